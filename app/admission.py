@@ -0,0 +1,226 @@
+import asyncio
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
+from .http_pool import http_pool
+from .models import AgentConfig, ConcurrencyConfig
+from .agent_store import UpstreamProfile
+from .logging_config import get_logger
+from .telemetry import span
+
+logger = get_logger(__name__)
+
+
+class OverloadedError(Exception):
+    """Petición rechazada por tener llena la cola (o agotada la espera) de un limitador"""
+
+    def __init__(self, scope: str, name: str, retry_after: int, reason: str):
+        super().__init__(f"{scope} '{name}' saturado: {reason}")
+        self.scope = scope
+        self.name = name
+        self.retry_after = retry_after
+
+
+class ConcurrencyLimiter:
+    """Semáforo con cola de espera acotada y orden FIFO.
+
+    Si hay hueco la petición entra sin esperar; si no, espera en cola hasta
+    queue_timeout. Con la cola llena se rechaza al momento, así una ráfaga se
+    traduce en 429 rápidos en lugar de peticiones acumulándose hasta el timeout.
+    Los límites se pueden cambiar en caliente (recargas de configuración).
+    """
+
+    def __init__(self, scope: str, name: str, max_concurrent: int, max_queue: int,
+                 queue_timeout: float, retry_after: int):
+        self.scope = scope
+        self.name = name
+        self.config: Optional[ConcurrencyConfig] = None  # Config del agente con la que se calcularon los límites
+        self.active = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.update(max_concurrent, max_queue, queue_timeout, retry_after)
+
+    def update(self, max_concurrent: int, max_queue: int, queue_timeout: float, retry_after: int):
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout = queue_timeout
+        self.retry_after = max(1, retry_after)
+        self._wake()
+
+    def _reject(self, reason: str) -> OverloadedError:
+        return OverloadedError(self.scope, self.name, self.retry_after, reason)
+
+    async def acquire(self):
+        if self.active < self.max_concurrent and not self._waiters:
+            self.active += 1
+            self.admitted += 1
+            return
+        if len(self._waiters) >= self.max_queue:
+            self.rejected += 1
+            raise self._reject("cola llena")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.queued += 1
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except BaseException as e:
+            if waiter.done() and not waiter.cancelled():
+                # El hueco ya se había cedido a esta petición: se devuelve
+                self.release()
+            else:
+                try:
+                    self._waiters.remove(waiter)
+                except ValueError:
+                    pass
+            if isinstance(e, asyncio.TimeoutError):
+                self.timeouts += 1
+                raise self._reject(f"más de {self.queue_timeout:g}s en cola")
+            raise
+        self.admitted += 1
+
+    def release(self):
+        self.active -= 1
+        self._wake()
+
+    def _wake(self):
+        """Cede los huecos libres a las peticiones en cola (el hueco pasa directamente al despertado)"""
+        while self._waiters and self.active < self.max_concurrent:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.active += 1
+                waiter.set_result(None)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "active": self.active,
+            "queue_depth": len(self._waiters),
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts
+        }
+
+
+class AdmissionTicket:
+    """Huecos ocupados por una petición; release() es idempotente"""
+
+    __slots__ = ("_limiters",)
+
+    def __init__(self, limiters: List[ConcurrencyLimiter]):
+        self._limiters = limiters
+
+    def release(self):
+        limiters, self._limiters = self._limiters, []
+        for limiter in reversed(limiters):
+            limiter.release()
+
+
+class AdmissionController:
+    """Control de admisión por agente y por host upstream.
+
+    Cada agente con 'concurrency' tiene su propio limitador; además, los hosts
+    upstream para los que algún agente fija upstream_max_concurrent comparten un
+    limitador entre todos sus agentes (si varios lo fijan se usa el máximo), así
+    una ráfaga en un agente no agota el upstream de los demás. La petición ocupa
+    primero el hueco del agente y después el del upstream.
+    """
+
+    def __init__(self):
+        self._agents: Dict[str, ConcurrencyLimiter] = {}
+        self._upstreams: Dict[str, ConcurrencyLimiter] = {}
+
+    def configure(self, profiles: Iterable[UpstreamProfile]):
+        """Recalcula los límites por host upstream (arranque y recargas de configuración)"""
+        limits: Dict[str, Tuple[int, int, float, int]] = {}
+        for profile in profiles:
+            config = profile.concurrency
+            if not config or not config.upstream_max_concurrent:
+                continue
+            for url in http_pool.upstream_urls(profile)[:1]:
+                host = http_pool._host_key(url)
+                new = (config.upstream_max_concurrent, config.upstream_max_queue,
+                       config.queue_timeout, config.retry_after)
+                current = limits.get(host)
+                limits[host] = new if current is None else tuple(map(max, current, new))
+        for host in list(self._upstreams):
+            if host not in limits:
+                # Las peticiones en curso conservan su referencia al limitador retirado
+                del self._upstreams[host]
+        for host, values in limits.items():
+            limiter = self._upstreams.get(host)
+            if limiter is None:
+                self._upstreams[host] = ConcurrencyLimiter("upstream", host, *values)
+            else:
+                limiter.update(*values)
+
+    def forget(self, agent_ids: Iterable[str]):
+        """Descarta los limitadores de agentes eliminados"""
+        for agent_id in agent_ids:
+            self._agents.pop(agent_id, None)
+
+    def _agent_limiter(self, agent: AgentConfig, config: ConcurrencyConfig) -> ConcurrencyLimiter:
+        entry = self._agents.get(agent.id)
+        values = (config.max_concurrent, config.max_queue, config.queue_timeout, config.retry_after)
+        if entry is None:
+            entry = self._agents[agent.id] = ConcurrencyLimiter("agent", agent.id, *values)
+            entry.config = config
+        elif entry.config is not config:
+            # Configuración recargada: se ajustan los límites sin perder la cuenta de las peticiones en curso
+            entry.update(*values)
+            entry.config = config
+        return entry
+
+    def _limiters(self, agent: AgentConfig) -> List[ConcurrencyLimiter]:
+        limiters = []
+        if agent.concurrency:
+            limiters.append(self._agent_limiter(agent, agent.concurrency))
+        urls = http_pool.agent_upstream_urls(agent)
+        if urls:
+            upstream = self._upstreams.get(http_pool._host_key(urls[0]))
+            if upstream is not None:
+                limiters.append(upstream)
+        return limiters
+
+    async def acquire(self, agent: AgentConfig) -> AdmissionTicket:
+        """Ocupa los huecos del agente y de su upstream o lanza OverloadedError"""
+        limiters = self._limiters(agent)
+        acquired: List[ConcurrencyLimiter] = []
+        ticket = AdmissionTicket(acquired)
+        if not limiters:
+            return ticket
+        try:
+            with span("admission"):
+                for limiter in limiters:
+                    await limiter.acquire()
+                    acquired.append(limiter)
+        except OverloadedError as e:
+            ticket.release()
+            logger.debug("[Admission] Petición a '%s' rechazada: %s", agent.id, e)
+            raise
+        except BaseException:
+            ticket.release()
+            raise
+        return ticket
+
+    def samples(self, *fields: str) -> Dict[Tuple[str, str], int]:
+        """Suma de los campos de stats() indicados por (ámbito, nombre), para Prometheus"""
+        result = {}
+        for limiter in (*self._agents.values(), *self._upstreams.values()):
+            stats = limiter.stats()
+            result[(limiter.scope, limiter.name)] = sum(stats[field] for field in fields)
+        return result
+
+    def stats(self) -> Dict[str, Dict[str, Dict[str, int]]]:
+        return {
+            "agents": {agent_id: limiter.stats() for agent_id, limiter in self._agents.items()},
+            "upstreams": {host: limiter.stats() for host, limiter in self._upstreams.items()}
+        }
+
+
+# Instancia global
+admission = AdmissionController()
@@ -0,0 +1,513 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import sqlite3
+import sys
+import threading
+from abc import ABC, abstractmethod
+from pathlib import Path
+from types import MappingProxyType
+from typing import Any, Dict, Iterator, List, Mapping, NamedTuple, Optional, Set, Tuple
+from .cache import LRUCache
+from .models import AgentConfig, AgentType, ConcurrencyConfig, HTTPPoolConfig
+from .request_template import OpenAIRequestTemplate
+from .tools import tool_engine
+from .logging_config import get_logger
+
+logger = get_logger(__name__)
+
+
+def agent_summary(agent: AgentConfig) -> Dict[str, Any]:
+    """Datos de un agente que se muestran en los listados"""
+    return {
+        "id": agent.id,
+        "name": agent.name,
+        "type": agent.type.value,
+        "enabled": agent.enabled
+    }
+
+
+def load_agent(data: Dict[str, Any]) -> AgentConfig:
+    """Valida la configuración de un agente, incluidos los handlers de sus tools locales"""
+    agent = AgentConfig(**data)
+    tool_engine.prepare(agent)
+    return agent
+
+
+class UpstreamProfile(NamedTuple):
+    """Lo que necesitan el pool HTTP y el control de admisión de un agente, sin su configuración completa.
+
+    El almacén SQLite lo guarda en una columna propia: configurar los pools y los
+    limitadores de todos los agentes no obliga a parsear cada configuración.
+    """
+    agent_id: str
+    type: AgentType
+    embeddings: bool  # Agente openai con índice: también llama al endpoint de embeddings
+    endpoint: Optional[str]  # Webhook de n8n o chat_endpoint del backend personalizado
+    http_pool: Optional[HTTPPoolConfig]
+    concurrency: Optional[ConcurrencyConfig]
+
+    @classmethod
+    def from_agent(cls, agent: AgentConfig) -> "UpstreamProfile":
+        openai_config = agent.openai_config
+        if agent.type == AgentType.N8N and agent.n8n_config:
+            endpoint = agent.n8n_config.webhook_url
+        else:
+            endpoint = agent.chat_endpoint if agent.type == AgentType.CUSTOM else None
+        return cls(
+            agent.id, agent.type,
+            bool(openai_config and (openai_config.pinecone_index or openai_config.local_index)),
+            endpoint, agent.http_pool, agent.concurrency
+        )
+
+    def to_json(self) -> str:
+        return json.dumps({
+            "type": self.type.value,
+            "embeddings": self.embeddings,
+            "endpoint": self.endpoint,
+            "http_pool": self.http_pool.model_dump() if self.http_pool else None,
+            "concurrency": self.concurrency.model_dump() if self.concurrency else None
+        }, ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, agent_id: str, text: str) -> "UpstreamProfile":
+        data = json.loads(text)
+        return cls(
+            agent_id, AgentType(data["type"]), data["embeddings"], data["endpoint"],
+            HTTPPoolConfig(**data["http_pool"]) if data["http_pool"] else None,
+            ConcurrencyConfig(**data["concurrency"]) if data["concurrency"] else None
+        )
+
+
+def compile_template(agent: AgentConfig) -> Optional[OpenAIRequestTemplate]:
+    if agent.type == AgentType.OPENAI and agent.openai_config:
+        return OpenAIRequestTemplate(agent)
+    return None
+
+
+class ConfigChanges:
+    """Resultado de una recarga: agentes nuevos o modificados y agentes eliminados"""
+
+    __slots__ = ("changed", "removed", "errors")
+
+    def __init__(self, changed: Set[str], removed: Set[str], errors: Dict[str, str]):
+        self.changed = changed
+        self.removed = removed
+        self.errors = errors
+
+    def __bool__(self) -> bool:
+        return bool(self.changed or self.removed)
+
+
+class AgentStore(ABC):
+    """Interfaz de los almacenes de configuración de agentes"""
+
+    name = "base"
+
+    @abstractmethod
+    def get(self, agent_id: str) -> Optional[AgentConfig]:
+        ...
+
+    async def get_async(self, agent_id: str) -> Optional[AgentConfig]:
+        """Como get(), para el event loop: un almacén con E/S la hace fuera de él"""
+        return self.get(agent_id)
+
+    @abstractmethod
+    def get_template(self, agent: AgentConfig) -> OpenAIRequestTemplate:
+        """Plantilla precompilada del agente (se compila al vuelo si el agente no es el almacenado)"""
+
+    @abstractmethod
+    def count(self) -> int:
+        ...
+
+    @abstractmethod
+    def list(self, offset: int = 0, limit: int = 100) -> List[Dict[str, Any]]:
+        """Resumen (id, nombre, tipo, enabled) de una página de agentes ordenados por id"""
+
+    @abstractmethod
+    def iter_agents(self) -> Iterator[AgentConfig]:
+        """Recorre todos los agentes (sin quedárselos en memoria si el almacén es perezoso)"""
+
+    @abstractmethod
+    def iter_upstreams(self) -> Iterator[UpstreamProfile]:
+        """Perfil de upstream de todos los agentes (para configurar pools y limitadores)"""
+
+    @abstractmethod
+    def reload(self) -> ConfigChanges:
+        ...
+
+    def stats(self) -> Dict[str, Any]:
+        return {"store": self.name}
+
+    def close(self):
+        pass
+
+
+class AgentSnapshot:
+    """Vista inmutable de los agentes cargados (y sus plantillas) en un momento dado.
+
+    Las peticiones leen siempre un snapshot completo: una recarga construye uno
+    nuevo y lo sustituye de una vez, así que nunca se ve un dict vacío o a medias.
+    """
+
+    __slots__ = ("agents", "templates", "summaries", "version")
+
+    def __init__(self, agents: Dict[str, AgentConfig], templates: Dict[str, OpenAIRequestTemplate], version: int):
+        self.agents: Mapping[str, AgentConfig] = MappingProxyType(agents)
+        self.templates: Mapping[str, OpenAIRequestTemplate] = MappingProxyType(templates)
+        self.summaries = tuple(agent_summary(agents[agent_id]) for agent_id in sorted(agents))
+        self.version = version
+
+
+class JsonAgentStore(AgentStore):
+    """Agentes en ficheros JSON de un directorio, todos en memoria (app/agents por defecto)"""
+
+    name = "json"
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self._snapshot = AgentSnapshot({}, {}, 0)
+        # Estado de cada fichero: (mtime_ns, tamaño, sha256) y el agente que define
+        self._file_stats: Dict[Path, Tuple[int, int, str]] = {}
+        self._file_agents: Dict[Path, AgentConfig] = {}
+        self._reload_lock = threading.Lock()
+        self.reload()
+
+    @property
+    def snapshot(self) -> AgentSnapshot:
+        return self._snapshot
+
+    def reload(self) -> ConfigChanges:
+        """Carga los agentes desde los archivos JSON, releyendo solo los que han cambiado.
+
+        Un fichero se vuelve a parsear si cambia su mtime o su tamaño y su contenido
+        (sha256) es distinto. Si un fichero modificado no es válido se mantiene la
+        versión anterior del agente. Al terminar se publica un snapshot nuevo.
+        """
+        with self._reload_lock:
+            if not self.directory.exists():
+                logger.warning("Directorio %s no existe", self.directory)
+                current_files = set()
+            else:
+                current_files = set(self.directory.glob("*.json"))
+
+            errors: Dict[str, str] = {}
+            file_agents = dict(self._file_agents)
+            for json_file in set(self._file_stats) - current_files:
+                del self._file_stats[json_file]
+                file_agents.pop(json_file, None)
+
+            for json_file in sorted(current_files):
+                try:
+                    stat = json_file.stat()
+                    previous = self._file_stats.get(json_file)
+                    if previous and previous[:2] == (stat.st_mtime_ns, stat.st_size):
+                        continue
+                    content = json_file.read_bytes()
+                    digest = hashlib.sha256(content).hexdigest()
+                    self._file_stats[json_file] = (stat.st_mtime_ns, stat.st_size, digest)
+                    if previous and previous[2] == digest:
+                        continue
+
+                    agent = load_agent(json.loads(content))
+                    file_agents[json_file] = agent
+                    logger.info("Agente cargado: %s (%s)", agent.id, agent.name)
+
+                except Exception as e:
+                    errors[json_file.name] = str(e)
+                    logger.error("Error cargando %s: %s", json_file, e)
+
+            old = self._snapshot
+            agents: Dict[str, AgentConfig] = {}
+            for json_file, agent in sorted(file_agents.items()):
+                if agent.id in agents:
+                    logger.warning("Agente '%s' duplicado en %s; se ignora", agent.id, json_file)
+                    continue
+                agents[agent.id] = agent
+
+            changed = {agent_id for agent_id, agent in agents.items() if old.agents.get(agent_id) is not agent}
+            removed = set(old.agents) - set(agents)
+            self._file_agents = file_agents
+            if changed or removed or not old.version:
+                templates = {}
+                for agent_id, agent in agents.items():
+                    template = old.templates.get(agent_id) if agent_id not in changed else None
+                    template = template or compile_template(agent)
+                    if template is not None:
+                        templates[agent_id] = template
+                # Sustitución atómica: las peticiones en curso conservan el snapshot anterior
+                self._snapshot = AgentSnapshot(agents, templates, old.version + 1)
+                for agent_id in removed:
+                    logger.info("Agente eliminado: %s", agent_id)
+            return ConfigChanges(changed, removed, errors)
+
+    def get(self, agent_id: str) -> Optional[AgentConfig]:
+        return self._snapshot.agents.get(agent_id)
+
+    def get_template(self, agent: AgentConfig) -> OpenAIRequestTemplate:
+        template = self._snapshot.templates.get(agent.id)
+        if template is None or template.agent is not agent:
+            template = OpenAIRequestTemplate(agent)
+        return template
+
+    def count(self) -> int:
+        return len(self._snapshot.agents)
+
+    def list(self, offset: int = 0, limit: int = 100) -> List[Dict[str, Any]]:
+        return list(self._snapshot.summaries[offset:offset + limit])
+
+    def iter_agents(self) -> Iterator[AgentConfig]:
+        return iter(list(self._snapshot.agents.values()))
+
+    def iter_upstreams(self) -> Iterator[UpstreamProfile]:
+        return iter([UpstreamProfile.from_agent(agent) for agent in self._snapshot.agents.values()])
+
+    def stats(self) -> Dict[str, Any]:
+        return {"store": self.name, "agents": self.count(), "version": self._snapshot.version}
+
+
+class SQLiteAgentStore(AgentStore):
+    """Agentes en una base de datos SQLite, cargados bajo demanda en una LRU acotada.
+
+    Solo se parsean los agentes que reciben tráfico, así que el arranque y la memoria
+    no crecen con el número de agentes. Cada importación incrementa una revisión
+    global; reload() consulta qué agentes cambiaron o se borraron desde la última
+    revisión vista y los saca de la LRU.
+    """
+
+    name = "sqlite"
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS agents (
+            id TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            type TEXT NOT NULL,
+            enabled INTEGER NOT NULL,
+            config TEXT NOT NULL,
+            sha256 TEXT NOT NULL,
+            revision INTEGER NOT NULL,
+            upstream TEXT
+        );
+        CREATE INDEX IF NOT EXISTS agents_revision ON agents (revision);
+        CREATE TABLE IF NOT EXISTS agent_deletions (
+            id TEXT NOT NULL,
+            revision INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS agent_deletions_revision ON agent_deletions (revision);
+        CREATE TABLE IF NOT EXISTS store_meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        );
+    """
+
+    def __init__(self, path: Path, cache_size: int = 1000):
+        self.path = path
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # Una sola conexión protegida por un lock: las lecturas son búsquedas por clave primaria
+        self._conn = sqlite3.connect(str(path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(self.SCHEMA)
+        self._lock = threading.Lock()
+        self._migrate()
+        self._cache = LRUCache(max_entries=max(1, cache_size))  # id -> (AgentConfig, plantilla)
+        self._revision = self._current_revision()
+        logger.info("[AgentStore] %d agentes en %s (revisión %d)", self.count(), path, self._revision)
+
+    def _migrate(self):
+        """Añade la columna 'upstream' a bases creadas antes de existir y la rellena (una sola vez)"""
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(agents)")}
+        if "upstream" not in columns:
+            self._conn.execute("ALTER TABLE agents ADD COLUMN upstream TEXT")
+        rows = self._conn.execute("SELECT id, config FROM agents WHERE upstream IS NULL").fetchall()
+        if not rows:
+            return
+        updates = []
+        for agent_id, config in rows:
+            try:
+                updates.append((UpstreamProfile.from_agent(AgentConfig(**json.loads(config))).to_json(), agent_id))
+            except Exception as e:
+                logger.error("[AgentStore] Configuración no válida para '%s': %s", agent_id, e)
+        with self._conn:
+            self._conn.executemany("UPDATE agents SET upstream = ? WHERE id = ?", updates)
+        logger.info("[AgentStore] Perfil de upstream calculado para %d agentes", len(updates))
+
+    def _current_revision(self) -> int:
+        row = self._conn.execute("SELECT value FROM store_meta WHERE key = 'revision'").fetchone()
+        return row[0] if row else 0
+
+    def _load(self, agent_id: str) -> Optional[Tuple[AgentConfig, Optional[OpenAIRequestTemplate]]]:
+        with self._lock:
+            entry = self._cache.get(agent_id)
+            if entry is not None:
+                return entry
+            row = self._conn.execute("SELECT config FROM agents WHERE id = ?", (agent_id,)).fetchone()
+        if row is None:
+            return None
+        try:
+            agent = load_agent(json.loads(row[0]))
+        except Exception as e:
+            logger.error("[AgentStore] Configuración no válida para '%s': %s", agent_id, e)
+            return None
+        entry = (agent, compile_template(agent))
+        with self._lock:
+            self._cache.set(agent_id, entry)
+        return entry
+
+    def _cached(self, agent_id: str) -> Optional[Tuple[AgentConfig, Optional[OpenAIRequestTemplate]]]:
+        with self._lock:
+            return self._cache.get(agent_id)
+
+    def get(self, agent_id: str) -> Optional[AgentConfig]:
+        entry = self._load(agent_id)
+        return entry[0] if entry else None
+
+    async def get_async(self, agent_id: str) -> Optional[AgentConfig]:
+        """Agente de la LRU o, si no está, leído y parseado en un hilo"""
+        entry = self._cached(agent_id) or await asyncio.to_thread(self._load, agent_id)
+        return entry[0] if entry else None
+
+    def get_template(self, agent: AgentConfig) -> OpenAIRequestTemplate:
+        # Solo la LRU: si el agente ya no está se compila su plantilla en lugar de volver a leerlo
+        entry = self._cached(agent.id)
+        if entry is None or entry[0] is not agent or entry[1] is None:
+            return OpenAIRequestTemplate(agent)
+        return entry[1]
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM agents").fetchone()[0]
+
+    def list(self, offset: int = 0, limit: int = 100) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, name, type, enabled FROM agents ORDER BY id LIMIT ? OFFSET ?", (limit, offset)
+            ).fetchall()
+        return [
+            {"id": agent_id, "name": name, "type": agent_type, "enabled": bool(enabled)}
+            for agent_id, name, agent_type, enabled in rows
+        ]
+
+    def iter_agents(self) -> Iterator[AgentConfig]:
+        with self._lock:
+            rows = self._conn.execute("SELECT id, config FROM agents ORDER BY id").fetchall()
+        for agent_id, config in rows:
+            try:
+                yield load_agent(json.loads(config))
+            except Exception as e:
+                logger.error("[AgentStore] Configuración no válida para '%s': %s", agent_id, e)
+
+    def iter_upstreams(self) -> Iterator[UpstreamProfile]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, upstream FROM agents WHERE upstream IS NOT NULL ORDER BY id"
+            ).fetchall()
+        for agent_id, upstream in rows:
+            yield UpstreamProfile.from_json(agent_id, upstream)
+
+    def reload(self) -> ConfigChanges:
+        with self._lock:
+            revision = self._current_revision()
+            if revision == self._revision:
+                return ConfigChanges(set(), set(), {})
+            changed = {row[0] for row in self._conn.execute(
+                "SELECT id FROM agents WHERE revision > ?", (self._revision,)
+            )}
+            removed = {row[0] for row in self._conn.execute(
+                "SELECT id FROM agent_deletions WHERE revision > ?", (self._revision,)
+            )} - changed
+            stale = changed | removed
+            self._cache.invalidate(lambda agent_id: agent_id in stale)
+            self._revision = revision
+        logger.info("[AgentStore] Revisión %d: %d agentes modificados, %d eliminados", revision, len(changed), len(removed))
+        return ConfigChanges(changed, removed, {})
+
+    def import_directory(self, directory: Path, prune: bool = False) -> Dict[str, Any]:
+        """Importa (o actualiza) los agentes de un directorio de JSON en una sola transacción.
+
+        Los ficheros no válidos se omiten. Con prune=True se borran los agentes que ya
+        no estén en el directorio. Los agentes sin cambios no incrementan la revisión.
+        """
+        agents: Dict[str, Tuple[AgentConfig, str]] = {}
+        errors: Dict[str, str] = {}
+        for json_file in sorted(directory.glob("*.json")):
+            try:
+                data = json.loads(json_file.read_text(encoding="utf-8"))
+                agent = load_agent(data)
+            except Exception as e:
+                errors[json_file.name] = str(e)
+                continue
+            agents[agent.id] = (agent, json.dumps(data, ensure_ascii=False, sort_keys=True))
+
+        with self._lock, self._conn:
+            revision = self._current_revision() + 1
+            existing = dict(self._conn.execute("SELECT id, sha256 FROM agents"))
+            upserts = []
+            for agent_id, (agent, config) in agents.items():
+                digest = hashlib.sha256(config.encode("utf-8")).hexdigest()
+                if existing.get(agent_id) != digest:
+                    upserts.append((
+                        agent_id, agent.name, agent.type.value, int(agent.enabled), config, digest, revision,
+                        UpstreamProfile.from_agent(agent).to_json()
+                    ))
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO agents (id, name, type, enabled, config, sha256, revision, upstream) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                upserts
+            )
+            deleted = sorted(set(existing) - set(agents)) if prune else []
+            self._conn.executemany("DELETE FROM agents WHERE id = ?", [(agent_id,) for agent_id in deleted])
+            self._conn.executemany(
+                "INSERT INTO agent_deletions (id, revision) VALUES (?, ?)",
+                [(agent_id, revision) for agent_id in deleted]
+            )
+            if upserts or deleted:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO store_meta (key, value) VALUES ('revision', ?)", (revision,)
+                )
+        return {
+            "imported": len(upserts),
+            "unchanged": len(agents) - len(upserts),
+            "deleted": len(deleted),
+            "errors": errors
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            cache = self._cache.stats()
+        return {"store": self.name, "agents": self.count(), "revision": self._revision, "cache": cache}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Importa los agentes de un directorio de JSON a la base de datos SQLite de agentes"
+    )
+    parser.add_argument("directory", nargs="?", default="app/agents", help="Directorio con los JSON de agentes")
+    parser.add_argument("--db", default="app/agents.db", help="Ruta de la base de datos SQLite")
+    parser.add_argument("--prune", action="store_true", help="Borra los agentes que no estén en el directorio")
+    args = parser.parse_args()
+
+    directory = Path(args.directory)
+    if not directory.is_dir():
+        sys.exit(f"Directorio {directory} no existe")
+    store = SQLiteAgentStore(Path(args.db))
+    try:
+        result = store.import_directory(directory, prune=args.prune)
+    finally:
+        store.close()
+    for name, error in result["errors"].items():
+        print(f"ERROR {name}: {error}")
+    print(
+        f"Importados {result['imported']}, sin cambios {result['unchanged']}, "
+        f"eliminados {result['deleted']}, con errores {len(result['errors'])}"
+    )
+    if result["errors"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
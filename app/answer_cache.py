@@ -0,0 +1,210 @@
+import hashlib
+import json
+from typing import Dict, Iterable, List, Optional, Tuple
+from .cache import LRUCache, normalize_text
+from .chat_service import ChatService
+from .models import AgentConfig, AgentType, ChatMessage, ChatResponse
+from .logging_config import get_logger
+
+# NumPy es opcional: sin él no se buscan casi-duplicados (solo coincidencias exactas)
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+logger = get_logger(__name__)
+
+# Respuestas que indican un fallo al leer la salida del modelo: nunca se cachean
+_ERROR_PREFIX = "Error al procesar respuesta"
+
+
+class _QuestionVectors:
+    """Embeddings normalizados de las preguntas cacheadas de un agente, en una matriz NumPy.
+
+    Buscar el casi-duplicado es un único producto matriz-vector. Las filas de las
+    preguntas que la LRU ya ha descartado se reutilizan al guardar nuevas.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = max(1, capacity)
+        self.matrix: Optional["np.ndarray"] = None
+        self.keys: List[Optional[str]] = []
+        self.rows: Dict[str, int] = {}
+        self.free: List[int] = []
+
+    def _reset(self, dimension: int):
+        self.matrix = np.zeros((self.capacity, dimension), dtype=np.float32)
+        self.keys = [None] * self.capacity
+        self.rows = {}
+        self.free = list(range(self.capacity - 1, -1, -1))
+
+    def remove(self, key: str):
+        row = self.rows.pop(key, None)
+        if row is not None:
+            self.keys[row] = None
+            self.matrix[row] = 0
+            self.free.append(row)
+
+    def add(self, key: str, vector: "np.ndarray", cache: LRUCache):
+        if self.matrix is None or self.matrix.shape[1] != len(vector):
+            self._reset(len(vector))  # Primer vector o deployment de embeddings distinto
+        row = self.rows.get(key)
+        if row is None:
+            if not self.free:
+                live = {cached_key for cached_key, _ in cache.items()}
+                for stale in [stale for stale in self.rows if stale not in live]:
+                    self.remove(stale)
+            if not self.free:
+                return
+            row = self.free.pop()
+            self.rows[key] = row
+            self.keys[row] = key
+        self.matrix[row] = vector
+
+    def candidates(self, vector: "np.ndarray", threshold: float) -> List[Tuple[float, str]]:
+        """(similitud, pregunta) por encima del umbral, de mayor a menor"""
+        if self.matrix is None or self.matrix.shape[1] != len(vector) or not self.rows:
+            return []
+        scores = self.matrix @ vector
+        rows = np.flatnonzero(scores >= threshold)
+        rows = rows[np.argsort(-scores[rows], kind="stable")]
+        return [(float(scores[row]), self.keys[row]) for row in rows if self.keys[row] is not None]
+
+
+class AnswerCache:
+    """Caché de respuestas finales (ya en HTML) a primeras preguntas de agentes openai.
+
+    Solo se usa si el agente lo activa en 'answer_cache', el mensaje no continúa una
+    conversación (sin previous_response_id) y la temperatura es baja. Cada agente
+    tiene su propia LRU asociada al hash de su configuración: si /reload-config
+    cambia el agente, sus respuestas cacheadas se descartan.
+    """
+
+    def __init__(self):
+        self._caches: Dict[str, Tuple[str, LRUCache]] = {}  # agent_id -> (hash de config, caché)
+        self._vectors: Dict[str, _QuestionVectors] = {}
+        self._hashes: Dict[str, str] = {}
+        self._near_hits: Dict[str, int] = {}
+
+    @staticmethod
+    def config_hash(agent: AgentConfig) -> str:
+        """Hash de la parte de la configuración que influye en la respuesta"""
+        relevant = agent.model_dump(
+            mode="json", include={"type", "openai_config", "n8n_config", "custom_config", "chat_endpoint"}
+        )
+        return hashlib.sha256(json.dumps(relevant, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+    @staticmethod
+    def is_eligible(agent: AgentConfig, message: ChatMessage) -> bool:
+        config = agent.answer_cache
+        return bool(
+            config and config.enabled
+            and agent.type == AgentType.OPENAI and agent.openai_config
+            and not message.previous_response_id
+            and agent.openai_config.temperature <= config.max_temperature
+        )
+
+    def sync(self, agents: Iterable[AgentConfig], removed: Iterable[str] = ()):
+        """Recalcula los hashes de los agentes recargados y descarta sus cachés si han cambiado"""
+        for agent in agents:
+            self._hashes[agent.id] = self.config_hash(agent)
+        for agent_id in removed:
+            self._hashes.pop(agent_id, None)
+        for agent_id, (digest, _) in list(self._caches.items()):
+            if self._hashes.get(agent_id) != digest:
+                del self._caches[agent_id]
+                self._vectors.pop(agent_id, None)
+                self._near_hits.pop(agent_id, None)
+                logger.info("[AnswerCache] Configuración de '%s' cambiada: caché de respuestas descartada", agent_id)
+
+    def tracks(self, agent_id: str) -> bool:
+        """Indica si hay un hash (y quizá una caché) para el agente"""
+        return agent_id in self._hashes
+
+    def _get_cache(self, agent: AgentConfig) -> LRUCache:
+        digest = self._hashes.get(agent.id)
+        if digest is None:
+            digest = self._hashes[agent.id] = self.config_hash(agent)
+        entry = self._caches.get(agent.id)
+        if entry is not None and entry[0] == digest:
+            return entry[1]
+        config = agent.answer_cache
+        cache = LRUCache(max_entries=config.max_entries, ttl_seconds=config.ttl_seconds)
+        self._caches[agent.id] = (digest, cache)
+        self._vectors[agent.id] = _QuestionVectors(config.max_entries)
+        return cache
+
+    @staticmethod
+    async def _embed(text: str) -> Optional["np.ndarray"]:
+        """Embedding normalizado (norma 1) del mensaje; usa la caché de embeddings"""
+        try:
+            vector = await ChatService._generate_embedding(normalize_text(text))
+        except Exception as e:
+            logger.warning("[AnswerCache] No se pudo generar el embedding para casi-duplicados: %s", e)
+            return None
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = float(np.linalg.norm(vector))
+        return vector / norm if norm else vector
+
+    @staticmethod
+    def _near_duplicates_enabled(agent: AgentConfig) -> bool:
+        return agent.answer_cache.similarity_threshold is not None and NUMPY_AVAILABLE
+
+    async def get(self, agent: AgentConfig, message: ChatMessage) -> Optional[ChatResponse]:
+        """Devuelve la respuesta cacheada (exacta o casi-duplicada) o None"""
+        cache = self._get_cache(agent)
+        vectors = self._vectors[agent.id]
+        data = cache.get(normalize_text(message.message))
+        if data is None and self._near_duplicates_enabled(agent) and len(cache):
+            vector = await self._embed(message.message)
+            if vector is not None:
+                for score, key in vectors.candidates(vector, agent.answer_cache.similarity_threshold):
+                    data = cache.get(key, count=False)
+                    if data is not None:
+                        self._near_hits[agent.id] = self._near_hits.get(agent.id, 0) + 1
+                        logger.info("[AnswerCache] Casi-duplicado (similitud %.3f) de '%s'", score, key)
+                        break
+                    vectors.remove(key)  # Ya caducada o descartada por la LRU
+
+        if data is None:
+            return None
+        return ChatResponse(**data, conversation_id=message.conversation_id)
+
+    async def set(self, agent: AgentConfig, message: ChatMessage, response: ChatResponse):
+        """Guarda la respuesta final en HTML de una primera pregunta"""
+        if not response.response or response.response.startswith(_ERROR_PREFIX):
+            return
+        vector = await self._embed(message.message) if self._near_duplicates_enabled(agent) else None
+        key = normalize_text(message.message)
+        cache = self._get_cache(agent)
+        # Sin response_id: encadenar el siguiente turno a la respuesta de otro visitante mezclaría sus conversaciones
+        cache.set(key, response.model_dump(exclude={"conversation_id", "response_id"}))
+        if vector is not None:
+            self._vectors[agent.id].add(key, vector, cache)
+
+    def stats(self) -> Dict:
+        agents = {}
+        for agent_id, (_, cache) in self._caches.items():
+            stats = cache.stats()
+            # Un casi-duplicado cuenta como fallo en la búsqueda exacta: se corrige aquí
+            near_hits = self._near_hits.get(agent_id, 0)
+            stats["hits"] += near_hits
+            stats["misses"] -= near_hits
+            stats["near_duplicate_hits"] = near_hits
+            lookups = stats["hits"] + stats["misses"]
+            stats["hit_ratio"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+            agents[agent_id] = stats
+        hits = sum(stats["hits"] for stats in agents.values())
+        misses = sum(stats["misses"] for stats in agents.values())
+        return {
+            "hits": hits,
+            "near_duplicate_hits": sum(self._near_hits.values()),
+            "misses": misses,
+            "hit_ratio": round(hits / (hits + misses), 4) if hits + misses else 0.0,
+            "agents": agents
+        }
+
+
+# Instancia global
+answer_cache = AnswerCache()
@@ -0,0 +1,136 @@
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+_WHITESPACE_RE = re.compile(r"\s+")
+_EDGE_PUNCTUATION = "¿?¡!.,;:\"'()[]"
+_MISSING = object()
+
+
+def normalize_text(text: str) -> str:
+    """Normaliza un texto para usarlo como clave de caché.
+
+    Unifica la forma Unicode, pasa a minúsculas, colapsa espacios y elimina la
+    puntuación de los extremos ("¿Horario  biblioteca?" -> "horario biblioteca").
+    """
+    text = unicodedata.normalize("NFC", text).lower()
+    text = _WHITESPACE_RE.sub(" ", text).strip()
+    return text.strip(_EDGE_PUNCTUATION).strip()
+
+
+class LRUCache:
+    """Caché LRU en memoria con TTL y límite de entradas y/o de bytes.
+
+    No es segura entre hilos: está pensada para usarse desde el event loop.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1000,
+        ttl_seconds: Optional[float] = None,
+        max_bytes: Optional[int] = None,
+        sizeof: Optional[Callable[[Any], int]] = None
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._sizeof = sizeof or (lambda value: 0)
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()  # clave -> (valor, expira, tamaño)
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _MISSING, count=False) is not _MISSING
+
+    def get(self, key: Hashable, default: Any = None, count: bool = True) -> Any:
+        """Devuelve el valor (y lo marca como usado) o default si no existe o ha caducado"""
+        entry = self._entries.get(key)
+        if entry is None:
+            if count:
+                self.misses += 1
+            return default
+
+        value, expires_at, _ = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            self._remove(key)
+            self.expirations += 1
+            if count:
+                self.misses += 1
+            return default
+
+        self._entries.move_to_end(key)
+        if count:
+            self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl_seconds: Optional[float] = None):
+        """Guarda un valor; ttl_seconds sustituye al TTL por defecto"""
+        if key in self._entries:
+            self._remove(key)
+
+        ttl = ttl_seconds if ttl_seconds is not None else self.ttl_seconds
+        expires_at = time.monotonic() + ttl if ttl else None
+        size = self._sizeof(value)
+        self._entries[key] = (value, expires_at, size)
+        self._bytes += size
+
+        while self._entries and (
+            len(self._entries) > self.max_entries
+            or (self.max_bytes is not None and self._bytes > self.max_bytes)
+        ):
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def delete(self, key: Hashable) -> bool:
+        if key in self._entries:
+            self._remove(key)
+            return True
+        return False
+
+    def invalidate(self, predicate: Callable[[Hashable], bool]) -> int:
+        """Elimina las entradas cuya clave cumple el predicado y devuelve cuántas"""
+        keys = [key for key in self._entries if predicate(key)]
+        for key in keys:
+            self._remove(key)
+        return len(keys)
+
+    def clear(self) -> int:
+        removed = len(self._entries)
+        self._entries.clear()
+        self._bytes = 0
+        return removed
+
+    def items(self):
+        """Entradas vigentes (de la más antigua a la más reciente) sin alterar el orden LRU"""
+        now = time.monotonic()
+        return [
+            (key, value)
+            for key, (value, expires_at, _) in list(self._entries.items())
+            if expires_at is None or expires_at > now
+        ]
+
+    def _remove(self, key: Hashable):
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations
+        }
+
@@ -1,49 +1,61 @@
-import httpx
-import re
-import os
 import json
-from typing import Dict, Any
-from pinecone import Pinecone
-from .models import AgentConfig, ChatMessage, ChatResponse
-from .config import get_openai_api_key
+import logging
+from typing import Dict, Any, AsyncIterator, List, Optional
+from .models import AgentConfig, ChatMessage, ChatResponse, ResilienceConfig
+from .config import (
+    config_manager,
+    get_openai_api_key,
+    AZURE_OPENAI_RESPONSES_URL,
+    AZURE_OPENAI_EMBEDDINGS_URL,
+    AZURE_OPENAI_EMBEDDINGS_DEPLOYMENT
+)
+from .resilience import resilience
+from .single_flight import single_flight
+from .cache import normalize_text
+from .pinecone_service import pinecone_service
+from .local_index import local_index_service
+from .embedding_cache import embedding_cache
+from .search_cache import search_cache
+from .tools import tool_registry, tool_engine
+from .conversation_store import conversation_store
+from .markdown_stream import MarkdownStreamConverter, convert_markdown_to_html
+from .logging_config import get_logger
+from .telemetry import span
+
+logger = get_logger(__name__)
 
 
 class ChatService:
     """Servicio para manejar comunicación con diferentes backends"""
     
     @staticmethod
-    def _get_pinecone_client():
-        """Obtiene cliente de Pinecone configurado"""
-        print(f"[Pinecone] Intentando obtener cliente...")
-        api_key = os.getenv('PINECONE_API_KEY')
-        if not api_key:
-            print(f"[Pinecone] ERROR: PINECONE_API_KEY no encontrada en variables de entorno")
-            raise ValueError("PINECONE_API_KEY no encontrada en variables de entorno")
-        print(f"[Pinecone] API key encontrada, creando cliente...")
-        try:
-            client = Pinecone(api_key=api_key)
-            print(f"[Pinecone] Cliente creado exitosamente")
-            return client
-        except Exception as e:
-            print(f"[Pinecone] ERROR al crear cliente: {str(e)}")
-            raise
+    async def _generate_embedding(text: str, resilience_config: Optional[ResilienceConfig] = None):
+        """Genera embedding usando Azure OpenAI (con caché por texto normalizado).
+        
+        Las peticiones simultáneas del mismo texto comparten una única llamada.
+        """
+        cached = embedding_cache.get(AZURE_OPENAI_EMBEDDINGS_DEPLOYMENT, text)
+        if cached is not None:
+            logger.debug("[Embeddings] Embedding recuperado de caché para: '%s'", text)
+            return cached
+        
+        key = embedding_cache.make_key(AZURE_OPENAI_EMBEDDINGS_DEPLOYMENT, text)
+        return await single_flight.do(
+            "embedding", key, lambda: ChatService._request_embedding(text, resilience_config)
+        )
     
     @staticmethod
-    async def _generate_embedding(text: str):
-        """Genera embedding usando Azure OpenAI"""
-        print(f"[Embeddings] Generando embedding para: '{text}'")
+    async def _request_embedding(text: str, resilience_config: Optional[ResilienceConfig] = None):
+        """Llama al deployment de embeddings de Azure OpenAI y guarda el resultado en caché"""
+        logger.info("[Embeddings] Generando embedding para: '%s'", text)
         
-        # Configuración del endpoint
-        endpoint = "https://oai-swe-chatbotllm-dev.openai.azure.com/openai/deployments/3large-swe-ChatbotLLM-dev/embeddings"
-        api_version = "2025-01-01-preview"
-        
-        # URL completa
-        url = f"{endpoint}?api-version={api_version}"
+        # URL completa del deployment de embeddings
+        url = AZURE_OPENAI_EMBEDDINGS_URL
         
         # Obtener API key
         api_key = get_openai_api_key()
         if not api_key:
-            print(f"[Embeddings] ERROR: No se pudo obtener API key de OpenAI")
+            logger.error("[Embeddings] ERROR: No se pudo obtener API key de OpenAI")
             raise ValueError("API key de OpenAI no encontrada")
         
         # Headers
@@ -57,57 +69,48 @@ class ChatService:
             "input": text
         }
         
-        print(f"[Embeddings] Enviando petición a Azure OpenAI...")
+        logger.debug("[Embeddings] Enviando petición a Azure OpenAI...")
         
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(url, headers=headers, json=body, timeout=30.0)
-                response.raise_for_status()
-                
-                data = response.json()
-                embedding = data['data'][0]['embedding']
-                
-                print(f"[Embeddings] Embedding generado exitosamente (dimensión: {len(embedding)})")
-                return embedding
-                
+            with span("embedding"):
+                response = await resilience.request(
+                    "embeddings", "embedding", resilience_config, "POST", url,
+                    idempotent=True, headers=headers, json=body
+                )
+            response.raise_for_status()
+            
+            data = response.json()
+            embedding = data['data'][0]['embedding']
+            
+            logger.debug("[Embeddings] Embedding generado exitosamente (dimensión: %d)", len(embedding))
+            embedding_cache.put(AZURE_OPENAI_EMBEDDINGS_DEPLOYMENT, text, embedding)
+            return embedding
+            
         except Exception as e:
-            print(f"[Embeddings] ERROR generando embedding: {type(e).__name__}: {str(e)}")
-            import traceback
-            print(f"[Embeddings] Traceback completo:")
-            traceback.print_exc()
+            logger.exception("[Embeddings] ERROR generando embedding: %s: %s", type(e).__name__, e)
             raise
     
     @staticmethod
-    async def _search_pinecone(index_name: str, query: str, k: int = 20):
+    async def _search_pinecone(index_name: str, query: str, k: int = 20,
+                               resilience_config: Optional[ResilienceConfig] = None):
         """Realiza búsqueda semántica en Pinecone"""
-        print(f"[Pinecone] Iniciando búsqueda en índice '{index_name}' con query: '{query}'")
+        logger.info("[Pinecone] Iniciando búsqueda en índice '%s' con query: '%s'", index_name, query)
         try:
             # Generar embedding del query
-            print(f"[Pinecone] Generando embedding para la query...")
-            query_vector = await ChatService._generate_embedding(query)
+            logger.debug("[Pinecone] Generando embedding para la query...")
+            query_vector = await ChatService._generate_embedding(query, resilience_config)
             
-            print(f"[Pinecone] Obteniendo cliente...")
-            pc = ChatService._get_pinecone_client()
+            logger.debug("[Pinecone] Ejecutando query con k=%d usando vector generado...", k)
+            # Realizar búsqueda usando el vector generado (en el pool de hilos de Pinecone)
+            with span("pinecone"):
+                results = await pinecone_service.query(index_name, query_vector, top_k=k)
             
-            print(f"[Pinecone] Conectando al índice '{index_name}'...")
-            index = pc.Index(index_name)
-            
-            print(f"[Pinecone] Ejecutando query con k={k} usando vector generado...")
-            # Realizar búsqueda usando el vector generado
-            results = index.query(
-                vector=query_vector,  # Usar el vector generado
-                top_k=k,
-                include_metadata=True,
-                include_values=False
-            )
-            
-            print(f"[Pinecone] Query ejecutada, procesando resultados...")
-            print(f"[Pinecone] Respuesta cruda de Pinecone: {results}")
+            logger.debug("[Pinecone] Respuesta cruda de Pinecone: %s", results)
             
             # Formatear resultados
             formatted_results = []
             matches = results.get('matches', [])
-            print(f"[Pinecone] Encontrados {len(matches)} matches")
+            logger.debug("[Pinecone] Encontrados %d matches", len(matches))
             
             for i, match in enumerate(matches):
                 result_data = {
@@ -116,220 +119,145 @@ class ChatService:
                     'metadata': match.get('metadata', {})
                 }
                 formatted_results.append(result_data)
-                print(f"[Pinecone] Match {i+1}: ID={result_data['id']}, Score={result_data['score']}")
+                logger.debug("[Pinecone] Match %d: ID=%s, Score=%s", i + 1, result_data['id'], result_data['score'])
             
-            print(f"[Pinecone] Búsqueda completada exitosamente con {len(formatted_results)} resultados")
+            logger.info("[Pinecone] Búsqueda completada exitosamente con %d resultados", len(formatted_results))
             return formatted_results
             
         except Exception as e:
-            print(f"[Pinecone] ERROR en búsqueda: {type(e).__name__}: {str(e)}")
-            import traceback
-            print(f"[Pinecone] Traceback completo:")
-            traceback.print_exc()
+            logger.exception("[Pinecone] ERROR en búsqueda: %s: %s", type(e).__name__, e)
             return []
     
     @staticmethod
-    async def _process_openai_response_with_tools(client, url, headers, body, agent):
-        """Procesa respuestas de OpenAI que pueden contener function_calls recursivamente"""
-        max_iterations = 5  # Evitar loops infinitos
-        iteration = 0
-        
-        while iteration < max_iterations:
-            iteration += 1
-            print(f"[OpenAI] Iteración {iteration} de procesamiento de tools...")
-            
-            response = await client.post(url, headers=headers, json=body, timeout=30.0)
-            response.raise_for_status()
-            data = response.json()
-            
-            # Verificar si hay nuevas function_calls
-            function_calls_to_process = []
-            for output_item in data.get("output", []):
-                if output_item.get("type") == "function_call":
-                    function_name = output_item.get("name", "unknown")
-                    print(f"[OpenAI] 🔧 LLM quiere usar la tool (iteración {iteration}): '{function_name}'")
-                    if function_name == "semantic_search":
-                        arguments = output_item.get("arguments", {})
-                        query = arguments.get("query", "")
-                        print(f"[OpenAI] 🔍 Query solicitada (iteración {iteration}): '{query}'")
-                    function_calls_to_process.append(output_item)
-            
-            # Si no hay más function_calls, retornar la respuesta final
-            if not function_calls_to_process:
-                print(f"[OpenAI] Procesamiento completado en {iteration} iteración(es)")
-                return data
-            
-            # Procesar las nuevas function_calls
-            print(f"[OpenAI] Procesando {len(function_calls_to_process)} function_calls en iteración {iteration}...")
-            
-            function_outputs = []
-            for function_call in function_calls_to_process:
-                call_id = function_call.get("call_id")
-                function_name = function_call.get("name")
-                arguments_str = function_call.get("arguments", "{}")
-                
-                if function_name == "semantic_search" and agent.openai_config.pinecone_index:
-                    print(f"[OpenAI-Recursivo] 📝 Arguments string: {arguments_str}")
-                    try:
-                        arguments = json.loads(arguments_str)
-                        query = arguments.get("query", "")
-                    except json.JSONDecodeError as e:
-                        print(f"[OpenAI-Recursivo] ❌ Error parseando arguments: {e}")
-                        query = ""
-                    print(f"[OpenAI-Recursivo] 🔍 Procesando semantic_search (iteración {iteration}) con query: '{query}'")
-                    print(f"[OpenAI-Recursivo] 📋 Call ID: {call_id}")
-                    print(f"[OpenAI-Recursivo] 🎯 Índice Pinecone: {agent.openai_config.pinecone_index}")
-                    
-                    # Realizar búsqueda en Pinecone
-                    print(f"[OpenAI-Recursivo] 🚀 Iniciando búsqueda en Pinecone (iteración {iteration})...")
-                    search_results = await ChatService._search_pinecone(
-                        agent.openai_config.pinecone_index, 
-                        query, 
-                        k=20
+    async def _search_local(directory: str, query: str, k: int = 20,
+                            resilience_config: Optional[ResilienceConfig] = None,
+                            hybrid_vector_weight: Optional[float] = None):
+        """Búsqueda semántica en un índice vectorial local (mismo formato que _search_pinecone).
+        
+        Con hybrid_vector_weight combina el coseno con BM25 sobre la metadata.
+        """
+        mode = "vector" if hybrid_vector_weight is None else "hybrid"
+        logger.info("[LocalIndex] Iniciando búsqueda (%s) en índice '%s' con query: '%s'", mode, directory, query)
+        try:
+            query_vector = await ChatService._generate_embedding(query, resilience_config)
+            with span("local_index"):
+                if hybrid_vector_weight is None:
+                    results = await local_index_service.query(directory, query_vector, top_k=k)
+                else:
+                    results = await local_index_service.query(
+                        directory, query_vector, top_k=k, query_text=query, vector_weight=hybrid_vector_weight
                     )
-                    
-                    # Extraer solo los metadatos de los resultados
-                    metadata_only = []
-                    for result in search_results:
-                        metadata = result.get('metadata', {})
-                        if metadata:  # Solo añadir si hay metadatos
-                            metadata_only.append(metadata)
-                    
-                    # Formatear resultados para OpenAI (solo metadatos)
-                    result_output = {
-                        "type": "function_call_output",
-                        "call_id": call_id,
-                        "output": json.dumps(metadata_only, ensure_ascii=False)
-                    }
-                    function_outputs.append(result_output)
+            logger.info("[LocalIndex] Búsqueda completada exitosamente con %d resultados", len(results))
+            return results
             
-            # Preparar para la siguiente iteración
-            if function_outputs:
-                current_response_id = data.get("id")
-                body = {
-                    "model": agent.openai_config.model,
-                    "input": function_outputs,
-                    "previous_response_id": current_response_id,
-                    "text": {
-                        "format": {
-                            "type": "text"
-                        }
-                    },
-                    "reasoning": {},
-                    "tools": body["tools"],
-                    "max_output_tokens": agent.openai_config.max_output_tokens,
-                    "store": True
-                }
-                
-                # Solo añadir temperature y top_p si el modelo NO es o4-mini
-                if agent.openai_config.model != "o4-mini":
-                    body["temperature"] = agent.openai_config.temperature
-                    body["top_p"] = agent.openai_config.top_p
-                print(f"[OpenAI] Preparando iteración {iteration + 1} con previous_response_id: {current_response_id}")
-            else:
-                # No hay function_outputs para procesar, retornar respuesta actual
-                return data
-        
-        print(f"[OpenAI] ADVERTENCIA: Se alcanzó el máximo de iteraciones ({max_iterations})")
-        return data
+        except Exception as e:
+            logger.exception("[LocalIndex] ERROR en búsqueda: %s: %s", type(e).__name__, e)
+            return []
     
     @staticmethod
-    def _convert_markdown_to_html(text: str) -> str:
-        """Convierte markdown básico a HTML"""
-        # 1. Convertir enlaces markdown [texto](url) a enlaces HTML
-        markdown_link_pattern = r'\[([^\]]+)\]\(([^)]+)\)'
-        
-        def replace_link(match):
-            link_text = match.group(1)
-            url = match.group(2)
-            # Asegurar que la URL tenga protocolo
-            if not url.startswith(('http://', 'https://')):
-                url = 'https://' + url
-            return f'<a href="{url}" target="_blank" rel="noopener noreferrer">{link_text}</a>'
-        
-        text = re.sub(markdown_link_pattern, replace_link, text)
-        
-        # 2. Convertir negritas **texto** a <strong>texto</strong>
-        text = re.sub(r'\*\*([^*]+)\*\*', r'<strong>\1</strong>', text)
-        
-        # 3. Convertir cursivas *texto* a <em>texto</em>
-        text = re.sub(r'\*([^*]+)\*', r'<em>\1</em>', text)
-        
-        # 4. Convertir listas con soporte para anidación
-        lines = text.split('\n')
-        processed_lines = []
-        list_stack = []  # Para manejar listas anidadas
-        
-        for line in lines:
-            # Detectar el nivel de indentación
-            stripped_line = line.strip()
-            indent_level = (len(line) - len(line.lstrip())) // 2  # Asumiendo 2 espacios por nivel
-            
-            if stripped_line.startswith('- '):
-                # Es un elemento de lista
-                list_item = stripped_line[2:].strip()  # Remover "- "
-                
-                # Manejar niveles de anidación
-                while len(list_stack) > indent_level:
-                    processed_lines.append('</ul>')
-                    list_stack.pop()
-                
-                if len(list_stack) == indent_level:
-                    # Mismo nivel, continúa la lista actual
-                    pass
-                else:
-                    # Nuevo nivel de anidación
-                    processed_lines.append('<ul>')
-                    list_stack.append(indent_level)
-                
-                processed_lines.append(f'<li>{list_item}</li>')
-                
-            elif stripped_line:
-                # No es un elemento de lista, cerrar todas las listas abiertas
-                while list_stack:
-                    processed_lines.append('</ul>')
-                    list_stack.pop()
-                
-                # Añadir línea normal si no está vacía
-                processed_lines.append(stripped_line)
-            else:
-                # Línea vacía - preservar como separador de párrafos
-                if not list_stack:  # Solo añadir líneas vacías fuera de listas
-                    processed_lines.append('')
-        
-        # Cerrar listas que quedaron abiertas
-        while list_stack:
-            processed_lines.append('</ul>')
-            list_stack.pop()
-        
-        # 5. Procesar líneas para crear HTML con saltos apropiados
-        result_parts = []
-        for i, line in enumerate(processed_lines):
-            if line == '':
-                # Línea vacía = separador de párrafos
-                if result_parts and not result_parts[-1].endswith('<br><br>'):
-                    result_parts.append('<br><br>')
-            elif line.startswith('<ul>') or line.startswith('</ul>') or line.startswith('<li>'):
-                # Elementos de lista - añadir sin <br>
-                result_parts.append(line)
-            else:
-                # Texto normal - añadir con <br> si no es el primer elemento
-                if result_parts and not result_parts[-1].endswith(('<ul>', '</ul>', '<br>', '<br><br>')):
-                    result_parts.append('<br>')
-                result_parts.append(line)
-        
-        text = ''.join(result_parts)
+    def _metadata_output(search_results: List[Dict[str, Any]], min_score: Optional[float] = None) -> str:
+        """Serializa para OpenAI solo los metadatos (no vacíos) de los resultados con score >= min_score"""
+        metadata_only = [
+            result['metadata'] for result in search_results
+            if result.get('metadata') and (min_score is None or result.get('score', 0) >= min_score)
+        ]
+        return json.dumps(metadata_only, ensure_ascii=False)
+    
+    @staticmethod
+    async def _semantic_search_output(agent: AgentConfig, query: str, k: Optional[int] = None) -> str:
+        """Devuelve el output serializado de semantic_search, usando la caché de resultados"""
+        openai_config = agent.openai_config
+        k = k or openai_config.search_k
+        if openai_config.local_index:
+            # El índice local responde en microsegundos: no pasa por la caché de resultados
+            search_results = await ChatService._search_local(
+                openai_config.local_index, query, k=k, resilience_config=agent.resilience,
+                hybrid_vector_weight=openai_config.hybrid_vector_weight if openai_config.search_mode == "hybrid" else None
+            )
+            return ChatService._metadata_output(search_results, openai_config.search_min_score)
         
-        # 6. Limpiar múltiples <br> seguidos y espacios
-        text = re.sub(r'(<br>\s*){3,}', '<br><br>', text)
-        text = re.sub(r'<br></ul>', '</ul>', text)  # Limpiar <br> antes de </ul>
-        text = re.sub(r'<ul><br>', '<ul>', text)    # Limpiar <br> después de <ul>
+        cache_key = search_cache.make_key(
+            openai_config.pinecone_index, openai_config.pinecone_index_version, query, k,
+            openai_config.search_min_score
+        )
+        cached = search_cache.get(cache_key)
+        if cached is not None:
+            logger.info("[Pinecone] Resultados recuperados de caché para: '%s'", query)
+            return cached
+        
+        # La misma búsqueda en curso para otra petición se espera en lugar de repetirla
+        return await single_flight.do(
+            "search", cache_key, lambda: ChatService._run_semantic_search(agent, query, k, cache_key)
+        )
+    
+    @staticmethod
+    async def _run_semantic_search(agent: AgentConfig, query: str, k: int, cache_key: tuple) -> str:
+        """Busca en Pinecone, serializa los metadatos y los guarda en la caché de resultados"""
+        openai_config = agent.openai_config
+        # Realizar búsqueda en Pinecone
+        search_results = await ChatService._search_pinecone(
+            openai_config.pinecone_index, query, k=k, resilience_config=agent.resilience
+        )
         
-        return text
+        # Formatear resultados para OpenAI (solo metadatos)
+        output = ChatService._metadata_output(search_results, openai_config.search_min_score)
+        # Una lista vacía puede venir de un error de Pinecone: no se cachea
+        if search_results:
+            search_cache.set(cache_key, output, ttl_seconds=openai_config.search_cache_ttl)
+        return output
+    
+    @staticmethod
+    def _get_function_calls(data, iteration=1):
+        """Devuelve los elementos function_call del output de una respuesta"""
+        function_calls = []
+        for output_item in data.get("output", []):
+            if output_item.get("type") == "function_call":
+                function_name = output_item.get("name", "unknown")
+                logger.info("[OpenAI] 🔧 LLM quiere usar la tool (iteración %d): '%s'", iteration, function_name)
+                function_calls.append(output_item)
+        return function_calls
+    
+    @staticmethod
+    def _convert_markdown_to_html(text: str) -> str:
+        """Convierte markdown básico a HTML (enlaces, negritas, cursivas y listas anidadas)"""
+        return convert_markdown_to_html(text)
+    
+    @staticmethod
+    def _coalescing_key(agent: AgentConfig, message: ChatMessage) -> Optional[tuple]:
+        """Clave single-flight de una primera pregunta a un agente openai, o None si no se puede agrupar.
+        
+        Solo se agrupan mensajes sin previous_response_id ni historial en el servidor:
+        la respuesta depende únicamente del agente y del texto normalizado.
+        """
+        if (agent.type != "openai" or not agent.openai_config or message.previous_response_id
+                or conversation_store.is_enabled(agent, message)):
+            return None
+        return (agent.id, normalize_text(message.message))
     
     @staticmethod
     async def send_message(agent: AgentConfig, message: ChatMessage) -> ChatResponse:
-        """Envía mensaje según el tipo de agente"""
+        """Envía mensaje según el tipo de agente (las primeras preguntas idénticas simultáneas se agrupan)"""
+        key = ChatService._coalescing_key(agent, message)
+        if key is None:
+            return await ChatService._dispatch_message(agent, message)
+        led = False
+
+        def dispatch():
+            nonlocal led
+            led = True
+            return ChatService._dispatch_message(agent, message)
+
+        response = await single_flight.do("message", key, dispatch)
+        # Cada petición recibe su propia copia con su conversation_id. El response_id es de la
+        # conversación que lanzó la llamada: las demás empiezan su propia cadena en el siguiente turno
+        update = {"conversation_id": message.conversation_id}
+        if not led:
+            update["response_id"] = None
+        return response.model_copy(update=update)
+    
+    @staticmethod
+    async def _dispatch_message(agent: AgentConfig, message: ChatMessage) -> ChatResponse:
+        """Envía el mensaje al backend del agente y convierte la respuesta a HTML"""
         if agent.type == "openai":
             response = await ChatService._send_to_openai(agent, message)
         elif agent.type == "n8n":
@@ -340,26 +268,80 @@ class ChatService:
             raise ValueError(f"Tipo de agente no soportado: {agent.type}")
         
         # Convertir enlaces markdown a HTML en la respuesta
-        response.response = ChatService._convert_markdown_to_html(response.response)
+        with span("markdown"):
+            response.response = ChatService._convert_markdown_to_html(response.response)
         
         return response
     
     @staticmethod
-    async def _send_to_openai(agent: AgentConfig, message: ChatMessage) -> ChatResponse:
-        """Envía mensaje a OpenAI Responses API"""
-        print(f"[OpenAI] 🚀 Iniciando _send_to_openai")
-        print(f"[OpenAI] 👤 Mensaje del usuario: '{message.message}'")
-        
-        if not agent.openai_config:
-            print(f"[OpenAI] ❌ ERROR: Configuración de OpenAI faltante")
-            raise ValueError("Configuración de OpenAI faltante")
-        
-        print(f"[OpenAI] ✅ Configuración de OpenAI encontrada")
-        print(f"[OpenAI] 🔧 Pinecone index configurado: {agent.openai_config.pinecone_index}")
-        
-        # Configuración para la nueva Responses API
-        url = "https://oai-swe-chatbotllm-dev.openai.azure.com/openai/v1/responses?api-version=preview"
+    async def stream_message(agent: AgentConfig, message: ChatMessage) -> AsyncIterator[Dict[str, Any]]:
+        """Envía mensaje y emite eventos a medida que llega la respuesta.
+        
+        Emite eventos {"type": "delta", "text": ..., "html": ...} con cada fragmento de
+        texto y el HTML que ya es definitivo, y un evento final {"type": "done", ...}
+        con la respuesta completa en HTML.
+        Los agentes que no soportan streaming emiten directamente el evento final.
+        Las primeras preguntas idénticas simultáneas comparten un único stream.
+        """
+        key = ChatService._coalescing_key(agent, message)
+        if key is None:
+            async for event in ChatService._stream_events(agent, message):
+                yield event
+            return
+        led = False
+
+        def produce():
+            nonlocal led
+            led = True
+            return ChatService._stream_events(agent, message)
+
+        events = single_flight.stream("message_stream", key, produce)
+        async for event in events:
+            if event["type"] == "done":
+                event = {**event, "conversation_id": message.conversation_id}
+                if not led:
+                    event["response_id"] = None
+            yield event
+    
+    @staticmethod
+    async def _stream_events(agent: AgentConfig, message: ChatMessage) -> AsyncIterator[Dict[str, Any]]:
+        """Eventos delta/done de un mensaje (sin agrupar)"""
+        if agent.type != "openai":
+            response = await ChatService.send_message(agent, message)
+            yield {"type": "done", **response.model_dump()}
+            return
+        
+        # El HTML se genera según llegan los tokens; cada delta lleva el fragmento ya definitivo
+        converter = MarkdownStreamConverter()
+        streamed_text = []
+        streamed_html = []
+        final_response = None
+        async for event in ChatService._stream_openai(agent, message):
+            if event["type"] == "delta":
+                html = converter.feed(event["text"])
+                streamed_text.append(event["text"])
+                streamed_html.append(html)
+                yield {"type": "delta", "text": event["text"], "html": html}
+            else:
+                final_response = event["response"]
         
+        with span("markdown"):
+            if final_response.response == "".join(streamed_text):
+                final_response.response = "".join(streamed_html) + converter.finish()
+            else:
+                # Hubo texto en iteraciones intermedias o la respuesta final no llegó por deltas
+                final_response.response = ChatService._convert_markdown_to_html(final_response.response)
+        yield {"type": "done", **final_response.model_dump()}
+    
+    @staticmethod
+    def _build_openai_request(agent: AgentConfig, message: ChatMessage, stream: bool = False,
+                              history: Optional[List[Dict[str, Any]]] = None):
+        """Construye url, headers y body (bytes JSON) de la petición inicial a la Responses API.
+        
+        El body sale de la plantilla precompilada del agente: solo se intercalan el
+        mensaje del usuario y, o bien el historial guardado en el servidor (history),
+        o bien el previous_response_id.
+        """
         # Usar API key desde variables de entorno o desde configuración
         api_key = agent.openai_config.api_key or get_openai_api_key()
         
@@ -368,248 +350,211 @@ class ChatService:
             "Content-Type": "application/json"
         }
         
-        # Estructura de body para Responses API
-        body = {
-            "model": agent.openai_config.model,
-            "input": [
-                {
-                    "role": "system",
-                    "content": [
-                        {
-                            "type": "input_text",
-                            "text": agent.openai_config.instructions
-                        }
-                    ]
-                },
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "input_text",
-                            "text": message.message
-                        }
-                    ]
-                }
-            ],
-            "text": {
-                "format": {
-                    "type": "text"
-                }
-            },
-            "reasoning": {},
-            "tools": agent.openai_config.tools,
-            "max_output_tokens": agent.openai_config.max_output_tokens,
-            "store": True
-        }
-        
-        # Solo añadir temperature y top_p si el modelo NO es o4-mini
-        if agent.openai_config.model != "o4-mini":
-            body["temperature"] = agent.openai_config.temperature
-            body["top_p"] = agent.openai_config.top_p
-            print(f"[OpenAI] Añadiendo temperature y top_p para modelo: {agent.openai_config.model}")
+        template = config_manager.get_request_template(agent)
+        if history:
+            body = template.render(message.message, stream=stream, history=history)
         else:
-            print(f"[OpenAI] Omitiendo temperature y top_p para modelo o4-mini")
-        
-        # Añadir tool de semantic_search si está configurado Pinecone
-        if agent.openai_config.pinecone_index:
-            semantic_search_tool = {
-                "type": "function",
-                "name": "semantic_search",
-                "description": "Permite realizar búsquedas semánticas en un índice de Pinecone",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "query": {
-                            "type": "string",
-                            "description": "Término de búsqueda"
-                        }
-                    },
-                    "required": ["query"]
-                }
-            }
-            # Añadir la tool al body (copiando las tools existentes + la nueva)
-            body["tools"] = body["tools"] + [semantic_search_tool]
-            print(f"[OpenAI] Añadiendo tool semantic_search para índice: {agent.openai_config.pinecone_index}")
-
-        # Añadir include si el agente tiene la tool file_search
-        if agent.openai_config.tools:
-            for tool in agent.openai_config.tools:
-                if isinstance(tool, dict) and tool.get("type") == "file_search":
-                    body["include"] = ["file_search_call.results"]
-                    print(f"[OpenAI] Añadiendo include file_search_call.results al body")
-                    break
-        
-        # Añadir previous_response_id si está disponible para mantener contexto
-        if message.previous_response_id:
-            body["previous_response_id"] = message.previous_response_id
-        
-        async with httpx.AsyncClient() as client:
-            response = await client.post(url, headers=headers, json=body, timeout=30.0)
-            response.raise_for_status()
-            
-            data = response.json()
+            body = template.render(message.message, message.previous_response_id, stream=stream)
+        return AZURE_OPENAI_RESPONSES_URL, headers, body, template
+    
+    @staticmethod
+    def _extract_output_text(data: Dict[str, Any]) -> str:
+        """Extrae el texto del mensaje del asistente del output de la Responses API"""
+        try:
+            chat_response = None
             
-            # Verificar si hay function_calls que necesiten procesarse
-            function_calls_to_process = []
+            # Buscar en output el elemento que sea un mensaje del asistente
             for output_item in data.get("output", []):
-                if output_item.get("type") == "function_call":
-                    function_name = output_item.get("name", "unknown")
-                    print(f"[OpenAI] 🔧 LLM quiere usar la tool: '{function_name}'")
-                    print(f"[OpenAI] Output item: {output_item}")
-                    if function_name == "semantic_search":
-                        arguments_str = output_item.get("arguments", "{}")
-                        print(f"[OpenAI] 📝 Arguments string: {arguments_str}")
-                        try:
-                            arguments = json.loads(arguments_str)
-                            query = arguments.get("query", "")
-                            print(f"[OpenAI] 🔍 Query solicitada: '{query}'")
-                        except json.JSONDecodeError as e:
-                            print(f"[OpenAI] ❌ Error parseando arguments: {e}")
-                            query = ""
-                    function_calls_to_process.append(output_item)
+                if output_item.get("type") == "message" and output_item.get("role") == "assistant":
+                    # Encontrar el contenido de texto
+                    content_items = output_item.get("content", [])
+                    for content_item in content_items:
+                        if content_item.get("type") == "output_text":
+                            chat_response = content_item.get("text", "")
+                            break
+                    if chat_response:
+                        break
             
-            # Si hay function_calls, procesarlas y hacer una segunda petición
-            if function_calls_to_process:
-                print(f"[OpenAI] ✅ Procesando {len(function_calls_to_process)} function_calls...")
+            # Si no se encontró respuesta, usar fallback
+            if not chat_response:
+                chat_response = f"Error al procesar respuesta: No se encontró mensaje del asistente"
+            else:
+                logger.debug("[OpenAI] Respuesta: %s", chat_response)
                 
-                # Procesar cada function_call
-                function_outputs = []
-                for function_call in function_calls_to_process:
-                    call_id = function_call.get("call_id")
-                    function_name = function_call.get("name")
-                    arguments_str = function_call.get("arguments", "{}")
-                    
-                    if function_name == "semantic_search" and agent.openai_config.pinecone_index:
-                        print(f"[OpenAI] 📝 Arguments string: {arguments_str}")
-                        try:
-                            arguments = json.loads(arguments_str)
-                            query = arguments.get("query", "")
-                        except json.JSONDecodeError as e:
-                            print(f"[OpenAI] ❌ Error parseando arguments: {e}")
-                            query = ""
-                        print(f"[OpenAI] 🔍 Procesando function_call semantic_search con query: '{query}'")
-                        print(f"[OpenAI] 📋 Call ID: {call_id}")
-                        print(f"[OpenAI] 🎯 Índice Pinecone: {agent.openai_config.pinecone_index}")
-                        
-                        # Realizar búsqueda en Pinecone
-                        print(f"[OpenAI] 🚀 Iniciando búsqueda en Pinecone...")
-                        search_results = await ChatService._search_pinecone(
-                            agent.openai_config.pinecone_index, 
-                            query, 
-                            k=20
-                        )
-                        
-                        # Extraer solo los metadatos de los resultados
-                        metadata_only = []
-                        for result in search_results:
-                            metadata = result.get('metadata', {})
-                            if metadata:  # Solo añadir si hay metadatos
-                                metadata_only.append(metadata)
-                        
-                        # Formatear resultados para OpenAI (solo metadatos)
-                        result_output = {
-                            "type": "function_call_output",
-                            "call_id": call_id,
-                            "output": json.dumps(metadata_only, ensure_ascii=False)
-                        }
-                        function_outputs.append(result_output)
+        except (KeyError, IndexError, TypeError) as e:
+            # Fallback en caso de estructura diferente
+            chat_response = f"Error al procesar respuesta: {str(e)}"
+        
+        return chat_response
+    
+    @staticmethod
+    def _log_file_search_calls(data: Dict[str, Any]):
+        """DEBUG: Registra información específica de file_search_call (solo con LOG_LEVEL=DEBUG)"""
+        if not logger.isEnabledFor(logging.DEBUG):
+            return
+        for output_item in data.get("output", []):
+            if output_item.get("type") == "file_search_call":
+                lines = ["[OpenAI] FILE SEARCH CALL:", "-" * 40]
                 
-                # Hacer segunda petición a OpenAI con los resultados de las function_calls
-                if function_outputs:
-                    # Extraer response_id de la primera petición
-                    first_response_id = data.get("id")
-                    
-                    # Crear nuevo body solo con los resultados de las function_calls
-                    second_body = {
-                        "model": agent.openai_config.model,
-                        "input": function_outputs,  # Solo los resultados, no concatenar
-                        "previous_response_id": first_response_id,  # ID de la primera respuesta
-                        "text": {
-                            "format": {
-                                "type": "text"
-                            }
-                        },
-                        "reasoning": {},
-                        "tools": body["tools"],  # Mantener las tools por si quiere usarlas otra vez
-                        "max_output_tokens": agent.openai_config.max_output_tokens,
-                        "store": True
-                    }
-                    
-                    # Solo añadir temperature y top_p si el modelo NO es o4-mini
-                    if agent.openai_config.model != "o4-mini":
-                        second_body["temperature"] = agent.openai_config.temperature
-                        second_body["top_p"] = agent.openai_config.top_p
-                    
-                    print(f"[OpenAI] Enviando segunda petición con resultados de function_calls...")
-                    print(f"[OpenAI] Usando previous_response_id: {first_response_id}")
-                    
-                    # Procesar peticiones adicionales en caso de que OpenAI quiera usar tools múltiples veces
-                    data = await ChatService._process_openai_response_with_tools(
-                        client, url, headers, second_body, agent
-                    )
-            
-            # DEBUG: Imprimir información específica de file_search_call
-            for output_item in data.get("output", []):
-                if output_item.get("type") == "file_search_call":
-                    print(f"\n[OpenAI] FILE SEARCH CALL:")
-                    print("-" * 40)
-                    
-                    # Imprimir queries utilizadas
-                    queries = output_item.get("queries", [])
-                    print(f"Queries utilizadas ({len(queries)}):")
-                    for i, query in enumerate(queries, 1):
-                        print(f"  {i}. {query}")
-                    
-                    # Imprimir resultados obtenidos
-                    results = output_item.get("results", [])
-                    print(f"\nResultados obtenidos ({len(results)}):")
-                    for i, result in enumerate(results, 1):
-                        filename = result.get("filename", "N/A")
-                        score = result.get("score", 0)
-                        full_text = result.get("text", "")
-                        print(f"  {i}. Archivo: {filename}")
-                        print(f"     Score: {score:.4f}")
-                        print(f"     Texto completo:")
-                        print(f"     {full_text}")
-                        print("-" * 20)
-                    
-                    print("-" * 40)
-            
-            # Extraer respuesta de la nueva estructura de Responses API
-            # Buscar el mensaje del asistente en el array output
-            try:
-                chat_response = None
+                # Queries utilizadas
+                queries = output_item.get("queries", [])
+                lines.append(f"Queries utilizadas ({len(queries)}):")
+                for i, query in enumerate(queries, 1):
+                    lines.append(f"  {i}. {query}")
                 
-                # Buscar en output el elemento que sea un mensaje del asistente
-                for output_item in data.get("output", []):
-                    if output_item.get("type") == "message" and output_item.get("role") == "assistant":
-                        # Encontrar el contenido de texto
-                        content_items = output_item.get("content", [])
-                        for content_item in content_items:
-                            if content_item.get("type") == "output_text":
-                                chat_response = content_item.get("text", "")
-                                break
-                        if chat_response:
-                            break
+                # Resultados obtenidos
+                results = output_item.get("results") or []
+                lines.append(f"Resultados obtenidos ({len(results)}):")
+                for i, result in enumerate(results, 1):
+                    lines.append(f"  {i}. Archivo: {result.get('filename', 'N/A')}")
+                    lines.append(f"     Score: {result.get('score', 0):.4f}")
+                    lines.append(f"     Texto completo:")
+                    lines.append(f"     {result.get('text', '')}")
+                    lines.append("-" * 20)
                 
-                # Si no se encontró respuesta, usar fallback
-                if not chat_response:
-                    chat_response = f"Error al procesar respuesta: No se encontró mensaje del asistente"
-                else:
-                    print(f"[OpenAI] Respuesta: {chat_response}")
-                    
-            except (KeyError, IndexError, TypeError) as e:
-                # Fallback en caso de estructura diferente
-                chat_response = f"Error al procesar respuesta: {str(e)}"
+                lines.append("-" * 40)
+                logger.debug("\n".join(lines))
+    
+    @staticmethod
+    async def _send_to_openai(agent: AgentConfig, message: ChatMessage) -> ChatResponse:
+        """Envía mensaje a OpenAI Responses API"""
+        logger.info("[OpenAI] 🚀 Iniciando _send_to_openai")
+        logger.debug("[OpenAI] 👤 Mensaje del usuario: '%s'", message.message)
+        
+        if not agent.openai_config:
+            logger.error("[OpenAI] ❌ ERROR: Configuración de OpenAI faltante")
+            raise ValueError("Configuración de OpenAI faltante")
+        
+        logger.debug("[OpenAI] 🔧 Pinecone index configurado: %s", agent.openai_config.pinecone_index)
+        
+        data: Dict[str, Any] = {}
+        text = ""
+        async for event in ChatService._run_openai_tool_loop(agent, message):
+            data, text = event["data"], event["text"]
+        
+        return ChatResponse(
+            response=text,
+            conversation_id=message.conversation_id,
+            response_id=data.get("id")  # Para futuras peticiones
+        )
+    
+    @staticmethod
+    async def _read_openai_stream(agent: AgentConfig, url, headers, body) -> AsyncIterator[Dict[str, Any]]:
+        """Envía una petición con stream=True y emite los eventos SSE de la Responses API"""
+        response = await resilience.request(
+            agent.id, "openai-stream", agent.resilience, "POST", url,
+            idempotent=False, headers=headers, content=body, stream=True
+        )
+        try:
+            if response.is_error:
+                await response.aread()
+                response.raise_for_status()
+            
+            async for line in response.aiter_lines():
+                # Solo interesan las líneas "data: {...}"; "event:" repite el campo type
+                if not line.startswith("data:"):
+                    continue
+                payload = line[5:].strip()
+                if not payload or payload == "[DONE]":
+                    continue
+                yield json.loads(payload)
+        finally:
+            await response.aclose()
+    
+    @staticmethod
+    async def _stream_openai(agent: AgentConfig, message: ChatMessage) -> AsyncIterator[Dict[str, Any]]:
+        """Envía mensaje a OpenAI Responses API en modo streaming.
+        
+        Reenvía los eventos response.output_text.delta según llegan y resuelve las
+        function_calls entre iteraciones. Termina con {"type": "final", "response": ChatResponse}.
+        """
+        if not agent.openai_config:
+            raise ValueError("Configuración de OpenAI faltante")
+        
+        async for event in ChatService._run_openai_tool_loop(agent, message, stream=True):
+            if event["type"] == "delta":
+                yield event
+                continue
+            data = event["data"]
+            yield {
+                "type": "final",
+                "response": ChatResponse(
+                    response=event["text"],
+                    conversation_id=message.conversation_id,
+                    response_id=data.get("id")
+                )
+            }
+    
+    @staticmethod
+    async def _run_openai_tool_loop(agent: AgentConfig, message: ChatMessage,
+                                    stream: bool = False) -> AsyncIterator[Dict[str, Any]]:
+        """Motor de tool calling común a las respuestas normales y en streaming.
+        
+        Envía la petición inicial y, mientras el modelo pida function_calls, las ejecuta
+        con el tool_engine y devuelve sus resultados en una nueva petición. En streaming
+        emite {"type": "delta", "text": ...} según llegan los tokens. Termina siempre con
+        {"type": "final", "data": <última respuesta de la Responses API>, "text": <texto final>}.
+        
+        Si el agente guarda el historial en el servidor (conversation_state), la petición
+        inicial lleva el resumen y la ventana de turnos en lugar de previous_response_id
+        y el turno se añade al historial al terminar.
+        """
+        state = None
+        history = None
+        if conversation_store.is_enabled(agent, message):
+            with span("conversation"):
+                state = await conversation_store.load(agent, message.conversation_id)
+            history = conversation_store.context_items(agent, state) if state else None
+            if state or not message.previous_response_id:
+                # Historial del servidor (o primer turno): no se encadena con la respuesta anterior
+                message = message.model_copy(update={"previous_response_id": None})
+        url, headers, body, template = ChatService._build_openai_request(agent, message, stream=stream, history=history)
+        
+        max_iterations = 6  # Petición inicial + hasta 5 rondas de tools (evitar loops infinitos)
+        data: Dict[str, Any] = {}
+        for iteration in range(1, max_iterations + 1):
+            if stream:
+                data = {}
+                # En streaming el span incluye el tiempo de reenviar los deltas al cliente
+                with span("openai", f"openai-{iteration}"):
+                    async for event in ChatService._read_openai_stream(agent, url, headers, body):
+                        event_type = event.get("type")
+                        if event_type == "response.output_text.delta":
+                            yield {"type": "delta", "text": event.get("delta", "")}
+                        elif event_type in ("response.completed", "response.incomplete"):
+                            data = event.get("response") or {}
+                        elif event_type in ("response.failed", "error"):
+                            error = event.get("response", {}).get("error") or event.get("message") or event
+                            raise ValueError(f"Error en streaming de OpenAI: {error}")
+            else:
+                with span("openai", f"openai-{iteration}"):
+                    response = await resilience.request(
+                        agent.id, "openai", agent.resilience, "POST", url,
+                        idempotent=False, headers=headers, content=body
+                    )
+                response.raise_for_status()
+                data = response.json()
             
-            # Extraer response_id para futuras peticiones
-            response_id = data.get("id")
+            # Si no hay function_calls, esta es la respuesta final
+            function_calls_to_process = ChatService._get_function_calls(data, iteration)
+            if not function_calls_to_process:
+                logger.info("[OpenAI] Procesamiento completado en %d iteración(es)", iteration)
+                break
             
-            return ChatResponse(
-                response=chat_response,
-                conversation_id=message.conversation_id,
-                response_id=response_id
-            )
+            logger.info("[OpenAI] ✅ Procesando %d function_calls en iteración %d...", len(function_calls_to_process), iteration)
+            function_outputs = await tool_engine.execute(function_calls_to_process, agent)
+            
+            # Devolver los resultados a OpenAI encadenando con la respuesta anterior
+            body = template.render_followup(function_outputs, data.get("id"), stream=stream)
+            logger.debug("[OpenAI] Preparando iteración %d con previous_response_id: %s", iteration + 1, data.get('id'))
+        else:
+            logger.warning("[OpenAI] ADVERTENCIA: Se alcanzó el máximo de iteraciones (%d)", max_iterations)
+        
+        ChatService._log_file_search_calls(data)
+        text = ChatService._extract_output_text(data)
+        if state is not None and not text.startswith("Error al procesar respuesta"):
+            conversation_store.record_turn(agent, message.conversation_id, state, message.message, text)
+        yield {"type": "final", "data": data, "text": text}
     
     @staticmethod
     async def _send_to_n8n(agent: AgentConfig, message: ChatMessage) -> ChatResponse:
@@ -628,48 +573,46 @@ class ChatService:
             "Content-Type": "application/json"
         }
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                agent.n8n_config.webhook_url, 
-                headers=headers, 
-                json=body, 
-                timeout=30.0
+        with span("n8n"):
+            response = await resilience.request(
+                agent.id, "n8n", agent.resilience, "POST", agent.n8n_config.webhook_url,
+                idempotent=False, headers=headers, json=body
             )
-            response.raise_for_status()
-            
-            data = response.json()
+        response.raise_for_status()
+        
+        data = response.json()
+        
+        # Extraer respuesta de n8n (soporta tanto array como objeto)
+        try:
+            chat_response = ""
             
-            # Extraer respuesta de n8n (soporta tanto array como objeto)
-            try:
-                chat_response = ""
-                
-                if isinstance(data, list) and len(data) > 0:
-                    # Formato array: [{"output": "mensaje"}]
-                    chat_response = data[0].get("output", "")
-                elif isinstance(data, dict):
-                    # Formato objeto: {"output": "mensaje"}
-                    chat_response = data.get("output", "")
-                    
-                    # Si no hay 'output', buscar otras claves comunes
-                    if not chat_response:
-                        possible_keys = ["response", "message", "text", "result"]
-                        for key in possible_keys:
-                            if key in data:
-                                chat_response = data[key]
-                                break
+            if isinstance(data, list) and len(data) > 0:
+                # Formato array: [{"output": "mensaje"}]
+                chat_response = data[0].get("output", "")
+            elif isinstance(data, dict):
+                # Formato objeto: {"output": "mensaje"}
+                chat_response = data.get("output", "")
                 
-                # Validar que se obtuvo una respuesta válida
+                # Si no hay 'output', buscar otras claves comunes
                 if not chat_response:
-                    chat_response = f"Error: No se encontró respuesta en los datos de n8n"
-                    
-            except (KeyError, IndexError, TypeError) as e:
-                chat_response = f"Error al procesar respuesta de n8n: {str(e)}"
+                    possible_keys = ["response", "message", "text", "result"]
+                    for key in possible_keys:
+                        if key in data:
+                            chat_response = data[key]
+                            break
             
-            return ChatResponse(
-                response=chat_response,
-                conversation_id=message.conversation_id
-            )
-    
+            # Validar que se obtuvo una respuesta válida
+            if not chat_response:
+                chat_response = f"Error: No se encontró respuesta en los datos de n8n"
+                
+        except (KeyError, IndexError, TypeError) as e:
+            chat_response = f"Error al procesar respuesta de n8n: {str(e)}"
+        
+        return ChatResponse(
+            response=chat_response,
+            conversation_id=message.conversation_id
+        )
+
     @staticmethod
     async def _send_to_custom(agent: AgentConfig, message: ChatMessage) -> ChatResponse:
         """Envía mensaje a backend personalizado"""
@@ -685,30 +628,28 @@ class ChatService:
             message
         )
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                agent.chat_endpoint, 
-                headers=headers, 
-                json=body, 
-                timeout=30.0
-            )
-            response.raise_for_status()
-            
-            data = response.json()
-            
-            # Extraer respuesta usando la ruta configurada
-            chat_response = ChatService._extract_response(
-                data, 
-                agent.custom_config.response_path
-            )
-            
-            conversation_id = data.get("conversation_id", message.conversation_id)
-            
-            return ChatResponse(
-                response=chat_response,
-                conversation_id=conversation_id
+        with span("custom"):
+            response = await resilience.request(
+                agent.id, "custom", agent.resilience, "POST", agent.chat_endpoint,
+                idempotent=False, headers=headers, json=body
             )
-    
+        response.raise_for_status()
+        
+        data = response.json()
+        
+        # Extraer respuesta usando la ruta configurada
+        chat_response = ChatService._extract_response(
+            data, 
+            agent.custom_config.response_path
+        )
+        
+        conversation_id = data.get("conversation_id", message.conversation_id)
+        
+        return ChatResponse(
+            response=chat_response,
+            conversation_id=conversation_id
+        )
+
     @staticmethod
     def _build_custom_body(structure: Dict[str, Any], message: ChatMessage) -> Dict[str, Any]:
         """Construye el body usando la estructura configurada"""
@@ -736,4 +677,15 @@ class ChatService:
             else:
                 return str(data)  # Fallback
         
-        return str(result) 
\ No newline at end of file
+        return str(result) 
+
+
+@tool_registry.register("semantic_search")
+async def _semantic_search_tool(arguments: Dict[str, Any], agent: AgentConfig) -> str:
+    """Tool integrada: búsqueda semántica en el índice (local o de Pinecone) del agente"""
+    index = agent.openai_config.local_index or agent.openai_config.pinecone_index
+    if not index:
+        raise LookupError("El agente no tiene pinecone_index ni local_index configurado")
+    query = arguments.get("query", "")
+    logger.debug("[OpenAI] 🎯 semantic_search en índice '%s' con query: '%s'", index, query)
+    return await ChatService._semantic_search_output(agent, query)
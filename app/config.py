@@ -1,13 +1,26 @@
 import os
-import json
-from typing import Dict, Optional
+from typing import Any, Dict, Iterator, List, Optional
 from pathlib import Path
 from dotenv import load_dotenv
 from .models import AgentConfig
+from .agent_store import AgentStore, ConfigChanges, JsonAgentStore, SQLiteAgentStore, UpstreamProfile
+from .request_template import OpenAIRequestTemplate
+from .logging_config import get_logger
 
 # Cargar variables de entorno
 load_dotenv()
 
+logger = get_logger(__name__)
+
+# Endpoints de Azure OpenAI (sobrescribibles por entorno)
+AZURE_OPENAI_ENDPOINT = os.getenv('AZURE_OPENAI_ENDPOINT', 'https://oai-swe-chatbotllm-dev.openai.azure.com').rstrip('/')
+AZURE_OPENAI_RESPONSES_URL = f"{AZURE_OPENAI_ENDPOINT}/openai/v1/responses?api-version=preview"
+AZURE_OPENAI_EMBEDDINGS_DEPLOYMENT = os.getenv('AZURE_OPENAI_EMBEDDINGS_DEPLOYMENT', '3large-swe-ChatbotLLM-dev')
+AZURE_OPENAI_EMBEDDINGS_URL = (
+    f"{AZURE_OPENAI_ENDPOINT}/openai/deployments/{AZURE_OPENAI_EMBEDDINGS_DEPLOYMENT}/embeddings"
+    f"?api-version=2025-01-01-preview"
+)
+
 def get_openai_api_key() -> Optional[str]:
     """Obtiene la API key de OpenAI desde variables de entorno"""
     api_key = os.getenv('OPENAI_API_KEY')
@@ -16,42 +29,58 @@ def get_openai_api_key() -> Optional[str]:
     return api_key
 
 class ConfigManager:
+    """Punto de acceso a la configuración de los agentes.
+
+    El almacén se elige con AGENT_STORE: 'json' (por defecto, todos los JSON de
+    AGENTS_DIR en memoria) o 'sqlite' (AGENT_STORE_DB, con los agentes cargados bajo
+    demanda en una LRU de AGENT_CACHE_SIZE entradas).
+    """
+
     def __init__(self):
-        self.agents_dir = Path("app/agents")
-        self.agents: Dict[str, AgentConfig] = {}
-        self.load_agents()
-    
-    def load_agents(self):
-        """Carga todos los agentes desde archivos JSON"""
-        self.agents.clear()
-        
-        if not self.agents_dir.exists():
-            print(f"Directorio {self.agents_dir} no existe")
-            return
-        
-        for json_file in self.agents_dir.glob("*.json"):
-            try:
-                with open(json_file, 'r', encoding='utf-8') as f:
-                    agent_data = json.load(f)
-                
-                agent = AgentConfig(**agent_data)
-                self.agents[agent.id] = agent
-                print(f"Agente cargado: {agent.id} ({agent.name})")
-                
-            except Exception as e:
-                print(f"Error cargando {json_file}: {e}")
+        self.store = self._create_store()
+    
+    @staticmethod
+    def _create_store() -> AgentStore:
+        store_type = os.getenv("AGENT_STORE", "json").lower()
+        if store_type == "sqlite":
+            return SQLiteAgentStore(
+                Path(os.getenv("AGENT_STORE_DB", "app/agents.db")),
+                cache_size=int(os.getenv("AGENT_CACHE_SIZE", "1000"))
+            )
+        if store_type != "json":
+            logger.warning("AGENT_STORE '%s' no soportado; se usa 'json'", store_type)
+        return JsonAgentStore(Path(os.getenv("AGENTS_DIR", "app/agents")))
     
     def get_agent(self, agent_id: str) -> Optional[AgentConfig]:
         """Obtiene un agente por su ID"""
-        return self.agents.get(agent_id)
+        return self.store.get(agent_id)
+    
+    async def get_agent_async(self, agent_id: str) -> Optional[AgentConfig]:
+        """Como get_agent, sin bloquear el event loop si el almacén tiene que leer y parsear el agente"""
+        return await self.store.get_async(agent_id)
+    
+    def get_request_template(self, agent: AgentConfig) -> OpenAIRequestTemplate:
+        """Plantilla precompilada del agente (se compila al vuelo si el agente no viene del almacén)"""
+        return self.store.get_template(agent)
+    
+    def count_agents(self) -> int:
+        return self.store.count()
+    
+    def list_agents(self, offset: int = 0, limit: int = 100) -> List[Dict[str, Any]]:
+        """Página del listado de agentes (id, nombre, tipo, enabled) ordenado por id"""
+        return self.store.list(offset, limit)
+    
+    def iter_agents(self) -> Iterator[AgentConfig]:
+        """Recorre todos los agentes; con el almacén SQLite los parsea sin cachearlos"""
+        return self.store.iter_agents()
     
-    def get_all_agents(self) -> Dict[str, AgentConfig]:
-        """Obtiene todos los agentes"""
-        return self.agents
+    def iter_upstreams(self) -> Iterator[UpstreamProfile]:
+        """Perfil de upstream de todos los agentes, sin parsear sus configuraciones con el almacén SQLite"""
+        return self.store.iter_upstreams()
     
-    def reload_agents(self):
-        """Recarga todos los agentes"""
-        self.load_agents()
+    def reload_agents(self) -> ConfigChanges:
+        """Recarga los agentes modificados"""
+        return self.store.reload()
 
 # Instancia global del gestor de configuración
 config_manager = ConfigManager() 
\ No newline at end of file
@@ -0,0 +1,276 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+from .cache import LRUCache
+from .config import get_openai_api_key, AZURE_OPENAI_RESPONSES_URL
+from .resilience import resilience
+from .models import AgentConfig, AgentType, ChatMessage
+from .request_template import encode_json
+from .shared_state import shared_store
+from .logging_config import get_logger
+from .telemetry import span
+
+logger = get_logger(__name__)
+
+SUMMARY_PREFIX = "Resumen de la conversación anterior con el usuario:\n"
+SUMMARY_INSTRUCTIONS = (
+    "Resume la conversación entre un usuario y un asistente en español, en pocas frases. "
+    "Conserva los datos concretos (nombres, fechas, preferencias, preguntas pendientes) "
+    "que el asistente necesite para seguir la conversación."
+)
+
+
+class ConversationState:
+    """Historial compacto de una conversación: resumen de los turnos antiguos y últimos turnos"""
+
+    __slots__ = ("summary", "turns", "summarized_turns", "summarizing")
+
+    def __init__(self, summary: str = "", turns: Optional[List[Tuple[str, str]]] = None, summarized_turns: int = 0):
+        self.summary = summary
+        self.turns: List[Tuple[str, str]] = turns or []  # (mensaje del usuario, respuesta del asistente)
+        self.summarized_turns = summarized_turns
+        self.summarizing = False
+
+    def __bool__(self) -> bool:
+        return bool(self.summary or self.turns)
+
+
+class ConversationStore:
+    """Historial de las conversaciones en el servidor, por agente y conversation_id.
+
+    Los agentes openai que activan 'conversation_state' no encadenan los turnos con
+    previous_response_id: cada petición envía el resumen y una ventana de los últimos
+    turnos (max_turns y max_context_chars), así que el coste por turno no crece con
+    la longitud de la conversación. Los turnos que salen de la ventana se descartan
+    o, con summarize=true, se resumen en segundo plano.
+
+    Las conversaciones activas se guardan en una LRU con TTL y se persisten en SQLite
+    (CONVERSATION_DB) desde un hilo propio, fuera del event loop. Con varios workers
+    los turnos de una conversación pueden llegar a procesos distintos: el estado se
+    lee siempre de SQLite, que comparten todos, y la LRU no se usa para leer.
+    """
+
+    def __init__(self):
+        self.ttl_seconds = float(os.getenv("CONVERSATION_TTL", str(7 * 86400))) or None
+        self._memory = LRUCache(
+            max_entries=int(os.getenv("CONVERSATION_CACHE_SIZE", "10000")),
+            ttl_seconds=self.ttl_seconds
+        )
+        self._db_path = os.getenv("CONVERSATION_DB", "app/conversations.db")
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._tasks = set()
+        self.summaries = 0
+        self.summary_errors = 0
+
+    @staticmethod
+    def is_enabled(agent: AgentConfig, message: ChatMessage) -> bool:
+        config = agent.conversation_state
+        return bool(
+            config and config.enabled and message.conversation_id
+            and agent.type == AgentType.OPENAI and agent.openai_config
+        )
+
+    def open(self):
+        """Abre la base de datos y purga las conversaciones caducadas (se llama en el arranque)"""
+        if not self._db_path or self._conn is not None:
+            return
+        try:
+            Path(self._db_path).parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self._db_path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS conversations (
+                    agent_id TEXT NOT NULL,
+                    conversation_id TEXT NOT NULL,
+                    summary TEXT NOT NULL,
+                    turns TEXT NOT NULL,
+                    summarized_turns INTEGER NOT NULL,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (agent_id, conversation_id)
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS conversations_updated_at ON conversations (updated_at)")
+            if self.ttl_seconds:
+                with conn:
+                    purged = conn.execute(
+                        "DELETE FROM conversations WHERE updated_at < ?", (time.time() - self.ttl_seconds,)
+                    ).rowcount
+                if purged:
+                    logger.info("[Conversations] %d conversaciones caducadas eliminadas", purged)
+        except sqlite3.Error as e:
+            logger.error("[Conversations] ERROR abriendo %s: %s; solo se usará memoria", self._db_path, e)
+            self._db_path = None
+            return
+        self._conn = conn
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="conversations")
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def _read(self, key: Tuple[str, str]) -> Optional[ConversationState]:
+        with self._lock:
+            if self._conn is None:
+                return None
+            row = self._conn.execute(
+                "SELECT summary, turns, summarized_turns, updated_at FROM conversations "
+                "WHERE agent_id = ? AND conversation_id = ?", key
+            ).fetchone()
+        if row is None or (self.ttl_seconds and row[3] + self.ttl_seconds <= time.time()):
+            return None
+        return ConversationState(row[0], [tuple(turn) for turn in json.loads(row[1])], row[2])
+
+    def _write(self, key: Tuple[str, str], summary: str, turns: List[Tuple[str, str]], summarized_turns: int):
+        try:
+            with self._lock:
+                if self._conn is None:
+                    return
+                with self._conn:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO conversations "
+                        "(agent_id, conversation_id, summary, turns, summarized_turns, updated_at) "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        (*key, summary, json.dumps(turns, ensure_ascii=False), summarized_turns, time.time())
+                    )
+        except sqlite3.Error as e:
+            logger.error("[Conversations] ERROR guardando %s: %s", key, e)
+
+    def _persist(self, key: Tuple[str, str], state: ConversationState):
+        if self._executor is not None:
+            # Se copia el estado: el hilo escritor no debe ver modificaciones posteriores
+            self._executor.submit(self._write, key, state.summary, list(state.turns), state.summarized_turns)
+
+    async def load(self, agent: AgentConfig, conversation_id: str) -> ConversationState:
+        """Estado de la conversación (memoria, si no SQLite, si no vacío)"""
+        key = (agent.id, conversation_id)
+        state = None if shared_store.enabled and self._conn is not None else self._memory.get(key)
+        if state is None:
+            state = await asyncio.to_thread(self._read, key) if self._conn is not None else None
+            state = state or ConversationState()
+            self._memory.set(key, state)
+        return state
+
+    @staticmethod
+    def context_items(agent: AgentConfig, state: ConversationState) -> List[Dict[str, Any]]:
+        """Items de input para la Responses API: resumen y ventana de los últimos turnos"""
+        config = agent.conversation_state
+        window: List[Tuple[str, str]] = []
+        chars = len(state.summary)
+        for user_text, assistant_text in reversed(state.turns[-config.max_turns:] if config.max_turns > 0 else []):
+            chars += len(user_text) + len(assistant_text)
+            if window and chars > config.max_context_chars:
+                break
+            window.append((user_text, assistant_text))
+
+        items: List[Dict[str, Any]] = []
+        if state.summary:
+            items.append({"role": "system", "content": [{"type": "input_text", "text": SUMMARY_PREFIX + state.summary}]})
+        for user_text, assistant_text in reversed(window):
+            items.append({"role": "user", "content": [{"type": "input_text", "text": user_text}]})
+            items.append({"role": "assistant", "content": [{"type": "output_text", "text": assistant_text}]})
+        return items
+
+    def record_turn(self, agent: AgentConfig, conversation_id: str, state: ConversationState,
+                    user_text: str, assistant_text: str):
+        """Añade un turno y aplica la política de ventana/resumen del agente"""
+        config = agent.conversation_state
+        state.turns.append((user_text, assistant_text))
+        overflow = len(state.turns) - max(config.max_turns, 0)
+        if overflow > 0 and not state.summarizing:
+            if config.summarize:
+                state.summarizing = True
+                task = asyncio.create_task(self._summarize(agent, conversation_id, state, overflow))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+            else:
+                del state.turns[:overflow]
+        key = (agent.id, conversation_id)
+        self._memory.set(key, state)
+        self._persist(key, state)
+
+    async def record_answer(self, agent: AgentConfig, message: ChatMessage, text: str):
+        """Añade al historial un turno respondido sin pasar por OpenAI (p.ej. desde la caché de respuestas)"""
+        if self.is_enabled(agent, message):
+            state = await self.load(agent, message.conversation_id)
+            self.record_turn(agent, message.conversation_id, state, message.message, text)
+
+    async def _summarize(self, agent: AgentConfig, conversation_id: str, state: ConversationState, count: int):
+        """Resume los turnos más antiguos junto con el resumen previo (petición sin store)"""
+        config = agent.conversation_state
+        turns = state.turns[:count]
+        transcript = "\n".join(f"Usuario: {user}\nAsistente: {assistant}" for user, assistant in turns)
+        if state.summary:
+            transcript = f"Resumen previo:\n{state.summary}\n\nNuevos turnos:\n{transcript}"
+        body = {
+            "model": config.summary_model or agent.openai_config.model,
+            "instructions": SUMMARY_INSTRUCTIONS,
+            "input": [{"role": "user", "content": [{"type": "input_text", "text": transcript}]}],
+            "max_output_tokens": config.summary_max_tokens,
+            "store": False
+        }
+        headers = {
+            "api-key": agent.openai_config.api_key or get_openai_api_key(),
+            "Content-Type": "application/json"
+        }
+        try:
+            with span("summary"):
+                response = await resilience.request(
+                    agent.id, "summary", agent.resilience, "POST", AZURE_OPENAI_RESPONSES_URL,
+                    idempotent=False, headers=headers, content=encode_json(body)
+                )
+            response.raise_for_status()
+            summary = "".join(
+                content.get("text", "")
+                for item in response.json().get("output", []) if item.get("type") == "message"
+                for content in item.get("content", []) if content.get("type") == "output_text"
+            ).strip()
+            if not summary:
+                raise ValueError("respuesta sin texto")
+        except Exception as e:
+            # Sin resumen se descartan los turnos igualmente para mantener acotado el contexto
+            self.summary_errors += 1
+            logger.warning("[Conversations] No se pudo resumir %s/%s: %s", agent.id, conversation_id, e)
+            summary = state.summary
+        else:
+            self.summaries += 1
+        if shared_store.enabled and self._conn is not None:
+            # Otro worker ha podido guardar turnos nuevos mientras se resumía: se parte de lo guardado
+            latest = await asyncio.to_thread(self._read, (agent.id, conversation_id))
+            if latest is not None and latest.turns[:len(turns)] == turns:
+                state.turns = latest.turns
+        state.summary = summary
+        state.summarized_turns += len(turns)
+        del state.turns[:len(turns)]
+        state.summarizing = False
+        self._persist((agent.id, conversation_id), state)
+
+    async def drain(self):
+        """Espera a los resúmenes en curso (se llama en el apagado)"""
+        if self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._memory.stats(),
+            "persistent": self._conn is not None,
+            "summaries": self.summaries,
+            "summary_errors": self.summary_errors,
+            "summaries_in_progress": len(self._tasks)
+        }
+
+
+# Instancia global
+conversation_store = ConversationStore()
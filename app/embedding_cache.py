@@ -0,0 +1,265 @@
+import asyncio
+import hashlib
+import json
+import mmap
+import os
+import threading
+import time
+from array import array
+from pathlib import Path
+from typing import Dict, List, Optional
+from .cache import LRUCache, normalize_text
+from .logging_config import get_logger
+from .shared_state import shared_store
+
+logger = get_logger(__name__)
+_FLOAT32_SIZE = array("f").itemsize
+
+
+class _DiskEmbeddingStore:
+    """Segundo nivel de la caché de embeddings en disco, persistente entre reinicios.
+
+    Los vectores se guardan como float32 consecutivos en 'vectors.f32' y se leen
+    a través de un mmap; 'index.jsonl' indica el offset, la dimensión y la fecha
+    de cada clave. Ambos ficheros son append-only y se compactan al arrancar.
+
+    Las lecturas (desde el event loop) no toman ningún lock ni tocan el disco: usan
+    el mmap vigente. El hilo que escribe crea un mmap nuevo tras cada append y solo
+    entonces publica la clave; el mmap anterior se libera cuando nadie lo usa.
+    """
+
+    def __init__(self, directory: Path, ttl_seconds: Optional[float], max_bytes: int):
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.vectors_file = directory / "vectors.f32"
+        self.index_file = directory / "index.jsonl"
+        self._index: Dict[str, tuple] = {}  # clave -> (offset, dimensión, timestamp)
+        self._mmap: Optional[mmap.mmap] = None
+        self._size = 0  # Bytes escritos en el fichero de vectores
+        self._lock = threading.Lock()  # Solo entre escritores
+        self._full_warned = False
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._load()
+
+    def _is_expired(self, created_at: float) -> bool:
+        return bool(self.ttl_seconds) and created_at + self.ttl_seconds <= time.time()
+
+    def _load(self):
+        if self.index_file.exists():
+            with open(self.index_file, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                        self._index[entry["key"]] = (entry["offset"], entry["dim"], entry["created_at"])
+                    except (ValueError, KeyError):
+                        continue  # Línea truncada por un apagado a mitad de escritura
+
+        size = self.vectors_file.stat().st_size if self.vectors_file.exists() else 0
+        # Descartar entradas que apunten fuera del fichero de vectores
+        self._index = {
+            key: entry for key, entry in self._index.items()
+            if entry[0] + entry[1] * _FLOAT32_SIZE <= size
+        }
+        live_bytes = sum(dim * _FLOAT32_SIZE for _, dim, _ in self._index.values())
+        if size and (size > self.max_bytes or size > 2 * live_bytes or any(
+            self._is_expired(created_at) for _, _, created_at in self._index.values()
+        )):
+            self._compact()
+        self._size = self.vectors_file.stat().st_size if self.vectors_file.exists() else 0
+        self._mmap = self._map()
+        logger.info("[EmbeddingCache] %d embeddings cargados desde %s", len(self._index), self.directory)
+
+    def _compact(self):
+        """Reescribe los ficheros solo con las entradas vigentes más recientes que caben en max_bytes"""
+        live = sorted(
+            ((key, entry) for key, entry in self._index.items() if not self._is_expired(entry[2])),
+            key=lambda item: item[1][2],
+            reverse=True
+        )
+        vectors_tmp = self.vectors_file.with_suffix(".tmp")
+        index_tmp = self.index_file.with_suffix(".tmp")
+        new_index = {}
+        offset = 0
+        with open(self.vectors_file, "rb") as source, open(vectors_tmp, "wb") as vectors_out, \
+                open(index_tmp, "w", encoding="utf-8") as index_out:
+            for key, (old_offset, dim, created_at) in live:
+                length = dim * _FLOAT32_SIZE
+                if offset + length > self.max_bytes:
+                    break
+                source.seek(old_offset)
+                vectors_out.write(source.read(length))
+                new_index[key] = (offset, dim, created_at)
+                index_out.write(json.dumps({"key": key, "offset": offset, "dim": dim, "created_at": created_at}) + "\n")
+                offset += length
+        os.replace(vectors_tmp, self.vectors_file)
+        os.replace(index_tmp, self.index_file)
+        self._index = new_index
+
+    def _map(self) -> Optional[mmap.mmap]:
+        if not self._size:
+            return None
+        with open(self.vectors_file, "rb") as f:
+            return mmap.mmap(f.fileno(), self._size, access=mmap.ACCESS_READ)
+
+    def get(self, key: str) -> Optional[array]:
+        entry = self._index.get(key)
+        if entry is None:
+            return None
+        offset, dim, created_at = entry
+        if self._is_expired(created_at):
+            return None
+
+        end = offset + dim * _FLOAT32_SIZE
+        mapped = self._mmap
+        if mapped is None or len(mapped) < end:
+            return None
+        vector = array("f")
+        vector.frombytes(mapped[offset:end])
+        return vector
+
+    def append(self, key: str, vector: array):
+        """Añade un vector al final de los ficheros (se ejecuta fuera del event loop)"""
+        with self._lock:
+            offset = self._size
+            if offset + len(vector) * _FLOAT32_SIZE > self.max_bytes:
+                if not self._full_warned:
+                    logger.warning("[EmbeddingCache] Caché en disco llena (%d bytes); se compactará al reiniciar", self.max_bytes)
+                    self._full_warned = True
+                return
+            created_at = time.time()
+            with open(self.vectors_file, "ab") as f:
+                vector.tofile(f)
+            with open(self.index_file, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"key": key, "offset": offset, "dim": len(vector), "created_at": created_at}) + "\n")
+            self._size = offset + len(vector) * _FLOAT32_SIZE
+            # Primero el mmap que cubre el vector y después la clave que apunta a él
+            self._mmap = self._map()
+            self._index[key] = (offset, len(vector), created_at)
+
+    def close(self):
+        with self._lock:
+            self._mmap = None  # Se cierra al liberarse la última referencia
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+
+class EmbeddingCache:
+    """Caché de embeddings por (deployment, texto normalizado).
+
+    Nivel 1: LRU en memoria acotada en bytes y con TTL.
+    Nivel 2 (opcional, EMBEDDING_CACHE_DIR): vectores float32 en disco leídos vía mmap.
+    Con varios workers el nivel 2 es el almacén compartido (shared_state) en lugar del
+    disco, cuyos ficheros append-only no admiten escritores concurrentes.
+    """
+
+    def __init__(self):
+        self.ttl_seconds = float(os.getenv("EMBEDDING_CACHE_TTL", "86400")) or None
+        max_bytes = int(float(os.getenv("EMBEDDING_CACHE_MAX_MB", "64")) * 1024 * 1024)
+        self._memory = LRUCache(
+            max_entries=max(1, max_bytes // 1024),
+            ttl_seconds=self.ttl_seconds,
+            max_bytes=max_bytes,
+            sizeof=lambda vector: len(vector) * _FLOAT32_SIZE
+        )
+        self._disk: Optional[_DiskEmbeddingStore] = None
+        self._disk_dir = os.getenv("EMBEDDING_CACHE_DIR")
+        if self._disk_dir and shared_store.enabled:
+            logger.warning("[EmbeddingCache] Varios workers: se ignora EMBEDDING_CACHE_DIR y se usa la caché compartida")
+            self._disk_dir = None
+        self._disk_max_bytes = int(float(os.getenv("EMBEDDING_CACHE_DISK_MAX_MB", "512")) * 1024 * 1024)
+        self.disk_hits = 0
+        self.shared_hits = 0
+
+    @staticmethod
+    def make_key(deployment: str, text: str) -> str:
+        return hashlib.sha256(f"{deployment}\x00{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+    def _get_disk(self) -> Optional[_DiskEmbeddingStore]:
+        if self._disk is None and self._disk_dir:
+            try:
+                self._disk = _DiskEmbeddingStore(Path(self._disk_dir), self.ttl_seconds, self._disk_max_bytes)
+            except OSError as e:
+                logger.error("[EmbeddingCache] ERROR abriendo caché en disco: %s; se usará solo memoria", e)
+                self._disk_dir = None
+        return self._disk
+
+    def get(self, deployment: str, text: str) -> Optional[List[float]]:
+        """Devuelve el embedding cacheado o None"""
+        key = self.make_key(deployment, text)
+        vector = self._memory.get(key)
+        if vector is None and shared_store.enabled:
+            value = shared_store.get("embeddings", key)
+            if value is None:
+                return None
+            vector = array("f")
+            vector.frombytes(value)
+            self.shared_hits += 1
+            self._memory.set(key, vector)
+        elif vector is None:
+            disk = self._get_disk()
+            vector = disk.get(key) if disk else None
+            if vector is None:
+                return None
+            self.disk_hits += 1
+            self._memory.set(key, vector)
+        return vector.tolist()
+
+    def put(self, deployment: str, text: str, embedding: List[float]):
+        """Guarda un embedding en memoria y, en segundo plano, en disco o en la caché compartida"""
+        key = self.make_key(deployment, text)
+        vector = array("f", embedding)
+        self._memory.set(key, vector)
+        if shared_store.enabled:
+            shared_store.set_soon("embeddings", key, vector.tobytes(), self.ttl_seconds)
+
+        disk = self._get_disk()
+        if disk is not None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                disk.append(key, vector)
+            else:
+                loop.run_in_executor(None, self._append_safely, disk, key, vector)
+
+    @staticmethod
+    def _append_safely(disk: _DiskEmbeddingStore, key: str, vector: array):
+        try:
+            disk.append(key, vector)
+        except OSError as e:
+            logger.error("[EmbeddingCache] ERROR escribiendo en disco: %s", e)
+
+    def open(self):
+        """Carga la caché en disco (se llama en el arranque para no hacerlo en la primera petición)"""
+        self._get_disk()
+
+    def close(self):
+        if self._disk is not None:
+            self._disk.close()
+
+    def stats(self) -> Dict:
+        memory = self._memory.stats()
+        # Un acierto en disco (o en la caché compartida) es un fallo en memoria: se descuenta de los fallos
+        hits = memory["hits"] + self.disk_hits + self.shared_hits
+        misses = memory["misses"] - self.disk_hits - self.shared_hits
+        return {
+            "entries": memory["entries"],
+            "bytes": memory["bytes"],
+            "hits": hits,
+            "memory_hits": memory["hits"],
+            "disk_hits": self.disk_hits,
+            "shared_hits": self.shared_hits,
+            "misses": misses,
+            "hit_ratio": round(hits / (hits + misses), 4) if hits + misses else 0.0,
+            "evictions": memory["evictions"],
+            "expirations": memory["expirations"],
+            "disk_entries": len(self._disk) if self._disk else 0,
+            "disk_enabled": bool(self._disk_dir),
+            "shared": shared_store.enabled
+        }
+
+
+# Instancia global
+embedding_cache = EmbeddingCache()
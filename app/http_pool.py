@@ -0,0 +1,186 @@
+import asyncio
+import httpx
+from typing import Dict, Iterable, List, Set
+from urllib.parse import urlsplit
+from .config import AZURE_OPENAI_RESPONSES_URL, AZURE_OPENAI_EMBEDDINGS_URL
+from .models import AgentConfig, AgentType, HTTPPoolConfig
+from .agent_store import UpstreamProfile
+from .logging_config import get_logger
+
+logger = get_logger(__name__)
+
+# Segundos que se mantiene abierto un cliente sustituido para que terminen sus peticiones en curso
+RETIRED_CLIENT_GRACE_SECONDS = 60.0
+
+# HTTP/2 requiere el paquete opcional 'h2' (httpx[http2])
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+class _ConnectionTracer:
+    """Callback de trace de httpcore que detecta si una petición abrió una conexión nueva"""
+
+    __slots__ = ("opened_connection",)
+
+    def __init__(self):
+        self.opened_connection = False
+
+    async def __call__(self, event_name: str, info: dict):
+        if event_name == "connection.connect_tcp.complete":
+            self.opened_connection = True
+
+
+class HTTPClientPool:
+    """Clientes httpx compartidos por host upstream durante toda la vida de la aplicación"""
+
+    def __init__(self):
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        self._limits: Dict[str, HTTPPoolConfig] = {}
+        self._stats: Dict[str, Dict[str, int]] = {}
+        self._retiring: Set[asyncio.Task] = set()
+
+    @staticmethod
+    def _host_key(url: str) -> str:
+        """Normaliza una URL a 'esquema://host[:puerto]'"""
+        parts = urlsplit(url)
+        return f"{parts.scheme}://{parts.netloc}".lower()
+
+    @staticmethod
+    def upstream_urls(profile: UpstreamProfile) -> List[str]:
+        """URLs de los upstreams a los que habla un agente"""
+        if profile.type == AgentType.OPENAI:
+            urls = [AZURE_OPENAI_RESPONSES_URL]
+            if profile.embeddings:
+                urls.append(AZURE_OPENAI_EMBEDDINGS_URL)
+            return urls
+        return [profile.endpoint] if profile.endpoint else []
+
+    @staticmethod
+    def agent_upstream_urls(agent: AgentConfig) -> List[str]:
+        return HTTPClientPool.upstream_urls(UpstreamProfile.from_agent(agent))
+
+    def configure(self, profiles: Iterable[UpstreamProfile]) -> Set[str]:
+        """Calcula los límites por host a partir de los perfiles de upstream de los agentes.
+
+        Si varios agentes comparten host se usa el máximo de cada límite. Los clientes
+        ya creados conservan sus límites; solo afectan a los que se creen después.
+        Devuelve los hosts cuyos límites han cambiado.
+        """
+        limits: Dict[str, HTTPPoolConfig] = {}
+        for profile in profiles:
+            pool_config = profile.http_pool or HTTPPoolConfig()
+            for url in self.upstream_urls(profile):
+                host = self._host_key(url)
+                current = limits.get(host)
+                if current is None:
+                    limits[host] = pool_config
+                else:
+                    limits[host] = HTTPPoolConfig(
+                        max_connections=max(current.max_connections, pool_config.max_connections),
+                        max_keepalive_connections=max(
+                            current.max_keepalive_connections, pool_config.max_keepalive_connections
+                        ),
+                        keepalive_expiry=max(current.keepalive_expiry, pool_config.keepalive_expiry),
+                        http2=current.http2 and pool_config.http2
+                    )
+        changed = {
+            host for host in set(limits) | set(self._limits)
+            if limits.get(host) != self._limits.get(host)
+        }
+        self._limits = limits
+        return changed
+
+    async def reconfigure(self, profiles: Iterable[UpstreamProfile]):
+        """Aplica una recarga de configuración: los hosts con límites nuevos estrenan cliente.
+
+        El cliente anterior deja de repartirse y se cierra pasado un margen, así que
+        las peticiones que lo estén usando terminan con normalidad.
+        """
+        for host in self.configure(profiles):
+            client = self._clients.pop(host, None)
+            if client is not None:
+                logger.info("[HTTPPool] Límites de %s cambiados: se crea un cliente nuevo", host)
+                task = asyncio.create_task(self._close_later(client))
+                self._retiring.add(task)
+                task.add_done_callback(self._retiring.discard)
+
+    @staticmethod
+    async def _close_later(client: httpx.AsyncClient):
+        try:
+            await asyncio.sleep(RETIRED_CLIENT_GRACE_SECONDS)
+        finally:
+            await client.aclose()
+
+    async def start(self, profiles: Iterable[UpstreamProfile]):
+        """Crea los clientes de todos los upstreams conocidos (se llama en el arranque)"""
+        self.configure(profiles)
+        for host in self._limits:
+            if host not in self._clients:
+                self._create_client(host)
+        logger.info("[HTTPPool] %d clientes creados (HTTP/2 disponible: %s)", len(self._clients), HTTP2_AVAILABLE)
+
+    async def close(self):
+        """Cierra todos los clientes (se llama en el apagado)"""
+        clients = list(self._clients.values())
+        self._clients.clear()
+        for client in clients:
+            await client.aclose()
+        # Los clientes sustituidos se cierran ya sin esperar al margen
+        retiring = list(self._retiring)
+        for task in retiring:
+            task.cancel()
+        await asyncio.gather(*retiring, return_exceptions=True)
+
+    def get_client(self, url: str) -> httpx.AsyncClient:
+        """Devuelve el cliente compartido para el host de la URL, creándolo si no existe"""
+        host = self._host_key(url)
+        client = self._clients.get(host)
+        if client is None or client.is_closed:
+            client = self._create_client(host)
+        return client
+
+    def _create_client(self, host: str) -> httpx.AsyncClient:
+        pool_config = self._limits.get(host) or HTTPPoolConfig()
+        stats = self._stats.setdefault(host, {"requests": 0, "new_connections": 0, "reused_connections": 0})
+
+        async def on_request(request: httpx.Request):
+            request.extensions["trace"] = _ConnectionTracer()
+
+        async def on_response(response: httpx.Response):
+            tracer = response.request.extensions.get("trace")
+            stats["requests"] += 1
+            if isinstance(tracer, _ConnectionTracer) and tracer.opened_connection:
+                stats["new_connections"] += 1
+            else:
+                stats["reused_connections"] += 1
+
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=pool_config.max_connections,
+                max_keepalive_connections=pool_config.max_keepalive_connections,
+                keepalive_expiry=pool_config.keepalive_expiry
+            ),
+            http2=pool_config.http2 and HTTP2_AVAILABLE,
+            event_hooks={"request": [on_request], "response": [on_response]}
+        )
+        self._clients[host] = client
+        return client
+
+    def stats(self) -> Dict[str, Dict]:
+        """Contadores de reutilización de conexiones por host"""
+        result = {}
+        for host, stats in self._stats.items():
+            requests = stats["requests"]
+            result[host] = {
+                **stats,
+                "reuse_ratio": round(stats["reused_connections"] / requests, 4) if requests else 0.0,
+                "active": host in self._clients
+            }
+        return result
+
+
+# Instancia global
+http_pool = HTTPClientPool()
@@ -0,0 +1,86 @@
+import math
+import re
+import unicodedata
+from collections import Counter, defaultdict
+from typing import Any, Dict, Iterable, List
+
+# Términos compuestos (códigos de sala, emails, URLs) y palabras sueltas
+_TOKEN_RE = re.compile(r"\w+(?:[@.\-/_:]\w+)*")
+_PART_RE = re.compile(r"[^\W_]+")
+
+# Palabras vacías más frecuentes en las FAQs (español e inglés)
+STOPWORDS = frozenset("""
+a al ante como con de del desde el en entre es esta este la las le lo los mas me mi no o para pero por que se
+si sin su sus te tu un una uno y ya hay puedo puede cual cuales cuando donde
+an and are as at be by for from how i in is it of on or the to what when where which with you
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    """Términos de un texto para BM25.
+
+    Sin tildes y en minúsculas. Los términos compuestos ("A-201", "biblioteca@example.com")
+    se indexan enteros y también por partes, así una query con el código exacto puntúa
+    más que una que solo comparte una de sus partes.
+    """
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    terms = []
+    for token in _TOKEN_RE.findall(text):
+        parts = _PART_RE.findall(token)
+        if len(parts) > 1:
+            terms.append(token)
+        terms.extend(part for part in parts if part not in STOPWORDS)
+    return terms
+
+
+def metadata_text(metadata: Dict[str, Any]) -> str:
+    """Texto indexable de la metadata de un resultado (sus valores de texto y números)"""
+    return "\n".join(str(value) for value in metadata.values() if isinstance(value, (str, int, float)))
+
+
+class BM25Index:
+    """Índice invertido BM25 en memoria con los pesos precalculados.
+
+    Cada término guarda la lista de (documento, peso), donde el peso ya incluye el
+    IDF y la normalización por longitud: puntuar una query es sumar los pesos de
+    sus términos, sin recorrer los documentos.
+    """
+
+    def __init__(self, postings: Dict[str, List[List[float]]], documents: int):
+        self.postings = postings
+        self.documents = documents
+
+    @classmethod
+    def build(cls, texts: Iterable[str], k1: float = 1.2, b: float = 0.75) -> "BM25Index":
+        frequencies = [Counter(tokenize(text)) for text in texts]
+        lengths = [sum(counts.values()) for counts in frequencies]
+        average_length = (sum(lengths) / len(lengths)) if lengths else 0.0
+        document_frequency = Counter(term for counts in frequencies for term in counts)
+
+        postings: Dict[str, List[List[float]]] = defaultdict(list)
+        for document, (counts, length) in enumerate(zip(frequencies, lengths)):
+            norm = k1 * (1 - b + b * length / average_length) if average_length else k1
+            for term, frequency in counts.items():
+                df = document_frequency[term]
+                idf = math.log(1 + (len(frequencies) - df + 0.5) / (df + 0.5))
+                postings[term].append([document, round(idf * frequency * (k1 + 1) / (frequency + norm), 6)])
+        return cls(dict(postings), len(frequencies))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"documents": self.documents, "postings": self.postings}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "BM25Index":
+        return cls(data["postings"], int(data["documents"]))
+
+    def scores(self, query: str) -> Dict[int, float]:
+        """Score BM25 de cada documento que contiene algún término de la query"""
+        scores: Dict[int, float] = defaultdict(float)
+        for term in set(tokenize(query)):
+            for document, weight in self.postings.get(term, ()):
+                scores[int(document)] += weight
+        return scores
+
+    def __len__(self) -> int:
+        return len(self.postings)
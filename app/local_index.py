@@ -0,0 +1,364 @@
+"""Índice vectorial local para búsquedas semánticas sin salir del proceso.
+
+Alternativa a Pinecone para índices pequeños (p.ej. FAQs de unos cientos de
+entradas): los vectores se guardan normalizados en una matriz NumPy que se mapea
+desde disco y el top-k por similitud coseno se calcula con un producto de matrices.
+Junto a los vectores se guarda un índice BM25 de la metadata para la búsqueda
+híbrida (search_mode 'hybrid').
+
+Construcción (instantánea de un índice de Pinecone o embeddings de un corpus JSONL):
+    python -m app.local_index app/indexes/faqs --pinecone iese-library-faqs
+    python -m app.local_index app/indexes/faqs --jsonl faqs.jsonl [--int8]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+from .lexical_index import BM25Index, metadata_text
+from .logging_config import get_logger
+from .telemetry import Histogram
+
+# NumPy es opcional (solo lo necesitan los agentes con 'local_index')
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+logger = get_logger(__name__)
+
+MANIFEST_FILE = "manifest.json"
+VECTORS_FILE = "vectors.npy"
+SCALES_FILE = "scales.npy"
+ITEMS_FILE = "items.jsonl"
+LEXICAL_FILE = "lexical.json"
+
+# Por debajo de este tamaño (filas x dimensión) la búsqueda se hace en el event loop: tarda menos que ir a un hilo
+INLINE_MAX_VALUES = 4_000_000
+
+
+class LocalVectorIndex:
+    """Índice guardado en un directorio:
+
+    - manifest.json: dimensión, número de vectores, tipo ('float32' o 'int8'), origen y fecha.
+    - vectors.npy: matriz N x D de vectores de norma 1, en float32 o cuantizada a int8
+      (con scales.npy, la escala de cada fila).
+    - items.jsonl: id y metadata de cada fila, en el mismo orden.
+    - lexical.json: índice invertido BM25 del texto de la metadata (para el modo hybrid).
+    """
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self.manifest: Dict[str, Any] = json.loads((directory / MANIFEST_FILE).read_text(encoding="utf-8"))
+        self.dimension = int(self.manifest["dimension"])
+        self.dtype = self.manifest.get("dtype", "float32")
+        self.vectors = np.load(directory / VECTORS_FILE, mmap_mode="r")
+        self.scales = np.load(directory / SCALES_FILE) if self.dtype == "int8" else None
+        self.ids: List[str] = []
+        self.metadata: List[Dict[str, Any]] = []
+        with open(directory / ITEMS_FILE, "r", encoding="utf-8") as f:
+            for line in f:
+                item = json.loads(line)
+                self.ids.append(item["id"])
+                self.metadata.append(item.get("metadata") or {})
+        if self.vectors.shape != (len(self.ids), self.dimension):
+            raise ValueError(
+                f"Índice local {directory} inconsistente: vectores {self.vectors.shape}, "
+                f"{len(self.ids)} items, dimensión {self.dimension}"
+            )
+        if (directory / LEXICAL_FILE).exists():
+            self.lexical = BM25Index.from_dict(json.loads((directory / LEXICAL_FILE).read_text(encoding="utf-8")))
+        else:
+            # Índices construidos sin lexical.json: el índice BM25 se calcula al cargar
+            self.lexical = BM25Index.build(metadata_text(metadata) for metadata in self.metadata)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def _vector_scores(self, queries: Sequence[Sequence[float]]) -> "np.ndarray":
+        """Similitud coseno de cada query con cada fila (un único producto de matrices)"""
+        matrix = np.asarray(queries, dtype=np.float32)
+        if matrix.ndim == 1:
+            matrix = matrix[np.newaxis, :]
+        if matrix.shape[1] != self.dimension:
+            raise ValueError(f"La query tiene dimensión {matrix.shape[1]} y el índice {self.dimension}")
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix = matrix / np.where(norms == 0, 1, norms)
+        if self.scales is None:
+            return matrix @ self.vectors.T
+        # int8: se desescala el producto en lugar de la matriz (la conversión a float32 es temporal)
+        return (matrix @ self.vectors.T.astype(np.float32)) * self.scales
+
+    def _top(self, scores: "np.ndarray", top_k: int) -> List[Dict[str, Any]]:
+        """Los top_k resultados de mayor score, con el formato de _search_pinecone: {'id', 'score', 'metadata'}"""
+        top_k = min(top_k, len(self.ids))
+        if top_k <= 0:
+            return []
+        candidates = np.argpartition(-scores, top_k - 1)[:top_k]
+        ordered = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return [{"id": self.ids[i], "score": float(scores[i]), "metadata": self.metadata[i]} for i in ordered]
+
+    def search_batch(self, queries: Sequence[Sequence[float]], top_k: int) -> List[List[Dict[str, Any]]]:
+        """Top-k por similitud coseno de varias queries a la vez"""
+        return [self._top(row, top_k) for row in self._vector_scores(queries)]
+
+    def search(self, vector: Sequence[float], top_k: int) -> List[Dict[str, Any]]:
+        return self.search_batch([vector], top_k)[0]
+
+    def search_hybrid(self, vector: Sequence[float], query: str, top_k: int,
+                      vector_weight: float = 0.5) -> List[Dict[str, Any]]:
+        """Top-k combinando similitud coseno y BM25 sobre el texto de la metadata.
+
+        score = vector_weight * coseno + (1 - vector_weight) * BM25 normalizado, donde
+        el BM25 se divide por el máximo de la query (el mejor resultado léxico vale 1)
+        y vale 0 en los documentos sin ningún término de la query. La escala es la
+        misma haya o no coincidencias léxicas, así un mismo score mínimo recorta igual.
+        """
+        scores = self._vector_scores([vector])[0] * vector_weight
+        lexical_scores = self.lexical.scores(query)
+        if lexical_scores:
+            rows = np.fromiter(lexical_scores.keys(), dtype=np.int64, count=len(lexical_scores))
+            values = np.fromiter(lexical_scores.values(), dtype=np.float32, count=len(lexical_scores))
+            scores[rows] += (1 - vector_weight) * values / values.max()
+        return self._top(scores, top_k)
+
+
+class LocalIndexService:
+    """Índices locales abiertos por directorio.
+
+    Se abren la primera vez que se consultan y se vuelven a abrir si el índice se
+    reconstruye (cambia manifest.json), sin reiniciar el servidor.
+    """
+
+    def __init__(self):
+        self._indexes: Dict[str, Tuple[float, LocalVectorIndex]] = {}
+        self._lock = threading.Lock()
+        self.queries = 0
+        self.hybrid_queries = 0
+        self.errors = 0
+        self.query_latency = Histogram()
+
+    def _manifest_mtime(self, directory: str) -> float:
+        return (Path(directory) / MANIFEST_FILE).stat().st_mtime
+
+    def _cached(self, directory: str) -> Optional[LocalVectorIndex]:
+        entry = self._indexes.get(directory)
+        if entry is not None and entry[0] == self._manifest_mtime(directory):
+            return entry[1]
+        return None
+
+    def get(self, directory: str) -> LocalVectorIndex:
+        """Índice del directorio (bloqueante la primera vez: lee items.jsonl)"""
+        if not NUMPY_AVAILABLE:
+            raise RuntimeError("Los índices locales ('local_index') requieren 'numpy'")
+        index = self._cached(directory)
+        if index is None:
+            with self._lock:
+                index = self._cached(directory)
+                if index is None:
+                    mtime = self._manifest_mtime(directory)
+                    index = LocalVectorIndex(Path(directory))
+                    self._indexes[directory] = (mtime, index)
+                    logger.info(
+                        "[LocalIndex] Índice '%s' cargado: %d vectores de dimensión %d (%s)",
+                        directory, len(index), index.dimension, index.dtype
+                    )
+        return index
+
+    async def query(self, directory: str, vector: Sequence[float], top_k: int,
+                    query_text: Optional[str] = None, vector_weight: float = 0.5) -> List[Dict[str, Any]]:
+        """Top-k del índice (híbrido vector + BM25 si se pasa query_text).
+
+        La carga inicial y los índices grandes van a un hilo.
+        """
+        if query_text is None:
+            search, arguments = LocalVectorIndex.search, (vector, top_k)
+        else:
+            search, arguments = LocalVectorIndex.search_hybrid, (vector, query_text, top_k, vector_weight)
+        try:
+            index = self._cached(directory) if NUMPY_AVAILABLE else None
+            if index is None:
+                index = await asyncio.to_thread(self.get, directory)
+            started_at = time.perf_counter()
+            if len(index) * index.dimension <= INLINE_MAX_VALUES:
+                results = search(index, *arguments)
+            else:
+                results = await asyncio.to_thread(search, index, *arguments)
+        except Exception:
+            self.errors += 1
+            raise
+        self.query_latency.observe(time.perf_counter() - started_at)
+        self.queries += 1
+        if query_text is not None:
+            self.hybrid_queries += 1
+        return results
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "numpy_available": NUMPY_AVAILABLE,
+            "indexes": {
+                directory: {
+                    "vectors": len(index), "dimension": index.dimension, "dtype": index.dtype,
+                    "lexical_terms": len(index.lexical)
+                }
+                for directory, (_, index) in self._indexes.items()
+            },
+            "queries": self.queries,
+            "hybrid_queries": self.hybrid_queries,
+            "errors": self.errors,
+            "query_seconds": self.query_latency.snapshot()
+        }
+
+
+# ---- Construcción ----
+
+def write_index(directory: Path, ids: List[str], vectors: "np.ndarray", metadata: List[Dict[str, Any]],
+                source: str, quantize: bool = False):
+    """Guarda un índice (normaliza los vectores y, con quantize, los cuantiza a int8 por fila)
+    junto con el índice BM25 de su metadata.
+
+    Los ficheros se sustituyen con os.replace y manifest.json se escribe el último, así
+    un servidor que esté usando el índice sigue leyendo el anterior hasta que lo detecta.
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors = vectors / np.where(norms == 0, 1, norms)
+
+    def replace(name: str, write):
+        temporary = directory / f".{name}.tmp"
+        with open(temporary, "wb") as f:
+            write(f)
+        os.replace(temporary, directory / name)
+
+    if quantize:
+        scales = np.abs(vectors).max(axis=1) / 127
+        scales[scales == 0] = 1
+        quantized = np.round(vectors / scales[:, np.newaxis]).astype(np.int8)
+        replace(VECTORS_FILE, lambda f: np.save(f, quantized))
+        replace(SCALES_FILE, lambda f: np.save(f, scales.astype(np.float32)))
+    else:
+        replace(VECTORS_FILE, lambda f: np.save(f, vectors))
+        (directory / SCALES_FILE).unlink(missing_ok=True)
+    replace(ITEMS_FILE, lambda f: f.write("".join(
+        json.dumps({"id": item_id, "metadata": item_metadata}, ensure_ascii=False) + "\n"
+        for item_id, item_metadata in zip(ids, metadata)
+    ).encode("utf-8")))
+    lexical = BM25Index.build(metadata_text(item_metadata) for item_metadata in metadata)
+    replace(LEXICAL_FILE, lambda f: f.write(json.dumps(lexical.to_dict(), ensure_ascii=False).encode("utf-8")))
+    manifest = {
+        "dimension": int(vectors.shape[1]) if len(vectors) else 0,
+        "count": len(ids),
+        "dtype": "int8" if quantize else "float32",
+        "metric": "cosine",
+        "lexical_terms": len(lexical),
+        "source": source,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S")
+    }
+    replace(MANIFEST_FILE, lambda f: f.write(json.dumps(manifest, ensure_ascii=False, indent=2).encode("utf-8")))
+
+
+def snapshot_pinecone(index_name: str, namespace: Optional[str] = None) -> Tuple[List[str], List[List[float]], List[Dict]]:
+    """Descarga todos los vectores (con su metadata) de un índice serverless de Pinecone"""
+    from .pinecone_service import pinecone_service
+
+    index = pinecone_service.get_index(index_name)
+    ids, vectors, metadata = [], [], []
+    for page in index.list(namespace=namespace or None):
+        fetched = index.fetch(ids=list(page), namespace=namespace or None)
+        for vector_id in page:
+            vector = fetched.vectors.get(vector_id)
+            if vector is None:
+                continue
+            ids.append(vector.id)
+            vectors.append(list(vector.values))
+            metadata.append(dict(vector.metadata or {}))
+        print(f"  {len(ids)} vectores descargados...")
+    return ids, vectors, metadata
+
+
+def _read_corpus(path: Path, text_field: str) -> Iterator[Tuple[str, str, Dict[str, Any]]]:
+    """(id, texto a embeber, metadata) de cada línea del JSONL.
+
+    Cada línea es {"id": ..., "text": ..., "metadata": {...}} o un objeto plano (todo
+    salvo el id es metadata). Sin campo de texto se embeben los valores de la metadata.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            metadata = entry.get("metadata")
+            if metadata is None:
+                metadata = {key: value for key, value in entry.items() if key not in ("id", text_field)}
+            text = entry.get(text_field) or "\n".join(
+                str(value) for value in metadata.values() if isinstance(value, (str, int, float))
+            )
+            yield str(entry.get("id", number)), text, metadata
+
+
+def embed_corpus(path: Path, text_field: str = "text",
+                 batch_size: int = 64) -> Tuple[List[str], List[List[float]], List[Dict]]:
+    """Embebe un corpus JSONL con el mismo deployment de Azure OpenAI que las queries"""
+    import httpx
+    from .config import AZURE_OPENAI_EMBEDDINGS_URL, get_openai_api_key
+
+    entries = list(_read_corpus(path, text_field))
+    headers = {"api-key": get_openai_api_key(), "Content-Type": "application/json"}
+    vectors: List[List[float]] = []
+    with httpx.Client(timeout=60.0) as client:
+        for start in range(0, len(entries), batch_size):
+            batch = [text for _, text, _ in entries[start:start + batch_size]]
+            response = client.post(AZURE_OPENAI_EMBEDDINGS_URL, headers=headers, json={"input": batch})
+            response.raise_for_status()
+            data = sorted(response.json()["data"], key=lambda item: item["index"])
+            vectors.extend(item["embedding"] for item in data)
+            print(f"  {len(vectors)}/{len(entries)} textos embebidos...")
+    return [entry[0] for entry in entries], vectors, [entry[2] for entry in entries]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("directory", help="Directorio del índice local (se crea o se sustituye)")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--pinecone", metavar="INDICE", help="Instantánea de un índice serverless de Pinecone")
+    source.add_argument("--jsonl", type=Path, metavar="FICHERO", help="Corpus JSONL a embeber con Azure OpenAI")
+    parser.add_argument("--namespace", help="Namespace de Pinecone")
+    parser.add_argument("--text-field", default="text", help="Campo del JSONL con el texto a embeber")
+    parser.add_argument("--batch-size", type=int, default=64, help="Textos por petición de embeddings")
+    parser.add_argument("--int8", action="store_true", help="Cuantiza los vectores a int8 (4 veces menos memoria)")
+    args = parser.parse_args()
+
+    if not NUMPY_AVAILABLE:
+        sys.exit("Los índices locales requieren 'numpy' (pip install numpy)")
+    if args.pinecone:
+        print(f"Descargando el índice de Pinecone '{args.pinecone}'...")
+        ids, vectors, metadata = snapshot_pinecone(args.pinecone, args.namespace)
+        source_name = f"pinecone:{args.pinecone}" + (f"/{args.namespace}" if args.namespace else "")
+    else:
+        if not args.jsonl.is_file():
+            sys.exit(f"Fichero {args.jsonl} no existe")
+        print(f"Embebiendo {args.jsonl}...")
+        ids, vectors, metadata = embed_corpus(args.jsonl, args.text_field, args.batch_size)
+        source_name = f"jsonl:{args.jsonl.name}"
+    if not ids:
+        sys.exit("No hay vectores que guardar")
+
+    write_index(Path(args.directory), ids, np.asarray(vectors, dtype=np.float32), metadata, source_name, args.int8)
+    print(
+        f"Índice guardado en {args.directory}: {len(ids)} vectores de dimensión {len(vectors[0])}"
+        f" ({'int8' if args.int8 else 'float32'})"
+    )
+
+
+# Instancia global
+local_index_service = LocalIndexService()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+_listener = None
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler que descarta registros (y los cuenta) si la cola está llena en lugar de bloquear"""
+
+    def __init__(self, log_queue: "queue.Queue"):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging():
+    """Configura el logger 'app' (una sola vez).
+
+    El nivel se toma de LOG_LEVEL (por defecto INFO). Los registros se encolan y un
+    hilo (QueueListener) los escribe en stdout, así que loguear nunca bloquea el
+    event loop con escrituras en disco o en la consola.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    log_queue: "queue.Queue" = queue.Queue(maxsize=int(os.getenv("LOG_QUEUE_SIZE", "10000")))
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    logger = logging.getLogger("app")
+    logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+    logger.addHandler(_DroppingQueueHandler(log_queue))
+    logger.propagate = False
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Logger del módulo (configura el logging la primera vez)"""
+    setup_logging()
+    return logging.getLogger(name)
+
+
+def dropped_log_records() -> int:
+    return sum(
+        handler.dropped for handler in logging.getLogger("app").handlers
+        if isinstance(handler, _DroppingQueueHandler)
+    )
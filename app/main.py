@@ -1,19 +1,169 @@
-from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import HTMLResponse, PlainTextResponse, FileResponse
+from fastapi import FastAPI, Header, HTTPException, Query, Request, Response
+from fastapi.responses import HTMLResponse, PlainTextResponse, FileResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.background import BackgroundTask
+import asyncio
+import hmac
 import httpx
 import json
+import os
+from contextlib import asynccontextmanager
+from datetime import date
 from pathlib import Path
+from typing import Optional
 from .config import config_manager
 from .models import ChatMessage, ChatResponse, PublicAgentConfig
 from .chat_service import ChatService
 from .metrics_service import metrics_service
+from .http_pool import http_pool
+from .pinecone_service import pinecone_service
+from .local_index import local_index_service
+from .embedding_cache import embedding_cache
+from .search_cache import search_cache
+from .tools import tool_registry, tool_engine
+from .answer_cache import answer_cache
+from .admission import admission, OverloadedError
+from .resilience import resilience, CircuitOpenError
+from .single_flight import single_flight
+from .conversation_store import conversation_store
+from .shared_state import shared_store, worker_id
+from .widget_assets import widget_asset, widget_bootstraps, widget_response
+from .telemetry import (
+    STAGE_LATENCY,
+    REQUEST_LATENCY,
+    TimingMiddleware,
+    format_histograms,
+    format_samples,
+    span
+)
+from .logging_config import dropped_log_records, get_logger
+
+logger = get_logger(__name__)
+
+# Cada cuántos segundos se comprueban cambios en app/agents (0 = solo con /reload-config)
+CONFIG_WATCH_INTERVAL = float(os.getenv("CONFIG_WATCH_INTERVAL", "2"))
+
+# Cada cuántos segundos se comprueba si widget.js ha cambiado (0 = solo al arrancar)
+WIDGET_WATCH_INTERVAL = float(os.getenv("WIDGET_WATCH_INTERVAL", "2"))
+
+# Con varios workers, cada cuántos segundos publica cada uno sus histogramas de latencia
+# (los de un worker que deja de publicar desaparecen pasados WORKER_METRICS_TTL segundos)
+WORKER_METRICS_INTERVAL = float(os.getenv("WORKER_METRICS_INTERVAL", "5"))
+WORKER_METRICS_TTL = 300
+
+# Token que exige /cache/search/flush en la cabecera X-Admin-Token (sin definir = sin autenticación)
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+# Agentes por página en / y /agents
+AGENTS_PAGE_SIZE = 100
+
+# Valor del gauge agentclic_circuit_state para cada estado del circuit breaker
+CIRCUIT_STATE_VALUES = {"closed": 0, "half_open": 1, "open": 2}
+
+
+async def _apply_config_changes(changes):
+    """Invalida solo lo asociado a los agentes modificados o eliminados en una recarga"""
+    if not changes:
+        return
+    profiles = list(config_manager.iter_upstreams())
+    await http_pool.reconfigure(profiles)
+    admission.configure(profiles)
+    # Solo se cargan los agentes modificados que tienen caché de respuestas
+    answer_cache.sync(
+        [agent for agent_id in changes.changed
+         if answer_cache.tracks(agent_id) and (agent := await config_manager.get_agent_async(agent_id))],
+        removed=changes.removed
+    )
+    tool_engine.forget(changes.changed | changes.removed)
+    admission.forget(changes.removed)
+    resilience.forget(changes.changed | changes.removed)
+    widget_bootstraps.forget(changes.changed | changes.removed)
+    logger.info(
+        "[Config] Recarga aplicada: %d agentes modificados, %d eliminados",
+        len(changes.changed), len(changes.removed)
+    )
+
+
+async def _watch_widget():
+    """Reconstruye en un hilo la copia en memoria de widget.js cuando cambia el fichero"""
+    while True:
+        await asyncio.sleep(WIDGET_WATCH_INTERVAL)
+        try:
+            await asyncio.to_thread(widget_asset.refresh)
+        except Exception as e:
+            logger.exception("[Widget] Error recargando widget.js: %s", e)
+
+
+async def _watch_agent_configs():
+    """Recarga periódicamente los ficheros de agentes modificados (el parseo va en un hilo)"""
+    while True:
+        await asyncio.sleep(CONFIG_WATCH_INTERVAL)
+        try:
+            changes = await asyncio.to_thread(config_manager.reload_agents)
+            await _apply_config_changes(changes)
+        except Exception as e:
+            logger.exception("[Config] Error recargando agentes: %s", e)
+
+
+def _store_worker_metrics():
+    """Guarda en el almacén compartido los histogramas de latencia de este worker"""
+    payload = {"stages": STAGE_LATENCY.export(), "requests": REQUEST_LATENCY.export()}
+    shared_store.set("telemetry", worker_id(), json.dumps(payload).encode("utf-8"), WORKER_METRICS_TTL)
+
+
+def _other_workers_metrics() -> list:
+    """Últimos histogramas publicados por los demás workers"""
+    own = worker_id()
+    return [json.loads(value) for key, value in shared_store.items("telemetry") if key != own]
+
+
+async def _publish_worker_metrics():
+    while True:
+        await asyncio.sleep(WORKER_METRICS_INTERVAL)
+        try:
+            await asyncio.to_thread(_store_worker_metrics)
+        except Exception as e:
+            logger.exception("[SharedState] Error publicando métricas del worker: %s", e)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Crea y libera los recursos compartidos durante la vida de la aplicación"""
+    profiles = list(config_manager.iter_upstreams())
+    await http_pool.start(profiles)
+    admission.configure(profiles)
+    embedding_cache.open()
+    await asyncio.to_thread(conversation_store.open)
+    metrics_service.start()
+    await asyncio.to_thread(widget_asset.refresh)
+    watchers = []
+    if CONFIG_WATCH_INTERVAL > 0:
+        watchers.append(asyncio.create_task(_watch_agent_configs()))
+    if WIDGET_WATCH_INTERVAL > 0:
+        watchers.append(asyncio.create_task(_watch_widget()))
+    if shared_store.enabled:
+        logger.info("[SharedState] Worker %s usando estado compartido en %s", worker_id(), shared_store.path)
+        watchers.append(asyncio.create_task(_publish_worker_metrics()))
+    yield
+    for watcher in watchers:
+        watcher.cancel()
+    await asyncio.to_thread(metrics_service.stop)
+    await conversation_store.drain()
+    await asyncio.to_thread(conversation_store.close)
+    await http_pool.close()
+    pinecone_service.shutdown()
+    embedding_cache.close()
+    if shared_store.enabled:
+        await asyncio.to_thread(_store_worker_metrics)
+        shared_store.close()
+
 
 app = FastAPI(
     title="Embeddable Chatbot API",
     description="API para widgets de chatbot embebibles",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Configurar CORS para permitir embeds desde cualquier dominio
@@ -23,40 +173,77 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Cache", "Server-Timing", "Retry-After"],
 )
 
+# Medición de cada petición (y cabecera Server-Timing si SERVER_TIMING=true)
+app.add_middleware(TimingMiddleware, server_timing=os.getenv("SERVER_TIMING", "false").lower() == "true")
+
 # Montar archivos estáticos
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
 
 
 @app.get("/")
 async def root():
-    """Endpoint de health check"""
-    agents = config_manager.get_all_agents()
+    """Endpoint de health check (lista solo la primera página de agentes; el resto en /agents)"""
     return {
         "message": "Embeddable Chatbot API funcionando",
-        "agents_loaded": len(agents),
-        "agents": [
-            {
-                "id": agent.id,
-                "name": agent.name,
-                "type": agent.type.value,
-                "enabled": agent.enabled
-            }
-            for agent in agents.values()
-        ]
+        "agents_loaded": config_manager.count_agents(),
+        "agents": config_manager.list_agents(0, AGENTS_PAGE_SIZE),
+        "widget_url": widget_asset.versioned_path,
+        "circuit_breakers": resilience.breaker_states()
     }
 
 
-@app.get("/widget.js", response_class=PlainTextResponse)
-async def get_widget_script():
-    """Sirve el script JavaScript del widget embebible"""
-    try:
-        with open("app/static/widget.js", "r", encoding="utf-8") as f:
-            script_content = f.read()
-        return script_content
-    except FileNotFoundError:
+@app.get("/widget.js")
+async def get_widget_script(request: Request):
+    """Sirve el script del widget desde memoria (minificado, comprimido y con ETag)"""
+    build = widget_asset.current
+    if build is None:
         raise HTTPException(status_code=404, detail="Widget script no encontrado")
+    return widget_response(
+        build,
+        request.headers.get("if-none-match"),
+        request.headers.get("accept-encoding"),
+        f"public, max-age={widget_asset.max_age}"
+    )
+
+
+@app.get("/widget.{version}.js")
+async def get_versioned_widget_script(version: str, request: Request):
+    """Sirve una versión concreta del widget; su contenido no cambia, así que se cachea un año"""
+    build = widget_asset.get(version)
+    if build is None:
+        raise HTTPException(status_code=404, detail="Versión del widget no encontrada")
+    return widget_response(
+        build,
+        request.headers.get("if-none-match"),
+        request.headers.get("accept-encoding"),
+        "public, max-age=31536000, immutable"
+    )
+
+
+@app.get("/widget/{agent_id}.js")
+async def get_widget_bootstrap(agent_id: str, request: Request):
+    """Widget con la configuración pública del agente incrustada (evita la petición a /public-config)"""
+    build = widget_bootstraps.get(agent_id)
+    if build is None:
+        agent = await config_manager.get_agent_async(agent_id)
+        if not agent:
+            raise HTTPException(status_code=404, detail=f"Agente '{agent_id}' no encontrado")
+        if not agent.enabled:
+            raise HTTPException(status_code=403, detail=f"Agente '{agent_id}' está deshabilitado")
+        public_config = agent.to_public_config().model_dump(mode="json")
+        build = await asyncio.to_thread(widget_bootstraps.build, public_config)
+        if build is None:
+            raise HTTPException(status_code=404, detail="Widget script no encontrado")
+        widget_bootstraps.put(agent_id, build)
+    return widget_response(
+        build,
+        request.headers.get("if-none-match"),
+        request.headers.get("accept-encoding"),
+        f"public, max-age={widget_asset.max_age}"
+    )
 
 
 @app.get("/test", response_class=HTMLResponse)
@@ -74,7 +261,7 @@ async def get_test_page():
 async def get_test_page_with_agent(agent_id: str):
     """Sirve la página de prueba del widget con un agente específico (página en blanco)"""
     # Verificar que el agente existe y está habilitado
-    agent = config_manager.get_agent(agent_id)
+    agent = await config_manager.get_agent_async(agent_id)
     if not agent:
         raise HTTPException(status_code=404, detail=f"Agente '{agent_id}' no encontrado")
     
@@ -102,7 +289,7 @@ async def get_test_page_with_agent(agent_id: str):
     <!-- Página completamente blanca para pruebas del widget -->
     
     <!-- Widget del chatbot -->
-    <script src="/widget.js" data-agent-id="{agent_id}"></script>
+    <script src="{widget_asset.versioned_path or '/widget.js'}" data-agent-id="{agent_id}"></script>
 </body>
 </html>"""
         
@@ -114,7 +301,7 @@ async def get_test_page_with_agent(agent_id: str):
 @app.get("/public-config/{agent_id}", response_model=PublicAgentConfig)
 async def get_public_agent_config(agent_id: str):
     """Obtiene solo la configuración pública de un agente (sin información confidencial)"""
-    agent = config_manager.get_agent(agent_id)
+    agent = await config_manager.get_agent_async(agent_id)
     if not agent:
         raise HTTPException(status_code=404, detail=f"Agente '{agent_id}' no encontrado")
     
@@ -127,7 +314,7 @@ async def get_public_agent_config(agent_id: str):
 @app.get("/config/{agent_id}")
 async def get_agent_config(agent_id: str):
     """Obtiene la configuración completa de un agente específico (INCLUYE INFORMACIÓN CONFIDENCIAL)"""
-    agent = config_manager.get_agent(agent_id)
+    agent = await config_manager.get_agent_async(agent_id)
     if not agent:
         raise HTTPException(status_code=404, detail=f"Agente '{agent_id}' no encontrado")
     
@@ -137,10 +324,29 @@ async def get_agent_config(agent_id: str):
     return agent
 
 
+def _overloaded(agent, error: OverloadedError) -> HTTPException:
+    """429 inmediato con Retry-After cuando la cola del agente o de su upstream está llena"""
+    return HTTPException(
+        status_code=429,
+        detail=f"Agente '{agent.id}' saturado, inténtalo de nuevo en unos segundos",
+        headers={"Retry-After": str(error.retry_after)}
+    )
+
+
+def _circuit_open(agent, error: CircuitOpenError) -> HTTPException:
+    """503 inmediato con el mensaje de error del agente mientras su circuito está abierto"""
+    return HTTPException(
+        status_code=503,
+        detail=agent.messages.error,
+        headers={"Retry-After": str(error.retry_after)}
+    )
+
+
 @app.post("/chat/{agent_id}")
-async def proxy_chat(agent_id: str, message: ChatMessage):
+async def proxy_chat(agent_id: str, message: ChatMessage, response: Response):
     """Proxy para enviar mensajes según el tipo de agente"""
-    agent = config_manager.get_agent(agent_id)
+    with span("config"):
+        agent = await config_manager.get_agent_async(agent_id)
     if not agent:
         raise HTTPException(status_code=404, detail=f"Agente '{agent_id}' no encontrado")
     
@@ -149,11 +355,36 @@ async def proxy_chat(agent_id: str, message: ChatMessage):
     
     # Registrar mensaje en métricas ANTES de procesarlo
     if message.conversation_id:
-        metrics_service.record_message(agent_id, message.conversation_id)
+        with span("metrics"):
+            metrics_service.record_message(agent_id, message.conversation_id)
+    
+    # Caché de respuestas a primeras preguntas (opt-in por agente)
+    cacheable = answer_cache.is_eligible(agent, message)
+    if cacheable:
+        with span("answer_cache"):
+            cached = await answer_cache.get(agent, message)
+        if cached is not None:
+            response.headers["X-Cache"] = "HIT"
+            await conversation_store.record_answer(agent, message, cached.response)
+            return cached
+    response.headers["X-Cache"] = "MISS" if cacheable else "BYPASS"
+    
+    try:
+        resilience.check(agent.id, agent.resilience)
+        ticket = await admission.acquire(agent)
+    except CircuitOpenError as e:
+        raise _circuit_open(agent, e)
+    except OverloadedError as e:
+        raise _overloaded(agent, e)
     
     try:
-        return await ChatService.send_message(agent, message)
+        chat_response = await ChatService.send_message(agent, message)
+        if cacheable:
+            await answer_cache.set(agent, message, chat_response)
+        return chat_response
         
+    except CircuitOpenError as e:
+        raise _circuit_open(agent, e)
     except httpx.TimeoutException:
         raise HTTPException(status_code=504, detail="Timeout al contactar con el chatbot")
     except httpx.HTTPStatusError as e:
@@ -162,52 +393,320 @@ async def proxy_chat(agent_id: str, message: ChatMessage):
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error interno: {str(e)}")
+    finally:
+        ticket.release()
+
+
+def _format_sse(event: dict) -> str:
+    """Formatea un evento como Server-Sent Event"""
+    return f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+
+@app.post("/chat/{agent_id}/stream")
+async def proxy_chat_stream(agent_id: str, message: ChatMessage):
+    """Proxy de chat en streaming (SSE): emite eventos 'delta' con texto y un evento final 'done'"""
+    with span("config"):
+        agent = await config_manager.get_agent_async(agent_id)
+    if not agent:
+        raise HTTPException(status_code=404, detail=f"Agente '{agent_id}' no encontrado")
+    
+    if not agent.enabled:
+        raise HTTPException(status_code=403, detail=f"Agente '{agent_id}' está deshabilitado")
+    
+    # Registrar mensaje en métricas ANTES de procesarlo
+    if message.conversation_id:
+        with span("metrics"):
+            metrics_service.record_message(agent_id, message.conversation_id)
+    
+    cacheable = answer_cache.is_eligible(agent, message)
+    cached = None
+    if cacheable:
+        with span("answer_cache"):
+            cached = await answer_cache.get(agent, message)
+    
+    # La admisión se decide antes de empezar el stream para poder responder 429
+    ticket = None
+    if cached is None:
+        try:
+            resilience.check(agent.id, agent.resilience)
+            ticket = await admission.acquire(agent)
+        except CircuitOpenError as e:
+            raise _circuit_open(agent, e)
+        except OverloadedError as e:
+            raise _overloaded(agent, e)
+    
+    async def event_stream():
+        if cached is not None:
+            await conversation_store.record_answer(agent, message, cached.response)
+            yield _format_sse({"type": "done", **cached.model_dump()})
+            return
+        # Una vez iniciado el stream el status ya es 200: los errores viajan como evento 'error'
+        try:
+            async for event in ChatService.stream_message(agent, message):
+                yield _format_sse(event)
+                if cacheable and event["type"] == "done":
+                    await answer_cache.set(agent, message, ChatResponse(
+                        **{key: value for key, value in event.items() if key != "type"}
+                    ))
+        except CircuitOpenError:
+            yield _format_sse({"type": "error", "status": 503, "detail": agent.messages.error})
+        except httpx.TimeoutException:
+            yield _format_sse({"type": "error", "status": 504, "detail": "Timeout al contactar con el chatbot"})
+        except httpx.HTTPStatusError as e:
+            yield _format_sse({"type": "error", "status": 502, "detail": f"Error del chatbot: {e.response.status_code}"})
+        except ValueError as e:
+            yield _format_sse({"type": "error", "status": 400, "detail": str(e)})
+        except Exception as e:
+            yield _format_sse({"type": "error", "status": 500, "detail": f"Error interno: {str(e)}"})
+        finally:
+            ticket.release()
+    
+    return StreamingResponse(
+        event_stream(),
+        # Por si el cliente se desconecta antes de que empiece el stream
+        background=BackgroundTask(ticket.release) if ticket else None,
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+            "X-Cache": "HIT" if cached is not None else ("MISS" if cacheable else "BYPASS")
+        }
+    )
 
 
 @app.get("/agents")
-async def list_agents():
-    """Lista todos los agentes disponibles con su tipo"""
-    agents = config_manager.get_all_agents()
+async def list_agents(
+    offset: int = Query(0, ge=0),
+    limit: int = Query(AGENTS_PAGE_SIZE, ge=1, le=1000)
+):
+    """Lista paginada de los agentes disponibles con su tipo (ordenados por id)"""
     return {
-        "agents": [
-            {
-                "id": agent.id,
-                "name": agent.name,
-                "type": agent.type.value,
-                "enabled": agent.enabled
-            }
-            for agent in agents.values()
-        ]
+        "agents": config_manager.list_agents(offset, limit),
+        "total": config_manager.count_agents(),
+        "offset": offset,
+        "limit": limit
     }
 
 
 @app.post("/reload-config")
 async def reload_configuration():
-    """Recarga las configuraciones de agentes (útil para desarrollo)"""
-    config_manager.reload_agents()
-    agents = config_manager.get_all_agents()
+    """Recarga las configuraciones de agentes modificadas sin interrumpir las peticiones en curso"""
+    changes = await asyncio.to_thread(config_manager.reload_agents)
+    await _apply_config_changes(changes)
     return {
         "message": "Configuraciones recargadas",
-        "agents_loaded": len(agents),
-        "agents": list(agents.keys())
+        "agents_loaded": config_manager.count_agents(),
+        "changed": sorted(changes.changed),
+        "removed": sorted(changes.removed),
+        "errors": changes.errors
     }
 
 
+def _check_admin_token(token: Optional[str]):
+    if ADMIN_TOKEN and not (token and hmac.compare_digest(token.encode("utf-8"), ADMIN_TOKEN.encode("utf-8"))):
+        raise HTTPException(status_code=401, detail="X-Admin-Token no válido")
+
+
+@app.post("/cache/search/flush")
+async def flush_search_cache(index: Optional[str] = None, x_admin_token: Optional[str] = Header(None)):
+    """Vacía la caché de resultados de semantic_search (toda o solo la de un índice de Pinecone)"""
+    _check_admin_token(x_admin_token)
+    if shared_store.enabled:
+        # Escritura en SQLite que puede esperar al lock de la base: fuera del event loop
+        removed = await asyncio.to_thread(search_cache.flush, index)
+    else:
+        removed = search_cache.flush(index)
+    return {
+        "message": "Caché de búsqueda vaciada",
+        "index": index,
+        "entries_removed": removed
+    }
+
+
+def _parse_date_param(value: Optional[str], name: str) -> Optional[str]:
+    """Valida un parámetro de fecha AAAA-MM-DD"""
+    if value is None:
+        return None
+    try:
+        return date.fromisoformat(value).isoformat()
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"'{name}' debe tener formato AAAA-MM-DD")
+
+
 @app.get("/metrics/download")
-async def download_metrics():
-    """Descarga el archivo CSV con todas las métricas"""
-    csv_file = Path("app/metrics/messages.csv")
+async def download_metrics(
+    agent: Optional[str] = None,
+    date_from: Optional[str] = Query(None, alias="from"),
+    date_to: Optional[str] = Query(None, alias="to")
+):
+    """Descarga en streaming el CSV de mensajes (opcionalmente filtrado por agente y fechas)"""
+    date_from = _parse_date_param(date_from, "from")
+    date_to = _parse_date_param(date_to, "to")
+    
+    # Escribir antes las filas que aún estén en la cola del escritor
+    await asyncio.to_thread(metrics_service.flush)
     
-    if not csv_file.exists():
+    if not await asyncio.to_thread(metrics_service.list_segments):
         raise HTTPException(status_code=404, detail="Archivo de métricas no encontrado")
     
-    return FileResponse(
-        path=csv_file,
-        filename="chatbot_metrics.csv",
-        media_type="text/csv"
+    # El CSV se genera al vuelo y no tiene tamaño conocido: para reanudar, /metrics/segments/{nombre}
+    return StreamingResponse(
+        metrics_service.iter_csv(agent, date_from, date_to),
+        media_type="text/csv",
+        headers={
+            "Content-Disposition": 'attachment; filename="chatbot_metrics.csv"',
+            "Accept-Ranges": "none"
+        }
     )
 
 
+@app.get("/metrics/summary")
+async def metrics_summary(
+    agent: Optional[str] = None,
+    date_from: Optional[str] = Query(None, alias="from"),
+    date_to: Optional[str] = Query(None, alias="to")
+):
+    """Mensajes y conversaciones por agente y día (desde contadores agregados, sin leer las filas)"""
+    return await asyncio.to_thread(
+        metrics_service.summary, agent, _parse_date_param(date_from, "from"), _parse_date_param(date_to, "to")
+    )
+
+
+@app.get("/metrics/segments")
+async def list_metrics_segments():
+    """Lista los segmentos diarios de métricas"""
+    return {"segments": await asyncio.to_thread(metrics_service.list_segments)}
+
+
+@app.get("/metrics/segments/{name}")
+async def download_metrics_segment(name: str):
+    """Descarga un segmento diario tal cual (soporta peticiones Range para reanudar descargas)"""
+    path = await asyncio.to_thread(metrics_service.get_segment_path, name)
+    if path is None:
+        raise HTTPException(status_code=404, detail=f"Segmento '{name}' no encontrado")
+    media_type = "application/gzip" if name.endswith(".gz") else "application/vnd.apache.parquet"
+    return FileResponse(path=path, filename=name, media_type=media_type)
+
+
+@app.get("/metrics/runtime")
+async def runtime_metrics():
+    """Métricas en memoria del proceso (pools de conexiones, cola de Pinecone, cachés, etc.)"""
+    return {
+        "shared_state": shared_store.stats(),
+        "agent_store": config_manager.store.stats(),
+        "widget": widget_asset.stats(),
+        "widget_bootstraps": widget_bootstraps.stats(),
+        "http_pool": http_pool.stats(),
+        "pinecone": pinecone_service.stats(),
+        "local_indexes": local_index_service.stats(),
+        "embedding_cache": embedding_cache.stats(),
+        "search_cache": search_cache.stats(),
+        "tools": tool_registry.stats(),
+        "answer_cache": answer_cache.stats(),
+        "admission": admission.stats(),
+        "resilience": resilience.stats(),
+        "single_flight": single_flight.stats(),
+        "conversations": conversation_store.stats(),
+        "metrics_writer": metrics_service.stats()
+    }
+
+
+
+@app.get("/metrics/prometheus", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Métricas en formato de texto de Prometheus (latencias por etapa, por ruta y de los servicios)"""
+    pinecone_stats = pinecone_service.stats()
+    tool_stats = tool_registry.stats()
+    cache_stats = {
+        "embedding": embedding_cache.stats(),
+        "search": search_cache.stats(),
+        "answer": answer_cache.stats()
+    }
+    metrics_stats = metrics_service.stats()
+    upstream_stats = resilience.stats()
+    coalescing_stats = single_flight.stats()["groups"]
+    # Con varios workers las latencias incluyen las de todos; el resto de métricas son de este worker
+    workers = _other_workers_metrics() if shared_store.enabled else []
+    sections = [
+        STAGE_LATENCY.render(worker["stages"] for worker in workers),
+        REQUEST_LATENCY.render(worker["requests"] for worker in workers),
+        format_histograms(
+            "agentclic_pinecone_wait_seconds", "Tiempo en cola de las queries de Pinecone", (),
+            {(): pinecone_service.wait_latency}
+        ),
+        format_histograms(
+            "agentclic_pinecone_query_seconds", "Duración de las queries de Pinecone", (),
+            {(): pinecone_service.query_latency}
+        ),
+        format_histograms(
+            "agentclic_local_index_query_seconds", "Duración de las búsquedas en índices locales", (),
+            {(): local_index_service.query_latency}
+        ),
+        format_histograms(
+            "agentclic_tool_duration_seconds", "Duración de cada tool", ("tool",),
+            tool_registry.latency_histograms()
+        ),
+        format_samples(
+            "agentclic_tool_errors_total", "Tool calls con error o timeout", "counter", ("tool",),
+            {(name,): stats["errors"] + stats["timeouts"] for name, stats in tool_stats.items()}
+        ),
+        format_samples(
+            "agentclic_cache_hits_total", "Aciertos de las cachés", "counter", ("cache",),
+            {(name,): stats["hits"] for name, stats in cache_stats.items()}
+        ),
+        format_samples(
+            "agentclic_cache_misses_total", "Fallos de las cachés", "counter", ("cache",),
+            {(name,): stats["misses"] for name, stats in cache_stats.items()}
+        ),
+        format_samples(
+            "agentclic_pinecone_queue_depth", "Queries de Pinecone esperando un hilo", "gauge", (),
+            {(): pinecone_stats["queue_depth"]}
+        ),
+        format_samples(
+            "agentclic_admission_queue_depth", "Peticiones esperando hueco por agente o host upstream", "gauge",
+            ("scope", "name"), admission.samples("queue_depth")
+        ),
+        format_samples(
+            "agentclic_admission_in_flight", "Peticiones en curso por agente o host upstream", "gauge",
+            ("scope", "name"), admission.samples("active")
+        ),
+        format_samples(
+            "agentclic_admission_rejected_total", "Peticiones rechazadas con 429 (cola llena o espera agotada)",
+            "counter", ("scope", "name"), admission.samples("rejected", "timeouts")
+        ),
+        format_samples(
+            "agentclic_circuit_state", "Estado del circuit breaker (0 = cerrado, 1 = semiabierto, 2 = abierto)", "gauge",
+            ("upstream",),
+            {(name,): CIRCUIT_STATE_VALUES[stats["state"]] for name, stats in upstream_stats.items()}
+        ),
+        format_samples(
+            "agentclic_upstream_retries_total", "Reintentos de llamadas a upstreams", "counter", ("upstream",),
+            {(name,): stats["retries"] for name, stats in upstream_stats.items()}
+        ),
+        format_samples(
+            "agentclic_upstream_hedges_total", "Peticiones de cobertura (hedging) lanzadas", "counter", ("upstream",),
+            {(name,): stats["hedges"] for name, stats in upstream_stats.items()}
+        ),
+        format_samples(
+            "agentclic_single_flight_calls_total", "Llamadas ejecutadas por la capa single-flight", "counter",
+            ("group",), {(group,): stats["calls"] for group, stats in coalescing_stats.items()}
+        ),
+        format_samples(
+            "agentclic_single_flight_coalesced_total", "Peticiones que esperaron una llamada idéntica en curso",
+            "counter", ("group",), {(group,): stats["coalesced"] for group, stats in coalescing_stats.items()}
+        ),
+        format_samples(
+            "agentclic_metrics_dropped_total", "Filas de métricas descartadas por cola llena", "counter", (),
+            {(): metrics_stats["dropped"]}
+        ),
+        format_samples(
+            "agentclic_log_records_dropped_total", "Registros de log descartados por cola llena", "counter", (),
+            {(): dropped_log_records()}
+        ),
+    ]
+    return PlainTextResponse("".join(sections), media_type="text/plain; version=0.0.4")
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000) 
\ No newline at end of file
@@ -0,0 +1,410 @@
+from typing import List, Optional, Tuple, Union
+
+# Resultado de un intento de match que necesita más texto para decidirse
+_PARTIAL = object()
+
+_MatchResult = Union[None, object, Tuple[int, str]]
+
+
+class _InlinePass:
+    """Equivalente incremental de un re.sub inline de ChatService._convert_markdown_to_html.
+
+    Solo retiene texto desde el primer marcador cuyo match depende de lo que
+    todavía no ha llegado; todo lo anterior se emite en cuanto se recibe.
+    """
+
+    trigger = ""
+
+    def __init__(self):
+        self._pending = ""
+
+    def feed(self, text: str) -> str:
+        if not self._pending and self.trigger not in text:
+            return text
+        return self._process(self._pending + text, final=False)
+
+    def flush(self) -> str:
+        return self._process(self._pending, final=True)
+
+    def _match(self, buf: str, i: int) -> _MatchResult:
+        """Devuelve (fin, reemplazo), None si no hay match en i o _PARTIAL si aún no se sabe"""
+        raise NotImplementedError
+
+    def _process(self, buf: str, final: bool) -> str:
+        out: List[str] = []
+        i = 0
+        while True:
+            j = buf.find(self.trigger, i)
+            if j == -1:
+                out.append(buf[i:])
+                break
+
+            result = self._match(buf, j)
+            if result is _PARTIAL:
+                if not final:
+                    out.append(buf[i:j])
+                    self._pending = buf[j:]
+                    return "".join(out)
+                result = None
+
+            if result is None:
+                out.append(buf[i:j + 1])
+                i = j + 1
+            else:
+                end, replacement = result
+                out.append(buf[i:j])
+                out.append(replacement)
+                i = end
+
+        self._pending = ""
+        return "".join(out)
+
+
+class _LinkPass(_InlinePass):
+    """r'\\[([^\\]]+)\\]\\(([^)]+)\\)' -> <a href=...>"""
+
+    trigger = "["
+
+    def _match(self, buf: str, i: int) -> _MatchResult:
+        n = len(buf)
+        close_text = buf.find("]", i + 1)
+        if close_text == -1:
+            return _PARTIAL
+        if close_text == i + 1:
+            return None
+        open_url = close_text + 1
+        if open_url >= n:
+            return _PARTIAL
+        if buf[open_url] != "(":
+            return None
+        close_url = buf.find(")", open_url + 1)
+        if close_url == -1:
+            return _PARTIAL
+        if close_url == open_url + 1:
+            return None
+
+        link_text = buf[i + 1:close_text]
+        url = buf[open_url + 1:close_url]
+        # Asegurar que la URL tenga protocolo
+        if not url.startswith(("http://", "https://")):
+            url = "https://" + url
+        return close_url + 1, f'<a href="{url}" target="_blank" rel="noopener noreferrer">{link_text}</a>'
+
+
+class _BoldPass(_InlinePass):
+    """r'\\*\\*([^*]+)\\*\\*' -> <strong>"""
+
+    trigger = "*"
+
+    def _match(self, buf: str, i: int) -> _MatchResult:
+        n = len(buf)
+        if i + 1 >= n:
+            return _PARTIAL
+        if buf[i + 1] != "*":
+            return None
+        close = buf.find("*", i + 2)
+        if close == -1:
+            return _PARTIAL
+        if close == i + 2:
+            return None
+        if close + 1 >= n:
+            return _PARTIAL
+        if buf[close + 1] != "*":
+            return None
+        return close + 2, f"<strong>{buf[i + 2:close]}</strong>"
+
+
+class _ItalicPass(_InlinePass):
+    """r'\\*([^*]+)\\*' -> <em>"""
+
+    trigger = "*"
+
+    def _match(self, buf: str, i: int) -> _MatchResult:
+        close = buf.find("*", i + 1)
+        if close == -1:
+            return _PARTIAL
+        if close == i + 1:
+            return None
+        return close + 1, f"<em>{buf[i + 1:close]}</em>"
+
+
+class _LineRenderer:
+    """Pasos 4 y 5 de _convert_markdown_to_html (listas anidadas y saltos de línea) en streaming.
+
+    El tipo de cada línea (vacía, texto o elemento de lista) se decide con sus
+    primeros caracteres; a partir de ahí el contenido se emite según llega,
+    reteniendo solo el espacio en blanco final que strip() eliminaría.
+    """
+
+    _LIST_PREFIXES = ("<ul>", "</ul>", "<li>")
+
+    def __init__(self):
+        self._list_stack: List[int] = []
+        self._has_parts = False
+        self._last_tail = ""  # Final de la última parte emitida (para los endswith)
+        self._line_raw = ""  # Línea actual mientras su tipo no está decidido
+        self._line_kind: Optional[str] = None  # None (sin decidir), "text" o "item"
+        self._held_ws = ""
+        self._out: List[str] = []
+
+    def feed(self, text: str) -> str:
+        if self._line_kind is not None and "\n" not in text:
+            # Caso habitual en streaming: más contenido de una línea ya decidida
+            self._stream_content(text)
+            return self._take()
+        lines = text.split("\n")
+        for line in lines[:-1]:
+            if self._line_kind is None and not self._line_raw:
+                self._render_line(line)
+            else:
+                self._add(line)
+                self._end_line()
+        self._add(lines[-1])
+        return self._take()
+
+    def flush(self) -> str:
+        self._end_line()
+        while self._list_stack:
+            self._part("</ul>")
+            self._list_stack.pop()
+        return self._take()
+
+    def _render_line(self, line: str):
+        """Procesa de una vez una línea que ha llegado completa"""
+        stripped_line = line.strip()
+        if stripped_line.startswith("- "):
+            self._begin_item((len(line) - len(line.lstrip())) // 2, stripped_line[2:].lstrip())
+            self._end_line()
+        elif stripped_line:
+            self._begin_text(stripped_line)
+            self._line_kind = None
+        else:
+            self._decide(end_of_line=True)
+
+    def _take(self) -> str:
+        out = "".join(self._out)
+        self._out = []
+        return out
+
+    def _part(self, part: str):
+        self._out.append(part)
+        self._has_parts = True
+        self._last_tail = part[-8:]
+
+    def _start_part(self, prefix: str = ""):
+        self._has_parts = True
+        self._last_tail = ""
+        if prefix:
+            self._extend_part(prefix)
+
+    def _extend_part(self, text: str):
+        self._out.append(text)
+        self._last_tail = (self._last_tail + text)[-8:]
+
+    def _stream_content(self, text: str):
+        text = self._held_ws + text
+        content = text.rstrip()
+        self._held_ws = text[len(content):]
+        if content:
+            self._extend_part(content)
+
+    def _add(self, text: str):
+        if not text:
+            return
+        if self._line_kind is not None:
+            self._stream_content(text)
+            return
+        self._line_raw += text
+        self._decide(end_of_line=False)
+
+    def _end_line(self):
+        if self._line_kind is None:
+            self._decide(end_of_line=True)
+        if self._line_kind == "item":
+            self._extend_part("</li>")
+        self._line_raw = ""
+        self._line_kind = None
+        self._held_ws = ""
+
+    def _decide(self, end_of_line: bool):
+        raw = self._line_raw
+        content = raw.lstrip()
+
+        if not content:
+            if end_of_line:
+                # Línea vacía - preservar como separador de párrafos (solo fuera de listas)
+                if not self._list_stack and self._has_parts and not self._last_tail.endswith("<br><br>"):
+                    self._part("<br><br>")
+            return
+
+        if content.startswith("-"):
+            if len(content) == 1 and not end_of_line:
+                return
+            if content.startswith("- "):
+                list_item = content[2:].lstrip()
+                if list_item:
+                    self._begin_item((len(raw) - len(content)) // 2, list_item)
+                    return
+                if not end_of_line:
+                    return
+
+        if not end_of_line and len(content) < 5 and any(p.startswith(content) for p in self._LIST_PREFIXES):
+            return
+        self._begin_text(content)
+
+    def _begin_item(self, indent_level: int, list_item: str):
+        # Manejar niveles de anidación
+        while len(self._list_stack) > indent_level:
+            self._part("</ul>")
+            self._list_stack.pop()
+        if len(self._list_stack) != indent_level:
+            # Nuevo nivel de anidación
+            self._part("<ul>")
+            self._list_stack.append(indent_level)
+
+        self._line_kind = "item"
+        self._start_part("<li>")
+        self._stream_content(list_item)
+
+    def _begin_text(self, content: str):
+        # No es un elemento de lista, cerrar todas las listas abiertas
+        while self._list_stack:
+            self._part("</ul>")
+            self._list_stack.pop()
+
+        if not content.startswith(self._LIST_PREFIXES):
+            if self._has_parts and not self._last_tail.endswith(("<ul>", "</ul>", "<br>", "<br><br>")):
+                self._part("<br>")
+
+        self._line_kind = "text"
+        self._start_part()
+        self._stream_content(content)
+
+
+class _BrRunCollapser:
+    """r'(<br>\\s*){3,}' -> '<br><br>'"""
+
+    def __init__(self):
+        self._pending = ""
+
+    def feed(self, text: str) -> str:
+        if not self._pending and "<" not in text:
+            return text
+        return self._process(self._pending + text, final=False)
+
+    def flush(self) -> str:
+        return self._process(self._pending, final=True)
+
+    def _process(self, buf: str, final: bool) -> str:
+        out: List[str] = []
+        n = len(buf)
+        i = 0
+        while True:
+            j = buf.find("<br>", i)
+            if j == -1:
+                # Retener un posible "<br>" cortado al final del fragmento
+                hold = 0
+                if not final:
+                    for length in (3, 2, 1):
+                        if n - length >= i and buf.endswith("<br>"[:length]):
+                            hold = length
+                            break
+                out.append(buf[i:n - hold])
+                self._pending = buf[n - hold:]
+                return "".join(out)
+            out.append(buf[i:j])
+
+            pos = j
+            count = 0
+            while buf.startswith("<br>", pos):
+                count += 1
+                pos += 4
+                while pos < n and buf[pos].isspace():
+                    pos += 1
+
+            # La racha puede continuar con el siguiente fragmento
+            if not final and (pos == n or (n - pos < 4 and "<br>".startswith(buf[pos:]))):
+                self._pending = buf[j:]
+                return "".join(out)
+
+            out.append("<br><br>" if count >= 3 else buf[j:pos])
+            i = pos
+
+
+class _LiteralReplacer:
+    """Equivalente incremental de re.sub con un patrón literal"""
+
+    def __init__(self, old: str, new: str):
+        self._old = old
+        self._new = new
+        self._pending = ""
+
+    def feed(self, text: str) -> str:
+        if not self._pending and self._old[0] not in text:
+            return text
+        buf = self._pending + text
+        out: List[str] = []
+        i = 0
+        while True:
+            j = buf.find(self._old, i)
+            if j == -1:
+                break
+            out.append(buf[i:j])
+            out.append(self._new)
+            i = j + len(self._old)
+
+        # Retener el sufijo que podría ser el comienzo de otra aparición
+        hold = 0
+        for length in range(min(len(self._old) - 1, len(buf) - i), 0, -1):
+            if buf.endswith(self._old[:length]):
+                hold = length
+                break
+        out.append(buf[i:len(buf) - hold])
+        self._pending = buf[len(buf) - hold:]
+        return "".join(out)
+
+    def flush(self) -> str:
+        out = self._pending
+        self._pending = ""
+        return out
+
+
+class MarkdownStreamConverter:
+    """Convierte markdown a HTML de forma incremental.
+
+    Recibe el texto en fragmentos arbitrarios y devuelve en cada llamada el HTML
+    que ya no puede cambiar. La concatenación de todo lo emitido es idéntica a
+    ChatService._convert_markdown_to_html aplicado al texto completo.
+    """
+
+    def __init__(self):
+        self._stages = [
+            _LinkPass(),
+            _BoldPass(),
+            _ItalicPass(),
+            _LineRenderer(),
+            _BrRunCollapser(),
+            _LiteralReplacer("<br></ul>", "</ul>"),  # Limpiar <br> antes de </ul>
+            _LiteralReplacer("<ul><br>", "<ul>"),  # Limpiar <br> después de <ul>
+        ]
+
+    def feed(self, chunk: str) -> str:
+        """Procesa un fragmento y devuelve el HTML que ya es definitivo"""
+        for stage in self._stages:
+            if not chunk:
+                return ""
+            chunk = stage.feed(chunk)
+        return chunk
+
+    def finish(self) -> str:
+        """Cierra el stream y devuelve el HTML pendiente"""
+        chunk = ""
+        for stage in self._stages:
+            chunk = stage.feed(chunk) + stage.flush() if chunk else stage.flush()
+        return chunk
+
+
+def convert_markdown_to_html(text: str) -> str:
+    """Convierte un texto completo de markdown a HTML"""
+    converter = MarkdownStreamConverter()
+    return converter.feed(text) + converter.finish()
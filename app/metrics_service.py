@@ -1,28 +1,510 @@
 import csv
+import gzip
+import heapq
+import io
+import json
+import os
+import queue
+import re
 import threading
-from datetime import datetime
+import time
+import zlib
+from collections import Counter
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
 from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+from .logging_config import get_logger
+from .shared_state import shared_store, worker_id
+from .telemetry import STAGE_LATENCY
+
+# Parquet es opcional (requiere 'pyarrow'); sin él los segmentos se quedan en CSV comprimido
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PARQUET_AVAILABLE = True
+except ImportError:
+    PARQUET_AVAILABLE = False
+
+# Bloqueo de ficheros entre procesos (solo POSIX); sin él no se coordinan los cierres de día entre workers
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = get_logger(__name__)
+
+CSV_HEADER = ['fecha_hora', 'agente', 'conversation_id']
+_SEGMENT_RE = re.compile(r"^messages-(\d{4}-\d{2}-\d{2})(?:\.w\d+)?\.(csv\.gz|parquet)$")
+
+
+def _complete_members(data: bytes) -> Tuple[bytes, int]:
+    """Descomprime los miembros gzip completos de data; devuelve (contenido, bytes consumidos)"""
+    chunks = []
+    consumed = 0
+    while consumed < len(data):
+        decompressor = zlib.decompressobj(wbits=31)
+        try:
+            chunk = decompressor.decompress(data[consumed:])
+        except zlib.error:
+            break
+        if not decompressor.eof:
+            break  # Miembro a medio escribir por otro worker
+        chunks.append(chunk)
+        consumed = len(data) - len(decompressor.unused_data)
+    return b"".join(chunks), consumed
+
 
 class MetricsService:
+    """Registro de mensajes en segmentos diarios comprimidos con escritura en segundo plano.
+
+    record_message solo encola la fila (nunca bloquea ni hace I/O en el event loop);
+    un hilo escritor vacía la cola por lotes cuando se llena el lote, cada
+    METRICS_FLUSH_INTERVAL segundos y al apagar. Si la cola está llena la fila se
+    descarta y se contabiliza en 'dropped'.
+
+    Cada día se escribe en 'segments/messages-AAAA-MM-DD.csv.gz' (mismas columnas que
+    el antiguo messages.csv). Al cambiar de día el segmento se cierra: se guarda su
+    resumen por agente en un '.summary.json', se convierte a Parquet si está
+    configurado y se borran los segmentos más antiguos que METRICS_RETENTION_DAYS.
+
+    Con varios workers (shared_state) cada proceso escribe su propio segmento
+    ('messages-AAAA-MM-DD.w<pid>.csv.gz') y las consultas los combinan al leer: los
+    contadores de los días abiertos se actualizan leyendo solo lo añadido desde la
+    consulta anterior. Un único worker (con un flock) cierra cada día cuando ningún
+    segmento del día se ha modificado en los últimos METRICS_CLOSE_GRACE segundos.
+    """
+
     def __init__(self):
-        self.csv_file = Path("app/metrics/messages.csv")
-        self.csv_file.parent.mkdir(exist_ok=True)
-        self._lock = threading.Lock()
-        
-        # Crear archivo con headers si no existe
-        if not self.csv_file.exists():
-            with open(self.csv_file, 'w', newline='', encoding='utf-8') as f:
-                writer = csv.writer(f)
-                writer.writerow(['fecha_hora', 'agente', 'conversation_id'])
-    
+        self.metrics_dir = Path(os.getenv("METRICS_DIR", "app/metrics"))
+        self.segments_dir = self.metrics_dir / "segments"
+        self.legacy_csv_file = self.metrics_dir / "messages.csv"
+        self.segments_dir.mkdir(parents=True, exist_ok=True)
+        self.batch_size = int(os.getenv("METRICS_BATCH_SIZE", "200"))
+        self.flush_interval = float(os.getenv("METRICS_FLUSH_INTERVAL", "1.0"))
+        self.retention_days = int(os.getenv("METRICS_RETENTION_DAYS", "90"))  # 0 = sin límite
+        self.parquet = os.getenv("METRICS_SEGMENT_FORMAT", "csv.gz") == "parquet"
+        if self.parquet and not PARQUET_AVAILABLE:
+            logger.warning("[Metrics] METRICS_SEGMENT_FORMAT=parquet requiere 'pyarrow'; se usará csv.gz")
+            self.parquet = False
+        self.per_worker = shared_store.enabled
+        self.close_grace = float(os.getenv("METRICS_CLOSE_GRACE", str(max(60.0, 10 * self.flush_interval))))
+        self._queue: "queue.Queue" = queue.Queue(maxsize=int(os.getenv("METRICS_QUEUE_SIZE", "10000")))
+        self._write_lock = threading.Lock()
+        self._counters_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.recorded = 0
+        self.written = 0
+        self.dropped = 0
+        self.write_errors = 0
+
+        # Contadores agregados: días cerrados (desde los .summary.json) y días abiertos (por conversación)
+        self._closed_days: Dict[str, Dict[str, Dict[str, int]]] = {}  # día -> agente -> {messages, conversations}
+        self._open_days: Dict[str, Dict[str, Counter]] = {}  # día -> agente -> mensajes por conversation_id
+        self._offsets: Dict[str, int] = {}  # Con varios workers: segmento -> bytes ya contabilizados
+        self._closed_through: Optional[str] = None  # Día en el que se comprobó que los anteriores están cerrados
+
+        with self._write_lock:
+            with self._exclusive(blocking=True):
+                self._migrate_legacy_csv()
+            self._load_segments()
+
+    # ---- Segmentos ----
+
+    def _segment_path(self, day: str, extension: str = "csv.gz") -> Path:
+        """Segmento del día en el que escribe este proceso (uno por worker si hay varios)"""
+        suffix = f".{worker_id()}" if self.per_worker else ""
+        return self.segments_dir / f"messages-{day}{suffix}.{extension}"
+
+    def _summary_path(self, day: str) -> Path:
+        return self.segments_dir / f"messages-{day}.summary.json"
+
+    def _segment_files(self) -> List[tuple]:
+        """(día, ruta) de los segmentos de datos, ordenados por fecha"""
+        segments = []
+        for path in self.segments_dir.iterdir():
+            match = _SEGMENT_RE.match(path.name)
+            if match:
+                segments.append((match.group(1), path))
+        return sorted(segments)
+
+    def _day_files(self, day: str) -> List[Path]:
+        return [path for segment_day, path in self._segment_files() if segment_day == day]
+
+    @contextmanager
+    def _exclusive(self, blocking: bool = False):
+        """Con varios workers, bloqueo entre procesos de las tareas de mantenimiento; produce False si
+        otro worker lo tiene (solo sin blocking). Con un solo proceso siempre produce True."""
+        if not self.per_worker or fcntl is None:
+            yield True
+            return
+        with open(self.segments_dir / ".maintenance.lock", "a") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _read_segment(path: Path) -> Iterator[List[str]]:
+        """Filas (fecha_hora, agente, conversation_id) de un segmento"""
+        if path.name.endswith(".parquet"):
+            table = pq.read_table(path)
+            yield from zip(*(table.column(name).to_pylist() for name in CSV_HEADER))
+            return
+        with gzip.open(path, "rt", newline="", encoding="utf-8") as f:
+            reader = csv.reader(f)
+            next(reader, None)  # Cabecera
+            try:
+                yield from reader
+            except EOFError:
+                return  # Último lote a medio escribir por otro worker: se leerá en la próxima consulta
+
+    def _migrate_legacy_csv(self):
+        """Reparte el messages.csv anterior en segmentos diarios (solo la primera vez)"""
+        if not self.legacy_csv_file.exists():
+            return
+        rows_by_day: Dict[str, list] = {}
+        with open(self.legacy_csv_file, "r", newline="", encoding="utf-8") as f:
+            reader = csv.reader(f)
+            next(reader, None)
+            for row in reader:
+                if len(row) == 3:
+                    rows_by_day.setdefault(row[0][:10], []).append(row)
+        for day, rows in rows_by_day.items():
+            self._append_segment(day, rows)
+        self.legacy_csv_file.rename(self.legacy_csv_file.with_suffix(".csv.migrated"))
+        logger.info("[Metrics] messages.csv migrado a %d segmentos diarios", len(rows_by_day))
+
+    def _load_segments(self):
+        """Carga los resúmenes de los días cerrados y los contadores de los días abiertos"""
+        today = self._today()
+        for day, path in self._segment_files():
+            summary_path = self._summary_path(day)
+            if day < today and summary_path.exists():
+                self._closed_days[day] = json.loads(summary_path.read_text(encoding="utf-8"))
+                continue
+            if self.per_worker:
+                continue  # Se cuentan abajo, guardando hasta dónde se ha leído cada segmento
+            counters = self._open_days.setdefault(day, {})
+            for _, agent_id, conversation_id in self._read_segment(path):
+                counters.setdefault(agent_id, Counter())[conversation_id] += 1
+        if self.per_worker:
+            self._refresh_open_days()
+        if self._close_past_days():
+            self._closed_through = today
+
+    def _refresh_open_days(self):
+        """Con varios workers: suma a los contadores lo añadido a los segmentos abiertos desde la última lectura"""
+        today = self._today()
+        with self._counters_lock:
+            for day, path in self._segment_files():
+                if day in self._closed_days or not path.name.endswith(".csv.gz"):
+                    continue
+                summary_path = self._summary_path(day)
+                if day < today and summary_path.exists():
+                    # Día cerrado por otro worker
+                    self._closed_days[day] = json.loads(summary_path.read_text(encoding="utf-8"))
+                    self._open_days.pop(day, None)
+                    self._forget_offsets(day)
+                    continue
+                offset = self._offsets.get(path.name, 0)
+                try:
+                    with open(path, "rb") as f:
+                        f.seek(offset)
+                        data = f.read()
+                except FileNotFoundError:
+                    continue
+                content, consumed = _complete_members(data)
+                self._offsets[path.name] = offset + consumed
+                counters = self._open_days.setdefault(day, {})
+                for row in csv.reader(io.StringIO(content.decode("utf-8"), newline="")):
+                    if len(row) == 3 and row != CSV_HEADER:
+                        counters.setdefault(row[1], Counter())[row[2]] += 1
+
+    def _forget_offsets(self, day: str):
+        prefix = f"messages-{day}."
+        self._offsets = {name: offset for name, offset in self._offsets.items() if not name.startswith(prefix)}
+
+    def _append_segment(self, day: str, rows: list):
+        """Añade filas al segmento del día (cada escritura es un miembro gzip nuevo)"""
+        path = self._segment_path(day)
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if not path.exists():
+            writer.writerow(CSV_HEADER)
+        writer.writerows(rows)
+        with open(path, "ab") as f:
+            f.write(gzip.compress(buffer.getvalue().encode("utf-8")))
+
+    def _close_day(self, day: str):
+        """Guarda el resumen del día, lo convierte a Parquet si procede y deja de contar por conversación"""
+        counters = self._open_days.get(day, {})
+        summary = {
+            agent_id: {"messages": sum(conversations.values()), "conversations": len(conversations)}
+            for agent_id, conversations in counters.items()
+        }
+        # Escritura atómica: otros workers pueden leer el resumen en cualquier momento
+        summary_path = self._summary_path(day)
+        temporary = summary_path.with_name(f"{summary_path.name}.{worker_id()}.tmp")
+        temporary.write_text(json.dumps(summary, ensure_ascii=False), encoding="utf-8")
+        os.replace(temporary, summary_path)
+
+        for segment in self._day_files(day):
+            if self.parquet and segment.name.endswith(".csv.gz"):
+                columns = list(zip(*self._read_segment(segment))) or [[], [], []]
+                table = pa.table({name: pa.array(column, type=pa.string()) for name, column in zip(CSV_HEADER, columns)})
+                pq.write_table(table, segment.with_name(segment.name[:-len("csv.gz")] + "parquet"), compression="zstd")
+                segment.unlink()
+
+        with self._counters_lock:
+            self._closed_days[day] = summary
+            self._open_days.pop(day, None)
+            self._forget_offsets(day)
+
+    def _close_past_days(self) -> bool:
+        """Cierra los días anteriores a hoy; devuelve False si alguno queda pendiente (con varios
+        workers: otro worker está cerrando o aún puede escribir en él)"""
+        today = self._today()
+        closed_all = True
+        with self._exclusive() as acquired:
+            if not acquired:
+                return False
+            if self.per_worker:
+                self._refresh_open_days()
+            for day in sorted(self._open_days):
+                if day >= today:
+                    continue
+                if self.per_worker and not self._is_idle(day):
+                    closed_all = False
+                    continue
+                try:
+                    self._close_day(day)
+                except OSError as e:
+                    closed_all = False
+                    logger.error("[Metrics] ERROR cerrando el segmento %s: %s", day, e)
+            self._apply_retention(today)
+        return closed_all
+
+    def _is_idle(self, day: str) -> bool:
+        """Ningún worker ha escrito en los segmentos del día durante el margen de cierre"""
+        threshold = time.time() - self.close_grace
+        try:
+            return all(path.stat().st_mtime < threshold for path in self._day_files(day))
+        except FileNotFoundError:
+            return False
+
+    def _apply_retention(self, today: str):
+        if not self.retention_days:
+            return
+        oldest = (date.fromisoformat(today) - timedelta(days=self.retention_days)).isoformat()
+        for day, path in self._segment_files():
+            if day < oldest:
+                path.unlink(missing_ok=True)
+                self._summary_path(day).unlink(missing_ok=True)
+                with self._counters_lock:
+                    self._closed_days.pop(day, None)
+                logger.info("[Metrics] Segmento %s eliminado por retención (%d días)", path.name, self.retention_days)
+
+    @staticmethod
+    def _today() -> str:
+        return datetime.now().strftime('%Y-%m-%d')
+
+    # ---- Escritura en segundo plano ----
+
+    def start(self):
+        """Arranca el hilo escritor (se llama en el arranque de la aplicación)"""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name="metrics-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Detiene el hilo escritor y escribe las filas pendientes"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.flush()
+
     def record_message(self, agent_id: str, conversation_id: str):
-        """Añade una fila al CSV por cada mensaje"""
-        with self._lock:
-            with open(self.csv_file, 'a', newline='', encoding='utf-8') as f:
-                writer = csv.writer(f)
-                # Formato: YYYY-MM-DD HH:MM:SS
-                timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                writer.writerow([timestamp, agent_id, conversation_id])
+        """Encola una fila por cada mensaje"""
+        if self._thread is None:
+            self.start()
+        # Formato: YYYY-MM-DD HH:MM:SS
+        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        try:
+            self._queue.put_nowait((timestamp, agent_id, conversation_id))
+            self.recorded += 1
+        except queue.Full:
+            self.dropped += 1
+
+    def _drain(self) -> list:
+        rows = []
+        while len(rows) < self.batch_size:
+            try:
+                rows.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return rows
+
+    def _write_rows(self, rows: list):
+        if not rows:
+            return
+        rows_by_day: Dict[str, list] = {}
+        for row in rows:
+            rows_by_day.setdefault(row[0][:10], []).append(row)
+        started_at = time.perf_counter()
+        try:
+            for day, day_rows in rows_by_day.items():
+                self._append_segment(day, day_rows)
+            self.written += len(rows)
+            STAGE_LATENCY.labels("metrics_flush").observe(time.perf_counter() - started_at)
+        except OSError as e:
+            self.write_errors += 1
+            logger.error("[Metrics] ERROR escribiendo %d filas en %s: %s", len(rows), self.segments_dir, e)
+            return
+
+        if self.per_worker:
+            # Los contadores se leen de los segmentos de todos los workers en cada consulta
+            today = self._today()
+            if self._closed_through != today and self._close_past_days():
+                self._closed_through = today
+            return
+
+        with self._counters_lock:
+            for timestamp, agent_id, conversation_id in rows:
+                day_counters = self._open_days.setdefault(timestamp[:10], {})
+                day_counters.setdefault(agent_id, Counter())[conversation_id] += 1
+        if any(day < self._today() for day in self._open_days):
+            self._close_past_days()
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                rows = [self._queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+            # Completar el lote o esperar como mucho flush_interval antes de escribir.
+            # El lock se toma ya aquí para que flush() espere a este lote y respete el orden
+            with self._write_lock:
+                deadline = time.monotonic() + self.flush_interval
+                while len(rows) < self.batch_size and not self._stop_event.is_set():
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        rows.append(self._queue.get(timeout=remaining))
+                    except queue.Empty:
+                        break
+                self._write_rows(rows)
+
+    def flush(self):
+        """Escribe todas las filas pendientes (bloqueante, fuera del event loop)"""
+        with self._write_lock:
+            while not self._queue.empty():
+                self._write_rows(self._drain())
+
+    # ---- Consultas ----
+
+    def summary(self, agent_id: Optional[str] = None, date_from: Optional[str] = None,
+                date_to: Optional[str] = None) -> Dict:
+        """Mensajes y conversaciones por día y agente a partir de los contadores agregados.
+
+        Las conversaciones se cuentan como únicas dentro de cada día. Con varios workers
+        primero se leen las filas nuevas de sus segmentos (I/O: llamar fuera del event loop).
+        """
+        if self.per_worker:
+            self._refresh_open_days()
+        with self._counters_lock:
+            daily = {day: {agent: dict(values) for agent, values in agents.items()}
+                     for day, agents in self._closed_days.items()}
+            for day, agents in self._open_days.items():
+                daily[day] = {
+                    agent: {"messages": sum(conversations.values()), "conversations": len(conversations)}
+                    for agent, conversations in agents.items()
+                }
+
+        days = {}
+        totals: Dict[str, Dict[str, int]] = {}
+        for day in sorted(daily):
+            if (date_from and day < date_from) or (date_to and day > date_to):
+                continue
+            agents = {agent: values for agent, values in daily[day].items()
+                      if agent_id is None or agent == agent_id}
+            if not agents:
+                continue
+            days[day] = agents
+            for agent, values in agents.items():
+                total = totals.setdefault(agent, {"messages": 0, "conversations": 0})
+                total["messages"] += values["messages"]
+                total["conversations"] += values["conversations"]
+
+        return {
+            "agent": agent_id,
+            "from": date_from,
+            "to": date_to,
+            "totals": totals,
+            "daily": days
+        }
+
+    def list_segments(self) -> List[Dict]:
+        return [
+            {"name": path.name, "date": day, "bytes": path.stat().st_size}
+            for day, path in self._segment_files()
+        ]
+
+    def get_segment_path(self, name: str) -> Optional[Path]:
+        """Ruta de un segmento por nombre (solo nombres válidos, sin rutas)"""
+        if not _SEGMENT_RE.match(name):
+            return None
+        path = self.segments_dir / name
+        return path if path.exists() else None
+
+    def iter_csv(self, agent_id: Optional[str] = None, date_from: Optional[str] = None,
+                 date_to: Optional[str] = None) -> Iterator[str]:
+        """Genera el CSV (formato del antiguo messages.csv) leyendo los segmentos del rango"""
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(CSV_HEADER)
+        paths_by_day: Dict[str, List[Path]] = {}
+        for day, path in self._segment_files():
+            if (date_from and day < date_from) or (date_to and day > date_to):
+                continue
+            paths_by_day.setdefault(day, []).append(path)
+        for day, paths in paths_by_day.items():
+            # Los segmentos de varios workers se intercalan por fecha_hora
+            rows = heapq.merge(*(self._read_segment(path) for path in paths), key=lambda row: row[0])
+            for row in rows:
+                if agent_id is None or row[1] == agent_id:
+                    writer.writerow(row)
+                if buffer.tell() >= 64 * 1024:
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+        yield buffer.getvalue()
+
+    def stats(self) -> dict:
+        return {
+            "recorded": self.recorded,
+            "written": self.written,
+            "pending": self._queue.qsize(),
+            "dropped": self.dropped,
+            "write_errors": self.write_errors,
+            "queue_size": self._queue.maxsize,
+            "batch_size": self.batch_size,
+            "flush_interval": self.flush_interval,
+            "segment_format": "parquet" if self.parquet else "csv.gz",
+            "retention_days": self.retention_days,
+            "per_worker_segments": self.per_worker,
+            "open_days": sorted(self._open_days),
+            "closed_days": len(self._closed_days)
+        }
 
 # Instancia global
-metrics_service = MetricsService() 
\ No newline at end of file
+metrics_service = MetricsService()
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, model_validator
 from typing import Optional, Dict, Any, List, Union
 from enum import Enum
 
@@ -63,8 +63,26 @@ class OpenAIConfig(BaseModel):
     max_output_tokens: int = 2000
     temperature: float = 0.3
     top_p: float = 1.0
-    tools: List[Dict[str, Any]] = []  # Tools configurables para OpenAI
+    tools: List[Dict[str, Any]] = []  # Tools configurables para OpenAI (las de tipo function con "handler" se ejecutan en local)
     pinecone_index: Optional[str] = None  # Nombre del índice de Pinecone para búsquedas semánticas
+    pinecone_index_version: Optional[str] = None  # Cambiarlo invalida los resultados cacheados del índice
+    local_index: Optional[str] = None  # Directorio de un índice vectorial local (python -m app.local_index); tiene prioridad sobre pinecone_index
+    search_cache_ttl: Optional[float] = None  # Segundos; None = SEARCH_CACHE_TTL, 0 = sin caché
+    search_mode: str = "vector"  # 'vector' o 'hybrid' (coseno + BM25 sobre la metadata; requiere local_index)
+    hybrid_vector_weight: float = 0.5  # Peso del coseno en modo hybrid (0-1); el resto es BM25
+    search_k: int = 20  # Resultados de semantic_search como máximo
+    search_min_score: Optional[float] = None  # Descarta los resultados con menos score (en modo hybrid, el combinado)
+    max_parallel_tool_calls: int = 4  # Tool calls simultáneas como máximo para este agente
+    tool_call_timeout: float = 20.0  # Segundos máximos por tool call (cada tool puede fijar su "timeout")
+    tool_max_output_chars: int = 50000  # Tamaño máximo del resultado de una tool (cada tool puede fijar "max_output_chars")
+
+    @model_validator(mode="after")
+    def _check_search_mode(self):
+        if self.search_mode not in ("vector", "hybrid"):
+            raise ValueError(f"search_mode '{self.search_mode}' no válido: 'vector' o 'hybrid'")
+        if self.search_mode == "hybrid" and not self.local_index:
+            raise ValueError("search_mode 'hybrid' requiere local_index (el índice BM25 se construye con el índice local)")
+        return self
 
 
 class N8NConfig(BaseModel):
@@ -72,6 +90,58 @@ class N8NConfig(BaseModel):
     webhook_url: str
 
 
+class HTTPPoolConfig(BaseModel):
+    """Límites del pool de conexiones HTTP hacia el upstream del agente"""
+    max_connections: int = 20
+    max_keepalive_connections: int = 10
+    keepalive_expiry: float = 30.0  # Segundos que una conexión ociosa se mantiene abierta
+    http2: bool = True  # Solo se usa si el upstream lo negocia (TLS + ALPN)
+
+
+class AnswerCacheConfig(BaseModel):
+    """Caché de respuestas a primeras preguntas (solo agentes openai, opt-in)"""
+    enabled: bool = False
+    ttl_seconds: float = 3600.0
+    max_entries: int = 500
+    max_temperature: float = 0.3  # Por encima de esta temperatura las respuestas no se cachean
+    similarity_threshold: Optional[float] = None  # p.ej. 0.95 activa la búsqueda de casi-duplicados por embeddings
+
+
+class ConversationStateConfig(BaseModel):
+    """Historial de la conversación guardado en el servidor (solo agentes openai, opt-in)"""
+    enabled: bool = False
+    max_turns: int = 6  # Turnos (pregunta + respuesta) que se envían como contexto en cada petición
+    max_context_chars: int = 12000  # Límite de caracteres del resumen + turnos enviados
+    summarize: bool = False  # Resume los turnos que salen de la ventana en lugar de descartarlos
+    summary_model: Optional[str] = None  # Modelo para los resúmenes (por defecto el del agente)
+    summary_max_tokens: int = 400
+
+
+class ConcurrencyConfig(BaseModel):
+    """Control de admisión hacia el upstream del agente: peticiones simultáneas y cola de espera acotada"""
+    max_concurrent: int = 10  # Peticiones del agente en curso a la vez
+    max_queue: int = 20  # Peticiones esperando turno; con la cola llena se responde 429 al momento
+    queue_timeout: float = 5.0  # Segundos máximos en cola antes de responder 429
+    retry_after: int = 2  # Segundos sugeridos al cliente en la cabecera Retry-After
+    upstream_max_concurrent: Optional[int] = None  # Límite compartido por todos los agentes del mismo host upstream
+    upstream_max_queue: int = 50
+
+
+class ResilienceConfig(BaseModel):
+    """Timeouts, reintentos, peticiones de cobertura (hedging) y circuit breaker hacia el upstream del agente"""
+    connect_timeout: float = 5.0  # Segundos para establecer la conexión
+    read_timeout: float = 30.0  # Segundos máximos sin recibir datos en cada intento
+    total_timeout: float = 45.0  # Presupuesto total de la llamada, reintentos incluidos (en streaming, hasta las cabeceras)
+    retries: int = 2  # Reintentos ante fallos reintentables (conexión, 429, 5xx)
+    retry_backoff: float = 0.25  # Espera base entre reintentos (exponencial con jitter)
+    retry_max_backoff: float = 2.0
+    idempotent: Optional[bool] = None  # None = solo los embeddings; el resto (respuestas con store, n8n, custom) solo reintenta si la petición no llegó. true acepta generaciones duplicadas
+    hedge: bool = False  # Lanza una segunda petición si la primera supera el p95 de latencia observado
+    hedge_min_delay: float = 0.2  # Espera mínima antes de la petición de cobertura (segundos)
+    breaker_failures: int = 5  # Fallos seguidos que abren el circuito; 0 = sin circuit breaker
+    breaker_reset_timeout: float = 30.0  # Segundos con el circuito abierto antes de dejar pasar una petición de prueba
+
+
 class AgentConfig(BaseModel):
     id: str
     name: str
@@ -86,6 +156,11 @@ class AgentConfig(BaseModel):
     custom_config: Optional[CustomBackendConfig] = None  # Solo para type=custom
     openai_config: Optional[OpenAIConfig] = None  # Solo para type=openai
     n8n_config: Optional[N8NConfig] = None  # Solo para type=n8n
+    http_pool: Optional[HTTPPoolConfig] = None  # Límites de conexiones hacia el upstream
+    answer_cache: Optional[AnswerCacheConfig] = None  # Caché de respuestas a preguntas frecuentes
+    conversation_state: Optional[ConversationStateConfig] = None  # Historial en el servidor en lugar de previous_response_id
+    concurrency: Optional[ConcurrencyConfig] = None  # Límite de peticiones simultáneas y cola de espera
+    resilience: Optional[ResilienceConfig] = None  # Timeouts, reintentos y circuit breaker (valores por defecto si se omite)
     
     def to_public_config(self) -> PublicAgentConfig:
         """Convierte la configuración completa a configuración pública"""
@@ -0,0 +1,127 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+from pinecone import Pinecone
+from .telemetry import Histogram
+from .logging_config import get_logger
+
+logger = get_logger(__name__)
+
+
+class PineconeService:
+    """Cliente de Pinecone de larga duración con queries ejecutadas fuera del event loop.
+
+    El SDK de Pinecone es síncrono: cada query se ejecuta en un pool de hilos
+    acotado para que una búsqueda lenta no bloquee al resto de conversaciones.
+    Los handles de índice se crean una sola vez (describe_index incluido) y se reutilizan.
+    """
+
+    def __init__(self):
+        self.max_workers = int(os.getenv("PINECONE_MAX_WORKERS", "8"))
+        self._client: Optional[Pinecone] = None
+        self._indexes: Dict[str, Any] = {}
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()  # Solo para los contadores
+        self._index_lock = threading.Lock()  # Creación de handles (puede ir a la red)
+        self._queued = 0
+        self._running = 0
+        self._errors = 0
+        self.wait_latency = Histogram()  # Tiempo en cola hasta que un hilo coge la query
+        self.query_latency = Histogram()  # Duración de index.query
+
+    def _get_client(self) -> Pinecone:
+        """Obtiene (o crea una única vez) el cliente de Pinecone configurado"""
+        if self._client is None:
+            api_key = os.getenv('PINECONE_API_KEY')
+            if not api_key:
+                logger.error("[Pinecone] ERROR: PINECONE_API_KEY no encontrada en variables de entorno")
+                raise ValueError("PINECONE_API_KEY no encontrada en variables de entorno")
+            self._client = Pinecone(api_key=api_key)
+            logger.info("[Pinecone] Cliente creado exitosamente")
+        return self._client
+
+    def get_index(self, index_name: str):
+        """Devuelve el handle cacheado del índice (se ejecuta en el pool de hilos)"""
+        index = self._indexes.get(index_name)
+        if index is None:
+            with self._index_lock:
+                index = self._indexes.get(index_name)
+                if index is None:
+                    logger.info("[Pinecone] Conectando al índice '%s'...", index_name)
+                    index = self._get_client().Index(index_name)
+                    self._indexes[index_name] = index
+        return index
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="pinecone")
+        return self._executor
+
+    async def query(self, index_name: str, vector: List[float], top_k: int):
+        """Ejecuta index.query en el pool de hilos sin bloquear el event loop"""
+        loop = asyncio.get_running_loop()
+        submitted_at = time.perf_counter()
+        with self._lock:
+            self._queued += 1
+        dequeued = False
+
+        def dequeue():
+            # Una sola vez por query: al empezar o al cancelarse antes de que un hilo la coja
+            nonlocal dequeued
+            with self._lock:
+                if not dequeued:
+                    dequeued = True
+                    self._queued -= 1
+
+        def run_query():
+            started_at = time.perf_counter()
+            dequeue()
+            with self._lock:
+                self._running += 1
+            self.wait_latency.observe(started_at - submitted_at)
+            try:
+                return self.get_index(index_name).query(
+                    vector=vector,
+                    top_k=top_k,
+                    include_metadata=True,
+                    include_values=False
+                )
+            except Exception:
+                with self._lock:
+                    self._errors += 1
+                raise
+            finally:
+                self.query_latency.observe(time.perf_counter() - started_at)
+                with self._lock:
+                    self._running -= 1
+
+        future = loop.run_in_executor(self._get_executor(), run_query)
+        future.add_done_callback(lambda _: dequeue())
+        return await future
+
+    def shutdown(self):
+        """Detiene el pool de hilos (se llama en el apagado)"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> Dict:
+        """Profundidad de cola y latencias de las queries"""
+        with self._lock:
+            queued, running, errors = self._queued, self._running, self._errors
+        return {
+            "max_workers": self.max_workers,
+            "queue_depth": queued,
+            "in_flight": running,
+            "errors": errors,
+            "cached_indexes": sorted(self._indexes),
+            "wait_seconds": self.wait_latency.snapshot(),
+            "query_seconds": self.query_latency.snapshot()
+        }
+
+
+# Instancia global
+pinecone_service = PineconeService()
@@ -0,0 +1,106 @@
+import json
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from .models import AgentConfig
+from .tools import tool_engine
+from .logging_config import get_logger
+
+logger = get_logger(__name__)
+
+# Esquema de la tool semantic_search que se añade a los agentes con pinecone_index o local_index
+SEMANTIC_SEARCH_TOOL = {
+    "type": "function",
+    "name": "semantic_search",
+    "description": "Permite realizar búsquedas semánticas en un índice de Pinecone",
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "query": {
+                "type": "string",
+                "description": "Término de búsqueda"
+            }
+        },
+        "required": ["query"]
+    }
+}
+
+
+def encode_json(value: Any) -> bytes:
+    """Serializa a JSON compacto en UTF-8 (mismo formato en todas las piezas del body)"""
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class OpenAIRequestTemplate:
+    """Body de la Responses API de un agente, precompilado al cargar la configuración.
+
+    Las instrucciones, las tools y el resto de parámetros fijos se serializan una
+    sola vez a bytes; por petición solo se intercalan el mensaje del usuario (o los
+    resultados de las function_calls), el historial del servidor si lo hay y el
+    previous_response_id.
+    """
+
+    __slots__ = ("agent", "tools", "_input_prefix", "_user_prefix", "_followup_prefix", "_suffix")
+
+    def __init__(self, agent: AgentConfig):
+        config = agent.openai_config
+        tools = tool_engine.api_tools(agent)
+        if config.pinecone_index or config.local_index:
+            tools.append(SEMANTIC_SEARCH_TOOL)
+
+        # Parámetros comunes a la petición inicial y a las de seguimiento
+        params: Dict[str, Any] = {
+            "text": {"format": {"type": "text"}},
+            "reasoning": {},
+            "tools": tools,
+            "max_output_tokens": config.max_output_tokens,
+            "store": True
+        }
+        # Solo añadir temperature y top_p si el modelo NO es o4-mini
+        if config.model != "o4-mini":
+            params["temperature"] = config.temperature
+            params["top_p"] = config.top_p
+
+        include = b""
+        if any(isinstance(tool, dict) and tool.get("type") == "file_search" for tool in config.tools):
+            include = b',"include":["file_search_call.results"]'
+
+        system_message = encode_json({
+            "role": "system",
+            "content": [{"type": "input_text", "text": config.instructions}]
+        })
+        model = encode_json(config.model)
+
+        self.agent = agent
+        self.tools: Tuple[Dict[str, Any], ...] = tuple(tools)
+        self._input_prefix = b'{"model":' + model + b',"input":[' + system_message
+        self._user_prefix = b',{"role":"user","content":[{"type":"input_text","text":'
+        self._followup_prefix = b'{"model":' + model + b',"input":'
+        self._suffix = b"," + encode_json(params)[1:-1] + include
+        logger.debug(
+            "[OpenAI] Plantilla compilada para '%s' (%d tools, modelo %s)", agent.id, len(tools), config.model
+        )
+
+    @staticmethod
+    def _tail(previous_response_id: Optional[str], stream: bool) -> bytes:
+        tail = b""
+        if previous_response_id:
+            tail += b',"previous_response_id":' + encode_json(previous_response_id)
+        if stream:
+            tail += b',"stream":true'
+        return tail + b"}"
+
+    def render(self, message: str, previous_response_id: Optional[str] = None, stream: bool = False,
+               history: Sequence[Dict[str, Any]] = ()) -> bytes:
+        """Body de la petición inicial: instrucciones, historial (opcional) y mensaje del usuario"""
+        return b"".join((
+            self._input_prefix, *(b"," + encode_json(item) for item in history),
+            self._user_prefix, encode_json(message), b"}]}]",
+            self._suffix, self._tail(previous_response_id, stream)
+        ))
+
+    def render_followup(self, function_outputs: List[Dict[str, Any]], previous_response_id: Optional[str],
+                        stream: bool = False) -> bytes:
+        """Body que devuelve a OpenAI los resultados de las function_calls"""
+        return (
+            self._followup_prefix + encode_json(function_outputs)
+            + self._suffix + self._tail(previous_response_id, stream)
+        )
@@ -0,0 +1,339 @@
+import asyncio
+import random
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Set
+import httpx
+from .http_pool import http_pool
+from .models import ResilienceConfig
+from .logging_config import get_logger
+
+logger = get_logger(__name__)
+
+# Respuestas que indican que el upstream está saturado o caído (cuentan como fallo del circuito)
+FAILURE_STATUS = {408, 429, 500, 502, 503, 504}
+
+# Respuestas que garantizan que la petición no se procesó: se reintentan aunque no sea idempotente
+NOT_PROCESSED_STATUS = {429, 503}
+
+# Errores en los que la petición no llegó a enviarse
+NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+DEFAULT_RESILIENCE = ResilienceConfig()
+
+
+class CircuitOpenError(Exception):
+    """El circuito del upstream está abierto: se falla al momento sin llamar al upstream"""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"Circuito abierto para '{name}'")
+        self.name = name
+        self.retry_after = max(1, int(retry_after + 0.999))
+
+
+class CircuitBreaker:
+    """Circuit breaker por fallos consecutivos.
+
+    closed: pasan todas las peticiones. Tras breaker_failures fallos seguidos pasa a
+    open y rechaza al momento durante breaker_reset_timeout segundos; después
+    (half_open) deja pasar una única petición de prueba, que lo cierra si va bien o
+    lo vuelve a abrir si falla.
+    """
+
+    __slots__ = ("state", "failures", "opened_at", "probe_started", "opens")
+
+    def __init__(self):
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_started = 0.0
+        self.opens = 0
+
+    def allow(self, config: ResilienceConfig) -> bool:
+        if self.state == "closed" or config.breaker_failures <= 0:
+            return True
+        now = time.monotonic()
+        if self.state == "open" and now - self.opened_at < config.breaker_reset_timeout:
+            return False
+        # Una sola petición de prueba (si se pierde sin resultado, otra pasado el mismo margen)
+        if self.state == "half_open" and now - self.probe_started < config.breaker_reset_timeout:
+            return False
+        self.state = "half_open"
+        self.probe_started = now
+        return True
+
+    def retry_after(self, config: ResilienceConfig) -> float:
+        return max(0.0, config.breaker_reset_timeout - (time.monotonic() - self.opened_at))
+
+    def record_success(self):
+        self.state = "closed"
+        self.failures = 0
+
+    def record_failure(self, config: ResilienceConfig) -> bool:
+        """Registra un fallo; devuelve True si el circuito acaba de abrirse"""
+        self.failures += 1
+        if config.breaker_failures <= 0:
+            return False
+        if self.state == "half_open" or (self.state == "closed" and self.failures >= config.breaker_failures):
+            self.state = "open"
+            self.opened_at = time.monotonic()
+            self.opens += 1
+            return True
+        return False
+
+
+class LatencyWindow:
+    """Latencias recientes de un upstream para estimar el p95 del que depende el hedging"""
+
+    __slots__ = ("_samples", "_p95", "_pending")
+
+    MIN_SAMPLES = 20
+    RECOMPUTE_EVERY = 16
+
+    def __init__(self, size: int = 256):
+        self._samples: Deque[float] = deque(maxlen=size)
+        self._p95: Optional[float] = None
+        self._pending = 0
+
+    def observe(self, seconds: float):
+        self._samples.append(seconds)
+        self._pending += 1
+        if self._pending >= self.RECOMPUTE_EVERY and len(self._samples) >= self.MIN_SAMPLES:
+            ordered = sorted(self._samples)
+            self._p95 = ordered[int(0.95 * (len(ordered) - 1))]
+            self._pending = 0
+
+    @property
+    def p95(self) -> Optional[float]:
+        return self._p95
+
+
+class UpstreamStats:
+    __slots__ = ("breaker", "latency", "calls", "failures", "retries", "hedges", "hedge_wins", "rejected")
+
+    def __init__(self):
+        self.breaker = CircuitBreaker()
+        self.latency: Dict[str, LatencyWindow] = {}
+        self.calls = 0
+        self.failures = 0
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.rejected = 0
+
+
+class ResilientCaller:
+    """Capa común de las llamadas a Azure OpenAI, n8n y backends personalizados.
+
+    Cada llamada usa los timeouts del agente (conexión, lectura y presupuesto total),
+    reintenta con backoff exponencial y jitter los fallos reintentables, puede lanzar
+    una petición de cobertura si la primera tarda más que el p95 observado y pasa por
+    un circuit breaker propio del agente (o de 'embeddings'). Con el circuito abierto
+    lanza CircuitOpenError sin tocar el upstream.
+
+    Los fallos de conexión y las respuestas 429/503 se reintentan siempre (la petición
+    no se procesó); los timeouts de lectura y el resto de 5xx solo si la llamada es
+    idempotente. Las respuestas de error que no se reintentan se devuelven tal cual
+    para que el llamante haga raise_for_status().
+    """
+
+    def __init__(self):
+        self._upstreams: Dict[str, UpstreamStats] = {}
+        self._losers: Set[asyncio.Task] = set()
+
+    def _upstream(self, name: str) -> UpstreamStats:
+        upstream = self._upstreams.get(name)
+        if upstream is None:
+            upstream = self._upstreams[name] = UpstreamStats()
+        return upstream
+
+    def check(self, name: str, config: Optional[ResilienceConfig] = None):
+        """Lanza CircuitOpenError si el circuito de 'name' está abierto (sin consumir la petición de prueba)"""
+        config = config or DEFAULT_RESILIENCE
+        upstream = self._upstreams.get(name)
+        if upstream is not None and upstream.breaker.state == "open" and config.breaker_failures > 0:
+            retry_after = upstream.breaker.retry_after(config)
+            if retry_after > 0:
+                upstream.rejected += 1
+                raise CircuitOpenError(name, retry_after)
+
+    def forget(self, names):
+        """Descarta el estado de los agentes modificados o eliminados"""
+        for name in names:
+            self._upstreams.pop(name, None)
+
+    async def request(self, name: str, kind: str, config: Optional[ResilienceConfig], method: str, url: str, *,
+                      idempotent: bool, headers: Optional[Dict[str, str]] = None, content: Optional[bytes] = None,
+                      json: Any = None, stream: bool = False) -> httpx.Response:
+        """Envía la petición con reintentos, hedging y circuit breaker.
+
+        Con stream=True devuelve la respuesta en cuanto llegan las cabeceras (hay que
+        cerrarla con aclose()); los reintentos, el hedging y total_timeout solo cubren esa fase.
+        """
+        config = config or DEFAULT_RESILIENCE
+        if config.idempotent is not None:
+            idempotent = config.idempotent
+        upstream = self._upstream(name)
+        breaker = upstream.breaker
+        window = upstream.latency.get(kind)
+        if window is None:
+            window = upstream.latency[kind] = LatencyWindow()
+        client = http_pool.get_client(url)
+        deadline = time.monotonic() + config.total_timeout
+        upstream.calls += 1
+
+        attempt = 0
+        while True:
+            if not breaker.allow(config):
+                upstream.rejected += 1
+                raise CircuitOpenError(name, breaker.retry_after(config))
+            remaining = deadline - time.monotonic()
+            timeout = httpx.Timeout(
+                min(config.read_timeout, remaining), connect=min(config.connect_timeout, remaining)
+            )
+
+            def send():
+                request = client.build_request(
+                    method, url, headers=headers, content=content, json=json, timeout=timeout
+                )
+                return client.send(request, stream=stream)
+
+            hedge_delay = None
+            if config.hedge and idempotent and window.p95 is not None:
+                hedge_delay = max(config.hedge_min_delay, window.p95)
+
+            retry_wait = None
+            started = time.monotonic()
+            try:
+                response = await self._attempt(send, hedge_delay, upstream, remaining, config)
+            except httpx.TransportError as e:
+                upstream.failures += 1
+                if breaker.record_failure(config):
+                    logger.warning("[Resilience] Circuito abierto para '%s' tras %s", name, type(e).__name__)
+                if not (idempotent or isinstance(e, NOT_SENT_ERRORS)):
+                    raise
+                retry_wait = self._backoff(config, attempt)
+                if not self._can_retry(config, attempt, deadline, retry_wait):
+                    raise
+                logger.info("[Resilience] Reintento %d de '%s' (%s) tras %s", attempt + 1, name, kind, type(e).__name__)
+            else:
+                if response.status_code not in FAILURE_STATUS:
+                    breaker.record_success()
+                    window.observe(time.monotonic() - started)
+                    return response
+                upstream.failures += 1
+                if breaker.record_failure(config):
+                    logger.warning("[Resilience] Circuito abierto para '%s' tras HTTP %d", name, response.status_code)
+                if not (idempotent or response.status_code in NOT_PROCESSED_STATUS):
+                    return response
+                retry_wait = self._backoff(config, attempt, response.headers.get("retry-after"))
+                if not self._can_retry(config, attempt, deadline, retry_wait):
+                    return response
+                await response.aclose()
+                logger.info(
+                    "[Resilience] Reintento %d de '%s' (%s) tras HTTP %d", attempt + 1, name, kind, response.status_code
+                )
+            upstream.retries += 1
+            attempt += 1
+            await asyncio.sleep(retry_wait)
+
+    @staticmethod
+    def _backoff(config: ResilienceConfig, attempt: int, retry_after: Optional[str] = None) -> float:
+        """Backoff exponencial con jitter completo (o el Retry-After del upstream si lo indica)"""
+        if retry_after:
+            try:
+                return max(0.0, float(retry_after))
+            except ValueError:
+                pass
+        return random.uniform(0, min(config.retry_max_backoff, config.retry_backoff * 2 ** attempt))
+
+    @staticmethod
+    def _can_retry(config: ResilienceConfig, attempt: int, deadline: float, wait: float) -> bool:
+        # Solo se reintenta si queda margen para la espera y para conectar de nuevo
+        return (
+            attempt < config.retries and wait <= config.retry_max_backoff
+            and time.monotonic() + wait + config.connect_timeout < deadline
+        )
+
+    async def _attempt(self, send, hedge_delay: Optional[float], upstream: UpstreamStats, remaining: float,
+                       config: ResilienceConfig) -> httpx.Response:
+        """Un intento acotado a lo que queda del presupuesto total: el read_timeout de httpx
+        cuenta entre bloques de datos y una respuesta lenta podría superarlo"""
+        try:
+            return await asyncio.wait_for(self._send(send, hedge_delay, upstream), remaining)
+        except asyncio.TimeoutError:
+            raise httpx.ReadTimeout(f"Presupuesto total de {config.total_timeout:g}s agotado") from None
+
+    async def _send(self, send, hedge_delay: Optional[float], upstream: UpstreamStats) -> httpx.Response:
+        """Un intento; con hedge_delay, si no ha respondido en ese tiempo se lanza una segunda petición
+        y gana la primera que responda"""
+        if hedge_delay is None:
+            return await send()
+        first = asyncio.ensure_future(send())
+        try:
+            done, _ = await asyncio.wait({first}, timeout=hedge_delay)
+        except BaseException:
+            self._discard(first)
+            raise
+        if done:
+            return first.result()
+
+        upstream.hedges += 1
+        second = asyncio.ensure_future(send())
+        pending = {first, second}
+        error: Optional[BaseException] = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is second:
+                            upstream.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                self._discard(task)
+
+    def _discard(self, task: asyncio.Task):
+        """Cancela la petición perdedora y cierra su respuesta si llega a completarse"""
+        task.cancel()
+
+        def close(done: asyncio.Task):
+            self._losers.discard(done)
+            if not done.cancelled() and done.exception() is None:
+                closing = asyncio.ensure_future(done.result().aclose())
+                self._losers.add(closing)
+                closing.add_done_callback(self._losers.discard)
+
+        self._losers.add(task)
+        task.add_done_callback(close)
+
+    def breaker_states(self) -> Dict[str, str]:
+        """Estado de los circuitos que no están cerrados"""
+        return {
+            name: upstream.breaker.state
+            for name, upstream in self._upstreams.items() if upstream.breaker.state != "closed"
+        }
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            name: {
+                "state": upstream.breaker.state,
+                "consecutive_failures": upstream.breaker.failures,
+                "opens": upstream.breaker.opens,
+                "calls": upstream.calls,
+                "failures": upstream.failures,
+                "retries": upstream.retries,
+                "hedges": upstream.hedges,
+                "hedge_wins": upstream.hedge_wins,
+                "rejected": upstream.rejected,
+                "p95": {kind: round(window.p95, 4) for kind, window in upstream.latency.items() if window.p95}
+            }
+            for name, upstream in self._upstreams.items()
+        }
+
+
+# Instancia global
+resilience = ResilientCaller()
@@ -0,0 +1,76 @@
+import os
+from typing import Any, Dict, Optional
+from .cache import LRUCache, normalize_text
+from .shared_state import shared_store
+
+
+class SearchResultCache:
+    """Caché de resultados de semantic_search ya serializados (el 'output' del function_call_output).
+
+    La clave es (índice, versión del índice, query normalizada, k, score mínimo): al cambiar
+    'pinecone_index_version' en el JSON del agente las entradas anteriores dejan
+    de usarse y acaban saliendo por LRU/TTL.
+
+    Con varios workers las entradas se guardan solo en el almacén compartido (sin
+    copia en memoria), así /cache/search/flush vacía la caché de todos los workers.
+    """
+
+    def __init__(self):
+        self.default_ttl = float(os.getenv("SEARCH_CACHE_TTL", "3600"))
+        self._cache = LRUCache(
+            max_entries=int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", "2000")),
+            max_bytes=int(float(os.getenv("SEARCH_CACHE_MAX_MB", "32")) * 1024 * 1024),
+            sizeof=len
+        )
+        self.shared_hits = 0
+        self.shared_misses = 0
+
+    @staticmethod
+    def make_key(index_name: str, index_version: Optional[str], query: str, k: int,
+                 min_score: Optional[float] = None) -> tuple:
+        return (index_name, index_version or "", normalize_text(query), k, min_score)
+
+    @staticmethod
+    def _shared_key(key: tuple) -> str:
+        return "\x00".join(map(str, key))
+
+    def get(self, key: tuple) -> Optional[str]:
+        if shared_store.enabled:
+            value = shared_store.get("search", self._shared_key(key))
+            if value is None:
+                self.shared_misses += 1
+                return None
+            self.shared_hits += 1
+            return value.decode("utf-8")
+        return self._cache.get(key)
+
+    def set(self, key: tuple, output: str, ttl_seconds: Optional[float] = None):
+        ttl = self.default_ttl if ttl_seconds is None else ttl_seconds
+        if ttl <= 0:
+            return  # Caché desactivada para este agente
+        if shared_store.enabled:
+            shared_store.set_soon("search", self._shared_key(key), output.encode("utf-8"), ttl, tag=key[0])
+            return
+        self._cache.set(key, output, ttl_seconds=ttl)
+
+    def flush(self, index_name: Optional[str] = None) -> int:
+        """Vacía la caché completa o solo las entradas de un índice; devuelve cuántas se eliminaron"""
+        if shared_store.enabled:
+            return shared_store.delete("search", index_name)
+        if index_name is None:
+            return self._cache.clear()
+        return self._cache.invalidate(lambda key: key[0] == index_name)
+
+    def stats(self) -> Dict[str, Any]:
+        stats = {**self._cache.stats(), "default_ttl": self.default_ttl, "shared": shared_store.enabled}
+        if shared_store.enabled:
+            lookups = self.shared_hits + self.shared_misses
+            stats.update(
+                hits=self.shared_hits, misses=self.shared_misses,
+                hit_ratio=round(self.shared_hits / lookups, 4) if lookups else 0.0
+            )
+        return stats
+
+
+# Instancia global
+search_cache = SearchResultCache()
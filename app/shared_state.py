@@ -0,0 +1,229 @@
+import asyncio
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from .logging_config import get_logger
+
+logger = get_logger(__name__)
+
+# Directorio por defecto del estado compartido: tmpfs si existe, así SQLite no toca disco
+DEFAULT_SHARED_STATE_DIR = str(
+    Path("/dev/shm" if Path("/dev/shm").is_dir() else tempfile.gettempdir()) / "agentclic"
+)
+
+
+def shared_state_dir() -> Optional[str]:
+    """Directorio del estado compartido entre workers, o None si hay un solo proceso.
+
+    Se activa con SHARED_STATE_DIR o, si no está, con WEB_CONCURRENCY > 1 (la
+    variable que usan tanto gunicorn como 'uvicorn --workers' por defecto).
+    """
+    directory = os.getenv("SHARED_STATE_DIR")
+    if directory:
+        return directory
+    try:
+        workers = int(os.getenv("WEB_CONCURRENCY") or "1")
+    except ValueError:
+        workers = 1
+    return DEFAULT_SHARED_STATE_DIR if workers > 1 else None
+
+
+def worker_id() -> str:
+    """Identificador del worker actual (se calcula en cada llamada: el import puede ser anterior al fork)"""
+    return f"w{os.getpid()}"
+
+
+class SharedStore:
+    """Clave-valor con TTL en una base SQLite compartida por todos los workers.
+
+    Con varios workers cada proceso tiene su propio event loop y su propia memoria:
+    las cachés de embeddings y de búsquedas y las métricas de latencia se comparten
+    a través de esta base en SHARED_STATE_DIR (tmpfs por defecto), en modo WAL para
+    que las lecturas no esperen a las escrituras. Cada proceso abre su conexión
+    tras el fork. Las escrituras desde el event loop se hacen en un hilo con set_soon().
+
+    Las lecturas son síncronas (microsegundos en tmpfs) y usan su propia conexión,
+    sin el lock de las escrituras y con un busy timeout de READ_TIMEOUT segundos:
+    si la base está bloqueada más tiempo la lectura cuenta como fallo de caché en
+    lugar de parar el event loop.
+
+    Los errores de SQLite nunca llegan al llamante: una lectura fallida es un fallo
+    de caché y una escritura fallida se descarta (ambas se contabilizan).
+    """
+
+    PRUNE_EVERY = 500
+    WRITE_TIMEOUT = 5.0
+    READ_TIMEOUT = 0.05
+
+    def __init__(self):
+        directory = shared_state_dir()
+        self.path: Optional[Path] = Path(directory) / "shared.db" if directory else None
+        self.max_entries = int(os.getenv("SHARED_CACHE_MAX_ENTRIES", "200000"))
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+        self._reader: Optional[sqlite3.Connection] = None
+        self._reader_pid: Optional[int] = None
+        self._writes_since_prune = 0
+        self.reads = 0
+        self.writes = 0
+        self.errors = 0
+        self.busy = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.path is not None
+
+    def _open(self, timeout: float) -> sqlite3.Connection:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(str(self.path), timeout=timeout, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=OFF")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                tag TEXT,
+                value BLOB NOT NULL,
+                expires_at REAL,
+                PRIMARY KEY (namespace, key)
+            ) WITHOUT ROWID
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS entries_tag ON entries (namespace, tag)")
+        conn.execute("CREATE INDEX IF NOT EXISTS entries_expires_at ON entries (expires_at)")
+        return conn
+
+    def _connection(self) -> sqlite3.Connection:
+        # Una conexión heredada de otro proceso no se puede usar: se abre una nueva tras el fork
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = self._open(self.WRITE_TIMEOUT)
+            self._pid = os.getpid()
+        return self._conn
+
+    def _read_connection(self) -> sqlite3.Connection:
+        if self._reader is None or self._reader_pid != os.getpid():
+            self._reader = self._open(self.READ_TIMEOUT)
+            self._reader_pid = os.getpid()
+        return self._reader
+
+    def _execute(self, sql: str, parameters: tuple = ()) -> Optional[sqlite3.Cursor]:
+        try:
+            with self._lock:
+                return self._connection().execute(sql, parameters)
+        except sqlite3.Error as e:
+            self.errors += 1
+            logger.warning("[SharedState] ERROR en %s: %s", self.path, e)
+            return None
+
+    def _query(self, sql: str, parameters: tuple = ()) -> Optional[List[tuple]]:
+        """Lectura desde el event loop: None si la base está bloqueada o falla"""
+        try:
+            return self._read_connection().execute(sql, parameters).fetchall()
+        except sqlite3.OperationalError as e:
+            if e.sqlite_errorcode & 0xFF in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED):
+                self.busy += 1
+                return None
+            self.errors += 1
+            logger.warning("[SharedState] ERROR en %s: %s", self.path, e)
+        except sqlite3.Error as e:
+            self.errors += 1
+            logger.warning("[SharedState] ERROR en %s: %s", self.path, e)
+        return None
+
+    def get(self, namespace: str, key: str) -> Optional[bytes]:
+        """Valor vigente de la clave o None"""
+        if self.path is None:
+            return None
+        self.reads += 1
+        rows = self._query(
+            "SELECT value FROM entries WHERE namespace = ? AND key = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (namespace, key, time.time())
+        )
+        return rows[0][0] if rows else None
+
+    def items(self, namespace: str) -> List[Tuple[str, bytes]]:
+        """Pares (clave, valor) vigentes de un espacio de nombres"""
+        if self.path is None:
+            return []
+        rows = self._query(
+            "SELECT key, value FROM entries WHERE namespace = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (namespace, time.time())
+        )
+        return rows or []
+
+    def set(self, namespace: str, key: str, value: bytes, ttl_seconds: Optional[float] = None,
+            tag: Optional[str] = None):
+        """Guarda el valor (bloqueante: desde el event loop usar set_soon)"""
+        if self.path is None:
+            return
+        expires_at = time.time() + ttl_seconds if ttl_seconds else None
+        if self._execute(
+            "INSERT OR REPLACE INTO entries (namespace, key, tag, value, expires_at) VALUES (?, ?, ?, ?, ?)",
+            (namespace, key, tag, value, expires_at)
+        ) is None:
+            return
+        self.writes += 1
+        self._writes_since_prune += 1
+        if self._writes_since_prune >= self.PRUNE_EVERY:
+            self._writes_since_prune = 0
+            self._prune()
+
+    def set_soon(self, namespace: str, key: str, value: bytes, ttl_seconds: Optional[float] = None,
+                 tag: Optional[str] = None):
+        """Como set(), pero en un hilo si se llama desde el event loop"""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.set(namespace, key, value, ttl_seconds, tag)
+        else:
+            loop.run_in_executor(None, self.set, namespace, key, value, ttl_seconds, tag)
+
+    def delete(self, namespace: str, tag: Optional[str] = None) -> int:
+        """Borra un espacio de nombres completo o solo las entradas con la etiqueta indicada"""
+        if self.path is None:
+            return 0
+        if tag is None:
+            cursor = self._execute("DELETE FROM entries WHERE namespace = ?", (namespace,))
+        else:
+            cursor = self._execute("DELETE FROM entries WHERE namespace = ? AND tag = ?", (namespace, tag))
+        return cursor.rowcount if cursor is not None else 0
+
+    def _prune(self):
+        """Elimina las entradas caducadas y, por encima de max_entries, las que caducan antes"""
+        self._execute("DELETE FROM entries WHERE expires_at <= ?", (time.time(),))
+        cursor = self._execute("SELECT COUNT(*) FROM entries")
+        excess = cursor.fetchone()[0] - self.max_entries if cursor is not None else 0
+        if excess > 0:
+            self._execute(
+                "DELETE FROM entries WHERE (namespace, key) IN ("
+                "SELECT namespace, key FROM entries WHERE expires_at IS NOT NULL ORDER BY expires_at LIMIT ?)",
+                (excess,)
+            )
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None and self._pid == os.getpid():
+                self._conn.close()
+            self._conn = None
+        if self._reader is not None and self._reader_pid == os.getpid():
+            self._reader.close()
+        self._reader = None
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": self.enabled,
+            "path": str(self.path) if self.path else None,
+            "worker": worker_id(),
+            "reads": self.reads,
+            "writes": self.writes,
+            "errors": self.errors,
+            "busy_reads": self.busy
+        }
+
+
+# Instancia global
+shared_store = SharedStore()
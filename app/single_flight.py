@@ -0,0 +1,170 @@
+import asyncio
+import os
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple, TypeVar
+from .logging_config import get_logger
+
+logger = get_logger(__name__)
+
+T = TypeVar("T")
+
+
+class _Call:
+    """Trabajo en curso y número de peticiones que esperan su resultado"""
+
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class _StreamCall:
+    """Stream en curso: eventos ya emitidos (para quien se une tarde) y estado final"""
+
+    __slots__ = ("task", "waiters", "events", "finished", "error", "changed")
+
+    def __init__(self):
+        self.task: Optional[asyncio.Task] = None
+        self.waiters = 0
+        self.events: List[Any] = []
+        self.finished = False
+        self.error: Optional[BaseException] = None
+        self.changed = asyncio.Condition()
+
+
+class _GroupStats:
+    __slots__ = ("calls", "coalesced")
+
+    def __init__(self):
+        self.calls = 0  # Trabajos ejecutados (líderes)
+        self.coalesced = 0  # Peticiones que esperaron el resultado de otra idéntica en curso
+
+
+class SingleFlight:
+    """Agrupa el trabajo idéntico en curso (single-flight).
+
+    La primera petición con una clave (líder) lanza el trabajo en una tarea propia;
+    las que llegan con la misma clave mientras sigue en curso esperan ese mismo
+    resultado (o excepción) en lugar de repetir la llamada al upstream. Si todas las
+    peticiones que esperan se cancelan (p.ej. el cliente se desconecta) el trabajo se
+    cancela. Las claves se olvidan al terminar: no es una caché.
+
+    Se desactiva con SINGLE_FLIGHT=false.
+    """
+
+    def __init__(self):
+        self.enabled = os.getenv("SINGLE_FLIGHT", "true").lower() == "true"
+        self._calls: Dict[Tuple[str, Hashable], _Call] = {}
+        self._streams: Dict[Tuple[str, Hashable], _StreamCall] = {}
+        self._groups: Dict[str, _GroupStats] = {}
+
+    def _group(self, group: str) -> _GroupStats:
+        stats = self._groups.get(group)
+        if stats is None:
+            stats = self._groups[group] = _GroupStats()
+        return stats
+
+    async def do(self, group: str, key: Hashable, factory: Callable[[], Awaitable[T]]) -> T:
+        """Ejecuta factory() o, si ya hay una llamada en curso con la misma clave, espera su resultado"""
+        if not self.enabled:
+            return await factory()
+        full_key = (group, key)
+        call = self._calls.get(full_key)
+        if call is None:
+            call = _Call(asyncio.ensure_future(factory()))
+            self._calls[full_key] = call
+            self._group(group).calls += 1
+            call.task.add_done_callback(lambda task: self._forget(self._calls, full_key, call))
+        else:
+            self._group(group).coalesced += 1
+            logger.debug("[SingleFlight] '%s' agrupada con una llamada en curso", group)
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                # Nadie espera ya el resultado
+                self._forget(self._calls, full_key, call)
+                call.task.cancel()
+
+    async def stream(self, group: str, key: Hashable, factory: Callable[[], AsyncIterator[T]]) -> AsyncIterator[T]:
+        """Como do() para generadores: quien se une a un stream en curso recibe todos sus eventos desde el principio"""
+        if not self.enabled:
+            async for event in factory():
+                yield event
+            return
+        full_key = (group, key)
+        call = self._streams.get(full_key)
+        if call is None:
+            call = _StreamCall()
+            call.task = asyncio.ensure_future(self._produce(call, factory))
+            self._streams[full_key] = call
+            self._group(group).calls += 1
+            call.task.add_done_callback(lambda task: self._forget(self._streams, full_key, call))
+        else:
+            self._group(group).coalesced += 1
+            logger.debug("[SingleFlight] Stream '%s' agrupado con uno en curso", group)
+        call.waiters += 1
+        index = 0
+        try:
+            while True:
+                async with call.changed:
+                    await call.changed.wait_for(lambda: index < len(call.events) or call.finished)
+                    events = call.events[index:]
+                    finished, error = call.finished, call.error
+                for event in events:
+                    yield event
+                index += len(events)
+                if finished and index >= len(call.events):
+                    if error is not None:
+                        raise error
+                    return
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                self._forget(self._streams, full_key, call)
+                call.task.cancel()
+
+    @staticmethod
+    async def _produce(call: _StreamCall, factory: Callable[[], AsyncIterator[Any]]):
+        try:
+            async for event in factory():
+                async with call.changed:
+                    call.events.append(event)
+                    call.changed.notify_all()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            call.error = e
+        async with call.changed:
+            call.finished = True
+            call.changed.notify_all()
+
+    @staticmethod
+    def _forget(calls: Dict, full_key: Tuple[str, Hashable], call):
+        if calls.get(full_key) is call:
+            del calls[full_key]
+        task = call.task
+        if task is not None and task.done() and not task.cancelled():
+            task.exception()  # Evita el aviso de excepción no recuperada si nadie la esperaba
+
+    def stats(self) -> Dict[str, Any]:
+        groups = {
+            group: {
+                "calls": stats.calls,
+                "coalesced": stats.coalesced,
+                "coalesced_ratio": round(stats.coalesced / (stats.calls + stats.coalesced), 4)
+                if stats.calls + stats.coalesced else 0.0
+            }
+            for group, stats in self._groups.items()
+        }
+        return {
+            "enabled": self.enabled,
+            "in_flight": len(self._calls) + len(self._streams),
+            "groups": groups
+        }
+
+
+# Instancia global
+single_flight = SingleFlight()
@@ -22,14 +22,16 @@
         async init() {
             // Buscar el script tag que incluye este widget
             const scripts = document.querySelectorAll('script[data-agent-id]');
-            const widgetScript = scripts[scripts.length - 1]; // El último script debería ser este
+            // El último script debería ser este; /widget/{agent_id}.js no necesita data-agent-id
+            const widgetScript = scripts[scripts.length - 1] || document.currentScript;
+            const bootstrap = window.EmbeddableChatbotBootstrap;
             
-            if (!widgetScript) {
+            if (!widgetScript && !bootstrap) {
                 console.error('EmbeddableChatbot: No se encontró data-agent-id en el script tag');
                 return;
             }
             
-            this.agentId = widgetScript.getAttribute('data-agent-id');
+            this.agentId = (widgetScript && widgetScript.getAttribute('data-agent-id')) || (bootstrap && bootstrap.agentId);
             
             if (!this.agentId) {
                 console.error('EmbeddableChatbot: data-agent-id es requerido');
@@ -37,10 +39,12 @@
             }
             
             // Extraer la URL base del src del script
-            const scriptSrc = widgetScript.src;
+            const scriptSrc = widgetScript ? widgetScript.src : '';
             if (scriptSrc) {
-                // Extraer la URL base (todo antes de /widget.js)
-                this.apiBase = scriptSrc.replace('/widget.js', '');
+                // Extraer la URL base: origen y ruta sin el nombre del script
+                // (/widget.js, /widget.<versión>.js o /widget/<agente>.js)
+                const scriptUrl = new URL(scriptSrc, window.location.href);
+                this.apiBase = scriptUrl.origin + scriptUrl.pathname.replace(/\/widget(\.[0-9a-f]+|\/[^\/]+)?\.js$/, '');
                 console.log(`EmbeddableChatbot: API base detectada desde script: ${this.apiBase}`);
             } else {
                 // Fallback a window.location.origin si no se puede detectar
@@ -72,6 +76,18 @@
         }
         
         async loadConfig() {
+            // Configuración incrustada por /widget/{agent_id}.js: no hace falta pedirla
+            const bootstrap = window.EmbeddableChatbotBootstrap;
+            if (bootstrap && bootstrap.agentId === this.agentId && bootstrap.config) {
+                this.config = bootstrap.config;
+                console.log('EmbeddableChatbot: Configuración incrustada en el script:', this.config);
+                if (!this.isDomainAllowed()) {
+                    console.warn('EmbeddableChatbot: Dominio no autorizado. Widget no se mostrará.');
+                    return false;
+                }
+                return true;
+            }
+            
             try {
                 console.log(`EmbeddableChatbot: Cargando configuración para agente ${this.agentId} desde ${this.apiBase}/public-config/${this.agentId}`);
                 const response = await fetch(`${this.apiBase}/public-config/${this.agentId}`);
@@ -551,7 +567,7 @@
                     requestBody.previous_response_id = this.previousResponseId;
                 }
                 
-                const response = await fetch(`${this.apiBase}/chat/${this.agentId}`, {
+                const response = await fetch(`${this.apiBase}/chat/${this.agentId}/stream`, {
                     method: 'POST',
                     headers: {
                         'Content-Type': 'application/json',
@@ -563,7 +579,31 @@
                     throw new Error(`Error ${response.status}: ${response.statusText}`);
                 }
                 
-                const data = await response.json();
+                // Burbuja del bot que se va rellenando con los tokens recibidos
+                let botContent = null;
+                let streamedHtml = '';
+                let data = null;
+                
+                await this.readEventStream(response, (event) => {
+                    if (event.type === 'delta') {
+                        if (!botContent) {
+                            this.showLoading(false);
+                            botContent = this.addMessage('', 'bot');
+                        }
+                        // Cada delta trae el HTML ya definitivo; el navegador cierra las etiquetas abiertas
+                        streamedHtml += event.html;
+                        botContent.innerHTML = streamedHtml;
+                        this.scrollToBottom();
+                    } else if (event.type === 'done') {
+                        data = event;
+                    } else if (event.type === 'error') {
+                        throw new Error(`Error ${event.status}: ${event.detail}`);
+                    }
+                });
+                
+                if (!data) {
+                    throw new Error('Respuesta incompleta del servidor');
+                }
                 
                 // Actualizar conversation_id si viene en la respuesta
                 if (data.conversation_id) {
@@ -575,8 +615,13 @@
                     this.savePreviousResponseId(data.response_id);
                 }
                 
-                // Añadir respuesta del bot
-                this.addMessage(data.response, 'bot');
+                // Sustituir el texto provisional por la respuesta final en HTML
+                if (botContent) {
+                    botContent.innerHTML = data.response;
+                    this.scrollToBottom();
+                } else {
+                    this.addMessage(data.response, 'bot');
+                }
                 
             } catch (error) {
                 console.error('Error enviando mensaje:', error);
@@ -588,6 +633,47 @@
             }
         }
         
+        async readEventStream(response, onEvent) {
+            // Parsear Server-Sent Events de un fetch (EventSource no permite POST)
+            const handleFrame = (frame) => {
+                const dataLines = frame.split('\n')
+                    .filter(line => line.startsWith('data:'))
+                    .map(line => line.slice(5).trim());
+                if (dataLines.length > 0) {
+                    onEvent(JSON.parse(dataLines.join('\n')));
+                }
+            };
+            
+            // Navegadores sin ReadableStream: procesar el cuerpo completo
+            if (!response.body || !response.body.getReader) {
+                const text = await response.text();
+                text.split('\n\n').forEach(handleFrame);
+                return;
+            }
+            
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) break;
+                
+                buffer += decoder.decode(value, { stream: true });
+                let separatorIndex;
+                while ((separatorIndex = buffer.indexOf('\n\n')) !== -1) {
+                    const frame = buffer.slice(0, separatorIndex);
+                    buffer = buffer.slice(separatorIndex + 2);
+                    handleFrame(frame);
+                }
+            }
+            
+            buffer += decoder.decode();
+            if (buffer.trim()) {
+                handleFrame(buffer);
+            }
+        }
+        
         addMessage(content, type) {
             const messagesContainer = this.container.querySelector('.chatbot-messages');
             const messageDiv = document.createElement('div');
@@ -595,6 +681,13 @@
             messageDiv.innerHTML = `<div class="message-content">${content}</div>`;
             
             messagesContainer.appendChild(messageDiv);
+            this.scrollToBottom();
+            
+            return messageDiv.querySelector('.message-content');
+        }
+        
+        scrollToBottom() {
+            const messagesContainer = this.container.querySelector('.chatbot-messages');
             messagesContainer.scrollTop = messagesContainer.scrollHeight;
         }
         
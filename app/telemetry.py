@@ -0,0 +1,236 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+from starlette.datastructures import MutableHeaders
+
+
+class Histogram:
+    """Histograma acumulativo de latencias (en segundos) con buckets fijos, seguro entre hilos"""
+
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)  # El último es +Inf
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        """Registra una observación"""
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = i
+                break
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+            self._count += 1
+
+    def raw(self) -> list:
+        """[recuentos por bucket, suma, total], para sumar histogramas de varios procesos"""
+        with self._lock:
+            return [list(self._counts), self._sum, self._count]
+
+    def merge(self, raw: list):
+        """Suma las observaciones de otro histograma con los mismos buckets (ver raw())"""
+        counts, total_sum, total = raw
+        with self._lock:
+            self._counts = [a + b for a, b in zip(self._counts, counts)]
+            self._sum += total_sum
+            self._count += total
+
+    def _quantile(self, counts, total: int, q: float) -> float:
+        """Estimación del cuantil q como límite superior del bucket que lo contiene"""
+        target = q * total
+        cumulative = 0
+        for i, count in enumerate(counts):
+            cumulative += count
+            if cumulative >= target:
+                return self.buckets[i] if i < len(self.buckets) else float("inf")
+        return float("inf")
+
+    def snapshot(self) -> Dict:
+        """Resumen serializable del histograma"""
+        with self._lock:
+            counts = list(self._counts)
+            total = self._count
+            total_sum = self._sum
+
+        cumulative = 0
+        buckets = {}
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+        buckets["+Inf"] = total
+
+        return {
+            "count": total,
+            "sum": round(total_sum, 6),
+            "avg": round(total_sum / total, 6) if total else 0.0,
+            "p50": self._quantile(counts, total, 0.50) if total else 0.0,
+            "p95": self._quantile(counts, total, 0.95) if total else 0.0,
+            "p99": self._quantile(counts, total, 0.99) if total else 0.0,
+            "buckets": buckets
+        }
+
+
+def _format_labels(labelnames: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape_label(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_histograms(name: str, documentation: str, labelnames: Sequence[str],
+                      series: Dict[Tuple[str, ...], Histogram]) -> str:
+    """Serializa histogramas en formato de texto de Prometheus"""
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} histogram"]
+    for values, histogram in sorted(series.items()):
+        snapshot = histogram.snapshot()
+        for bound, cumulative in snapshot["buckets"].items():
+            labels = _format_labels(labelnames, values, 'le="%s"' % bound)
+            lines.append(f"{name}_bucket{labels} {cumulative}")
+        lines.append(f"{name}_sum{_format_labels(labelnames, values)} {snapshot['sum']}")
+        lines.append(f"{name}_count{_format_labels(labelnames, values)} {snapshot['count']}")
+    return "\n".join(lines) + "\n"
+
+
+def format_samples(name: str, documentation: str, metric_type: str, labelnames: Sequence[str],
+                   samples: Dict[Tuple[str, ...], float]) -> str:
+    """Serializa contadores o gauges en formato de texto de Prometheus"""
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} {metric_type}"]
+    for values, value in sorted(samples.items()):
+        lines.append(f"{name}{_format_labels(labelnames, values)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+class HistogramFamily:
+    """Conjunto de histogramas con etiquetas (p.ej. uno por etapa del pipeline)"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str],
+                 buckets: Sequence[float] = Histogram.DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = buckets
+        self._series: Dict[Tuple[str, ...], Histogram] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values: str) -> Histogram:
+        histogram = self._series.get(values)
+        if histogram is None:
+            with self._lock:
+                histogram = self._series.setdefault(values, Histogram(self.buckets))
+        return histogram
+
+    def export(self) -> Dict[str, list]:
+        """Series en crudo (etiquetas en JSON -> Histogram.raw()), serializables entre procesos"""
+        return {json.dumps(values): histogram.raw() for values, histogram in list(self._series.items())}
+
+    def render(self, others: Iterable[Dict[str, list]] = ()) -> str:
+        """Texto de Prometheus; 'others' son exportaciones de otros workers que se suman a las propias"""
+        series = dict(self._series)
+        for export in others:
+            for labels, raw in export.items():
+                values = tuple(json.loads(labels))
+                merged = Histogram(self.buckets)
+                if values in series:
+                    merged.merge(series[values].raw())
+                merged.merge(raw)
+                series[values] = merged
+        return format_histograms(self.name, self.documentation, self.labelnames, series)
+
+
+STAGE_LATENCY = HistogramFamily(
+    "agentclic_stage_duration_seconds", "Duración de cada etapa del pipeline de chat", ("stage",)
+)
+REQUEST_LATENCY = HistogramFamily(
+    "agentclic_http_request_duration_seconds", "Duración de las peticiones HTTP por ruta",
+    ("method", "route", "status")
+)
+
+# Traza de la petición en curso (solo existe dentro de una petición HTTP)
+_current_trace: ContextVar[Optional["RequestTrace"]] = ContextVar("agentclic_request_trace", default=None)
+
+
+class RequestTrace:
+    """Duración de las etapas de una petición, para la cabecera Server-Timing"""
+
+    __slots__ = ("spans",)
+
+    def __init__(self):
+        self.spans: List[Tuple[str, float]] = []
+
+    def server_timing(self, total: Optional[float] = None) -> str:
+        durations: Dict[str, float] = {}
+        for name, seconds in self.spans:
+            durations[name] = durations.get(name, 0.0) + seconds
+        if total is not None:
+            durations["total"] = total
+        return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in durations.items())
+
+
+@contextmanager
+def span(stage: str, name: Optional[str] = None):
+    """Mide una etapa: la registra en el histograma de etapas y en la traza de la petición.
+
+    'name' permite distinguir repeticiones de una misma etapa en Server-Timing (p.ej. openai-2).
+    """
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started_at
+        STAGE_LATENCY.labels(stage).observe(elapsed)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.spans.append((name or stage, elapsed))
+
+
+class TimingMiddleware:
+    """Middleware ASGI que mide cada petición y, opcionalmente, añade la cabecera Server-Timing.
+
+    En respuestas en streaming la cabecera solo incluye las etapas terminadas antes
+    de empezar a enviar el cuerpo.
+    """
+
+    def __init__(self, app, server_timing: bool = False):
+        self.app = app
+        self.server_timing = server_timing
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        trace = RequestTrace()
+        token = _current_trace.set(trace)
+        started_at = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if self.server_timing:
+                    headers = MutableHeaders(scope=message)
+                    headers.append("Server-Timing", trace.server_timing(time.perf_counter() - started_at))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            route = scope.get("route")
+            REQUEST_LATENCY.labels(
+                scope["method"], getattr(route, "path", "sin_ruta"), str(status)
+            ).observe(time.perf_counter() - started_at)
+            _current_trace.reset(token)
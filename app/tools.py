@@ -0,0 +1,246 @@
+import asyncio
+import importlib
+import inspect
+import json
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+from .models import AgentConfig
+from .telemetry import Histogram, span
+from .logging_config import get_logger
+
+logger = get_logger(__name__)
+
+# Firma de un handler: handler(arguments, agent) -> str u objeto serializable a JSON
+ToolHandler = Callable[[Dict[str, Any], AgentConfig], Awaitable[Any]]
+
+# Claves de una tool local que solo usa el servidor (no se envían a OpenAI)
+LOCAL_TOOL_KEYS = ("handler", "timeout", "max_output_chars")
+
+TRUNCATED_SUFFIX = "…[resultado truncado]"
+
+# Nombre con el que se contabilizan las llamadas a tools que el agente no tiene
+UNKNOWN_TOOL = "(desconocida)"
+
+
+class ToolRegistry:
+    """Registro de handlers de tools locales y sus métricas por tool.
+
+    Un handler se registra por nombre (tools integradas como semantic_search) o
+    se declara en el JSON del agente con "handler": "paquete.modulo:funcion". Las
+    rutas 'modulo:funcion' solo se aceptan desde la configuración del agente (se
+    importan al cargarla): los nombres que emite el modelo nunca se importan.
+    """
+
+    def __init__(self):
+        self._handlers: Dict[str, ToolHandler] = {}
+        self._imported: Dict[str, ToolHandler] = {}  # 'modulo:funcion' de los JSON de agentes
+        self._stats: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str, handler: Optional[ToolHandler] = None):
+        """Registra un handler; también sirve como decorador (@tool_registry.register("nombre"))"""
+        def decorator(func: ToolHandler) -> ToolHandler:
+            self._handlers[name] = func
+            return func
+        return decorator(handler) if handler is not None else decorator
+
+    def get(self, name: str) -> Optional[ToolHandler]:
+        """Handler registrado con ese nombre (nunca importa nada)"""
+        return self._handlers.get(name)
+
+    def load(self, handler_ref: str) -> ToolHandler:
+        """Handler declarado en el JSON de un agente: un nombre registrado o 'modulo:funcion'"""
+        handler = self._handlers.get(handler_ref) or self._imported.get(handler_ref)
+        if handler is not None:
+            return handler
+        if ":" not in handler_ref:
+            raise LookupError(f"No hay ningún handler registrado como '{handler_ref}'")
+        module_name, _, attr = handler_ref.partition(":")
+        handler = getattr(importlib.import_module(module_name), attr)
+        if not callable(handler):
+            raise TypeError(f"El handler '{handler_ref}' no es una función")
+        with self._lock:
+            self._imported[handler_ref] = handler
+        return handler
+
+    def _tool_stats(self, name: str) -> Dict[str, Any]:
+        stats = self._stats.get(name)
+        if stats is None:
+            with self._lock:
+                stats = self._stats.setdefault(name, {
+                    "calls": 0, "errors": 0, "timeouts": 0, "truncated": 0, "latency": Histogram()
+                })
+        return stats
+
+    def record(self, name: str, seconds: float, outcome: str = "ok", truncated: bool = False):
+        stats = self._tool_stats(name)
+        stats["latency"].observe(seconds)
+        with self._lock:
+            stats["calls"] += 1
+            if outcome == "error":
+                stats["errors"] += 1
+            elif outcome == "timeout":
+                stats["timeouts"] += 1
+            if truncated:
+                stats["truncated"] += 1
+
+    def latency_histograms(self) -> Dict[Tuple[str, ...], Histogram]:
+        return {(name,): stats["latency"] for name, stats in list(self._stats.items())}
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            name: {**{k: v for k, v in stats.items() if k != "latency"},
+                   "latency_seconds": stats["latency"].snapshot()}
+            for name, stats in list(self._stats.items())
+        }
+
+
+class ToolEngine:
+    """Ejecuta las function_calls de una respuesta de OpenAI usando el registro de tools.
+
+    Las llamadas de un turno se ejecutan en paralelo (acotadas por agente) y los
+    resultados se devuelven en el orden en que las emitió el modelo. Una tool
+    desconocida, que falla o que supera su timeout devuelve un error al modelo en
+    lugar de descartarse.
+    """
+
+    def __init__(self, registry: ToolRegistry):
+        self.registry = registry
+        # Semáforos de tool calls simultáneas por agente (clave: id del agente y límite)
+        self._semaphores: Dict[Tuple[str, int], asyncio.Semaphore] = {}
+
+    @staticmethod
+    def local_tools(agent: AgentConfig) -> Dict[str, Dict[str, Any]]:
+        """Tools de tipo function declaradas en openai_config.tools, por nombre"""
+        return {
+            tool["name"]: tool
+            for tool in agent.openai_config.tools
+            if isinstance(tool, dict) and tool.get("type") == "function" and tool.get("name")
+        }
+
+    @staticmethod
+    def api_tools(agent: AgentConfig) -> List[Dict[str, Any]]:
+        """Tools del agente tal y como se envían a la Responses API (sin las claves locales)"""
+        return [
+            {k: v for k, v in tool.items() if k not in LOCAL_TOOL_KEYS}
+            if isinstance(tool, dict) and tool.get("type") == "function" else tool
+            for tool in agent.openai_config.tools
+        ]
+
+    def prepare(self, agent: AgentConfig):
+        """Importa y valida los handlers declarados en las tools del agente (al cargar su configuración)"""
+        if not agent.openai_config:
+            return
+        for name, tool in self.local_tools(agent).items():
+            handler_ref = tool.get("handler")
+            if not handler_ref:
+                continue
+            try:
+                self.registry.load(handler_ref)
+            except Exception as e:
+                raise ValueError(f"Handler '{handler_ref}' de la tool '{name}' no válido: {type(e).__name__}: {e}") from e
+
+    def _get_semaphore(self, agent: AgentConfig) -> asyncio.Semaphore:
+        limit = max(1, agent.openai_config.max_parallel_tool_calls)
+        key = (agent.id, limit)
+        semaphore = self._semaphores.get(key)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(limit)
+            self._semaphores[key] = semaphore
+        return semaphore
+
+    def forget(self, agent_ids: Iterable[str]):
+        """Descarta los semáforos de agentes recargados o eliminados"""
+        agent_ids = set(agent_ids)
+        for key in [key for key in self._semaphores if key[0] in agent_ids]:
+            del self._semaphores[key]
+
+    @staticmethod
+    def _error_output(message: str) -> str:
+        return json.dumps({"error": message}, ensure_ascii=False)
+
+    @staticmethod
+    async def _call(handler: ToolHandler, arguments: Dict[str, Any], agent: AgentConfig) -> Any:
+        """Llama al handler; uno síncrono se ejecuta en un hilo para no parar el event loop"""
+        if inspect.iscoroutinefunction(handler):
+            return await handler(arguments, agent)
+        result = await asyncio.to_thread(handler, arguments, agent)
+        if inspect.isawaitable(result):
+            result = await result
+        return result
+
+    async def execute_one(self, function_call: Dict[str, Any], agent: AgentConfig,
+                          tool_spec: Optional[Dict[str, Any]], log_prefix: str = "[OpenAI]") -> Dict[str, Any]:
+        """Ejecuta una function_call y devuelve su function_call_output"""
+        call_id = function_call.get("call_id")
+        name = function_call.get("name", "unknown")
+        arguments_str = function_call.get("arguments") or "{}"
+        logger.info("%s 🔧 Ejecutando tool '%s' (call_id: %s)", log_prefix, name, call_id)
+        logger.debug("%s 📝 Arguments: %s", log_prefix, arguments_str)
+
+        tool_spec = tool_spec or {}
+        timeout = tool_spec.get("timeout") or agent.openai_config.tool_call_timeout
+        max_chars = tool_spec.get("max_output_chars") or agent.openai_config.tool_max_output_chars
+        started_at = time.perf_counter()
+        outcome = "ok"
+        truncated = False
+
+        stats_name = UNKNOWN_TOOL
+
+        async with self._get_semaphore(agent):
+            try:
+                # Solo tools declaradas por el agente o registradas: el nombre del modelo nunca se importa
+                handler_ref = tool_spec.get("handler")
+                handler = self.registry.load(handler_ref) if handler_ref else self.registry.get(name)
+                if handler is None:
+                    raise LookupError(f"No hay ningún handler registrado como '{name}'")
+                stats_name = name
+                arguments = json.loads(arguments_str)
+                with span("tool", f"tool-{name}"):
+                    result = await asyncio.wait_for(self._call(handler, arguments, agent), timeout)
+                output = result if isinstance(result, str) else json.dumps(result, ensure_ascii=False)
+            except asyncio.TimeoutError:
+                outcome = "timeout"
+                logger.warning("%s ⏱️ Tool '%s' (%s) superó el timeout de %ss", log_prefix, name, call_id, timeout)
+                output = self._error_output(f"La tool '{name}' superó el tiempo máximo de {timeout} segundos")
+            except LookupError as e:
+                outcome = "error"
+                logger.warning("%s ❌ Tool '%s' no disponible: %s", log_prefix, name, e)
+                output = self._error_output(f"La tool '{name}' no está disponible")
+            except json.JSONDecodeError as e:
+                outcome = "error"
+                logger.warning("%s ❌ Error parseando arguments de '%s': %s", log_prefix, name, e)
+                output = self._error_output(f"Argumentos no válidos para '{name}': {e}")
+            except Exception as e:
+                outcome = "error"
+                logger.exception("%s ❌ Error ejecutando tool '%s': %s: %s", log_prefix, name, type(e).__name__, e)
+                output = self._error_output(f"Error ejecutando '{name}'")
+
+        if max_chars and len(output) > max_chars:
+            truncated = True
+            logger.warning("%s ✂️ Resultado de '%s' truncado a %d caracteres (%d)", log_prefix, name, max_chars, len(output))
+            output = output[:max_chars] + TRUNCATED_SUFFIX
+
+        self.registry.record(stats_name, time.perf_counter() - started_at, outcome, truncated)
+        return {
+            "type": "function_call_output",
+            "call_id": call_id,
+            "output": output
+        }
+
+    async def execute(self, function_calls: List[Dict[str, Any]], agent: AgentConfig,
+                      log_prefix: str = "[OpenAI]") -> List[Dict[str, Any]]:
+        """Ejecuta en paralelo las function_calls de un turno, conservando su orden"""
+        local_tools = self.local_tools(agent)
+        if len(function_calls) > 1:
+            logger.info("%s ⚡ Ejecutando %d function_calls en paralelo", log_prefix, len(function_calls))
+        return list(await asyncio.gather(*(
+            self.execute_one(function_call, agent, local_tools.get(function_call.get("name")), log_prefix)
+            for function_call in function_calls
+        )))
+
+
+# Instancias globales
+tool_registry = ToolRegistry()
+tool_engine = ToolEngine(tool_registry)
@@ -0,0 +1,326 @@
+import gzip
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional, Set, Tuple
+from starlette.responses import Response
+from .cache import LRUCache
+from .logging_config import get_logger
+
+# Brotli es opcional (paquete 'brotli'); sin él solo se sirven las variantes gzip e identity
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    BROTLI_AVAILABLE = False
+
+logger = get_logger(__name__)
+
+JS_MEDIA_TYPE = "application/javascript; charset=utf-8"
+
+# Tras estos caracteres (o palabras clave) una '/' abre un literal regex y no es una división
+_REGEX_PRECEDERS = set("(,=:[!&|?{};+-*%<>~^")
+_REGEX_KEYWORDS = {"return", "typeof", "case", "do", "else", "in", "of", "void", "delete", "throw", "new"}
+
+
+def minify_js(source: str) -> str:
+    """Minificado conservador de JavaScript.
+
+    Elimina comentarios, sangrías, espacios repetidos y líneas vacías fuera de
+    strings, plantillas y literales regex. Conserva los saltos de línea, así que la
+    inserción automática de ';' se comporta igual que en el original.
+    """
+    out = []
+    line = []
+    template_braces = []  # Llaves abiertas dentro de cada ${...} de plantillas anidadas
+    i, n = 0, len(source)
+
+    def end_line():
+        text = "".join(line).rstrip()
+        if text:
+            out.append(text + "\n")
+        line.clear()
+
+    def copy_template(start: int) -> int:
+        """Copia una plantilla desde su '`' (o desde el '}' de un ${...}) hasta el '`' o '${' siguiente"""
+        j = start + 1
+        while j < n:
+            char = source[j]
+            if char == "\\":
+                j += 2
+                continue
+            if char == "`":
+                line.append(source[start:j + 1])
+                return j + 1
+            if char == "$" and source.startswith("${", j):
+                line.append(source[start:j + 2])
+                template_braces.append(0)
+                return j + 2
+            j += 1
+        raise ValueError("Plantilla sin cerrar")
+
+    while i < n:
+        char = source[i]
+        if char == "\n":
+            end_line()
+            i += 1
+        elif char in " \t\r":
+            j = i
+            while j < n and source[j] in " \t\r":
+                j += 1
+            if line and line[-1] != " " and source[j:j + 1] not in ("\n", ""):
+                line.append(" ")
+            i = j
+        elif source.startswith("//", i):
+            j = source.find("\n", i)
+            i = n if j < 0 else j
+        elif source.startswith("/*", i):
+            j = source.find("*/", i + 2)
+            if j < 0:
+                raise ValueError("Comentario sin cerrar")
+            # Un comentario con saltos de línea equivale a un salto (por la inserción de ';')
+            if "\n" in source[i:j]:
+                end_line()
+            elif line and line[-1] != " ":
+                line.append(" ")
+            i = j + 2
+        elif char in "'\"":
+            j = i + 1
+            while j < n and source[j] != char:
+                if source[j] == "\n":
+                    raise ValueError("String sin cerrar")
+                j += 2 if source[j] == "\\" else 1
+            line.append(source[i:j + 1])
+            i = j + 1
+        elif char == "`":
+            i = copy_template(i)
+        elif char == "{" and template_braces:
+            template_braces[-1] += 1
+            line.append(char)
+            i += 1
+        elif char == "}" and template_braces:
+            if template_braces[-1] == 0:
+                template_braces.pop()
+                i = copy_template(i)
+            else:
+                template_braces[-1] -= 1
+                line.append(char)
+                i += 1
+        elif char == "/":
+            previous = "".join(line).rstrip()
+            word = previous.split(" ")[-1] if previous else ""
+            if not previous or previous[-1] in _REGEX_PRECEDERS or word in _REGEX_KEYWORDS:
+                j, in_class = i + 1, False
+                while j < n and (in_class or source[j] != "/"):
+                    if source[j] == "\n":
+                        raise ValueError("Regex sin cerrar")
+                    if source[j] == "\\":
+                        j += 1
+                    elif source[j] == "[":
+                        in_class = True
+                    elif source[j] == "]":
+                        in_class = False
+                    j += 1
+                line.append(source[i:j + 1])
+                i = j + 1
+            else:
+                line.append(char)
+                i += 1
+        else:
+            line.append(char)
+            i += 1
+    end_line()
+    return "".join(out)
+
+
+class WidgetBuild:
+    """Una versión del widget ya minificada y comprimida, lista para servirse desde memoria"""
+
+    __slots__ = ("version", "variants", "source_size")
+
+    def __init__(self, content: bytes, source_size: int, version: Optional[str] = None):
+        self.version = version or hashlib.sha256(content).hexdigest()[:16]
+        self.source_size = source_size
+        self.variants: Dict[str, bytes] = {"identity": content, "gzip": gzip.compress(content, compresslevel=9, mtime=0)}
+        if BROTLI_AVAILABLE:
+            self.variants["br"] = brotli.compress(content, mode=brotli.MODE_TEXT, quality=11)
+
+    def etag(self, encoding: str) -> str:
+        return f'"{self.version}"' if encoding == "identity" else f'"{self.version}-{encoding}"'
+
+    def matches(self, if_none_match: Optional[str]) -> bool:
+        """Indica si If-None-Match contiene esta versión (en cualquier codificación)"""
+        if not if_none_match:
+            return False
+        for tag in if_none_match.split(","):
+            tag = tag.strip()
+            if tag == "*":
+                return True
+            if tag.startswith("W/"):
+                tag = tag[2:]
+            if tag.strip('"').split("-")[0] == self.version:
+                return True
+        return False
+
+    def negotiate(self, accept_encoding: Optional[str]) -> str:
+        """Elige la mejor variante disponible según Accept-Encoding (br > gzip > identity)"""
+        accepted = {}
+        for part in (accept_encoding or "").lower().split(","):
+            name, _, params = part.strip().partition(";")
+            quality = 1.0
+            params = params.strip()
+            if params.startswith("q="):
+                try:
+                    quality = float(params[2:])
+                except ValueError:
+                    quality = 0.0
+            accepted[name.strip()] = quality
+        for encoding in ("br", "gzip"):
+            if encoding in self.variants and accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+                return encoding
+        return "identity"
+
+
+class WidgetAsset:
+    """widget.js servido desde memoria.
+
+    refresh() (llamado al arrancar y periódicamente desde una tarea en segundo plano)
+    comprueba el mtime y el tamaño del fichero y, si cambian, reconstruye las
+    variantes; las peticiones nunca tocan el disco. Se conservan las últimas
+    versiones para que las URLs versionadas que aún estén en caché sigan funcionando.
+    """
+
+    MAX_VERSIONS = 5
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.minify = os.getenv("WIDGET_MINIFY", "true").lower() == "true"
+        self.max_age = int(os.getenv("WIDGET_MAX_AGE", "300"))
+        self._stat: Optional[Tuple[int, int]] = None
+        self._current: Optional[WidgetBuild] = None
+        self._versions: "OrderedDict[str, WidgetBuild]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def refresh(self) -> bool:
+        """Recarga el fichero si ha cambiado; devuelve True si hay versión nueva"""
+        with self._lock:
+            try:
+                stat = self.path.stat()
+            except OSError as e:
+                logger.error("[Widget] No se puede leer %s: %s", self.path, e)
+                return False
+            if self._stat == (stat.st_mtime_ns, stat.st_size):
+                return False
+            source = self.path.read_text(encoding="utf-8")
+            content = source
+            if self.minify:
+                try:
+                    content = minify_js(source)
+                except ValueError as e:
+                    logger.error("[Widget] No se pudo minificar %s (%s); se sirve sin minificar", self.path, e)
+            build = WidgetBuild(content.encode("utf-8"), len(source.encode("utf-8")))
+            self._stat = (stat.st_mtime_ns, stat.st_size)
+            if self._current is not None and build.version == self._current.version:
+                return False
+            self._versions[build.version] = build
+            while len(self._versions) > self.MAX_VERSIONS:
+                self._versions.popitem(last=False)
+            self._current = build
+            logger.info(
+                "[Widget] Versión %s cargada (%s)", build.version,
+                ", ".join(f"{encoding}: {len(body)} bytes" for encoding, body in build.variants.items())
+            )
+            return True
+
+    @property
+    def current(self) -> Optional[WidgetBuild]:
+        return self._current
+
+    def get(self, version: str) -> Optional[WidgetBuild]:
+        return self._versions.get(version)
+
+    @property
+    def versioned_path(self) -> Optional[str]:
+        """URL versionada de la versión actual (cacheable de forma indefinida)"""
+        return f"/widget.{self._current.version}.js" if self._current else None
+
+    def stats(self):
+        build = self._current
+        if build is None:
+            return {"loaded": False}
+        return {
+            "loaded": True,
+            "version": build.version,
+            "source_bytes": build.source_size,
+            "bytes": {encoding: len(body) for encoding, body in build.variants.items()},
+            "versions": list(self._versions),
+            "brotli_available": BROTLI_AVAILABLE
+        }
+
+
+class WidgetBootstrapCache:
+    """Bootstraps por agente (/widget/{agent_id}.js): la configuración pública del agente
+    incrustada delante del widget, para no tener que pedir /public-config al cargar.
+
+    Cada entrada guarda la versión del widget con la que se construyó; la versión del
+    bootstrap (y su ETag) combina el hash de la configuración pública y el del widget.
+    Las recargas de configuración descartan las entradas de los agentes cambiados.
+    """
+
+    def __init__(self, asset: WidgetAsset, max_entries: int):
+        self.asset = asset
+        self._cache = LRUCache(max_entries=max(1, max_entries))  # agent_id -> (versión del widget, build)
+
+    def get(self, agent_id: str) -> Optional[WidgetBuild]:
+        entry = self._cache.get(agent_id)
+        current = self.asset.current
+        if entry is None or current is None or entry[0] != current.version:
+            return None
+        return entry[1]
+
+    def build(self, public_config: Dict) -> Optional[WidgetBuild]:
+        """Construye (y comprime) el bootstrap; se llama fuera del event loop"""
+        widget = self.asset.current
+        if widget is None:
+            return None
+        config_json = json.dumps(public_config, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+        config_hash = hashlib.sha256(config_json.encode("utf-8")).hexdigest()[:16]
+        # U+2028/U+2029 son válidos en JSON pero no en strings de JavaScript antiguos
+        config_json = config_json.replace("\u2028", "\\u2028").replace("\u2029", "\\u2029")
+        prefix = f"window.EmbeddableChatbotBootstrap={{agentId:{json.dumps(public_config['id'])},config:{config_json}}};\n"
+        content = prefix.encode("utf-8") + widget.variants["identity"]
+        return WidgetBuild(content, len(content), version=config_hash + widget.version)
+
+    def put(self, agent_id: str, build: WidgetBuild):
+        self._cache.set(agent_id, (build.version[16:], build))
+
+    def forget(self, agent_ids: Set[str]) -> int:
+        return self._cache.invalidate(lambda agent_id: agent_id in agent_ids)
+
+    def stats(self):
+        return self._cache.stats()
+
+
+def widget_response(build: WidgetBuild, if_none_match: Optional[str], accept_encoding: Optional[str],
+                    cache_control: str) -> Response:
+    """Respuesta (200 con la variante comprimida adecuada, o 304) para una versión del widget"""
+    encoding = build.negotiate(accept_encoding)
+    headers = {
+        "ETag": build.etag(encoding),
+        "Cache-Control": cache_control,
+        "Vary": "Accept-Encoding",
+        "X-Widget-Version": build.version
+    }
+    if build.matches(if_none_match):
+        return Response(status_code=304, headers=headers)
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    return Response(build.variants[encoding], media_type=JS_MEDIA_TYPE, headers=headers)
+
+
+# Instancias globales
+widget_asset = WidgetAsset(Path("app/static/widget.js"))
+widget_bootstraps = WidgetBootstrapCache(widget_asset, int(os.getenv("WIDGET_BOOTSTRAP_CACHE_SIZE", "1000")))
@@ -0,0 +1,336 @@
+"""Prueba de carga de la aplicación real contra upstreams simulados, sin red.
+
+Arranca los servidores de benchmarks.mock_upstreams (Azure OpenAI, embeddings,
+Pinecone y n8n), lanza la aplicación con uvicorn en un subproceso apuntando a
+ellos (con copias de los agentes de AGENTS_DIR cuyos webhooks y endpoints se
+reescriben hacia los simulados) y reproduce tráfico a un ritmo fijo de peticiones
+por segundo. El generador es de bucle abierto: cada petición sale en su instante
+programado aunque las anteriores no hayan terminado, y la latencia se mide desde
+ese instante (sin omisión coordinada).
+
+El tráfico es un JSONL con una petición por línea, que se repite en bucle:
+    {"endpoint": "chat", "agent_id": "openai-agent-txt", "message": "Hola", "conversation_id": "c1"}
+endpoint puede ser chat, stream, public-config o widget. Sin --traffic se genera
+tráfico sintético con todos los agentes.
+
+Informa del throughput y de p50/p95/p99 por endpoint (en streaming, también hasta
+el primer delta) y por etapa del pipeline, a partir de la cabecera Server-Timing
+(en streaming solo cuentan las etapas anteriores al inicio del cuerpo).
+
+Uso:
+    python -m benchmarks.load_test [--rps 20] [--duration 30] [--traffic fichero.jsonl]
+    python -m benchmarks.load_test --app-url http://127.0.0.1:8000   # aplicación ya arrancada
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import httpx
+
+from benchmarks.mock_upstreams import MockUpstreams, add_latency_arguments, free_port, latency_from_args
+
+QUESTIONS = [
+    "¿Qué horario tiene la biblioteca?",
+    "¿Cuántos libros puedo sacar en préstamo?",
+    "¿Cómo renuevo un préstamo?",
+    "¿Abrís en periodo de exámenes?",
+    "¿Dónde puedo imprimir?",
+    "¿Cómo accedo a las bases de datos desde casa?",
+    "¿Puedo reservar una sala de estudio?",
+    "¿Qué pasa si devuelvo un libro tarde?",
+]
+
+_STAGE_SUFFIX = re.compile(r"-\d+$")
+
+
+def prepare_agents(source: Path, target: Path, mocks: MockUpstreams) -> List[Dict]:
+    """Copia los agentes reescribiendo las URLs de n8n y de los backends custom hacia los simulados"""
+    target.mkdir(parents=True, exist_ok=True)
+    agents = []
+    for path in sorted(source.glob("*.json")):
+        config = json.loads(path.read_text(encoding="utf-8"))
+        if config.get("n8n_config"):
+            config["n8n_config"]["webhook_url"] = f"{mocks.n8n_url}/webhook/{config['id']}"
+        if config.get("type") == "custom":
+            config["chat_endpoint"] = f"{mocks.n8n_url}/custom"
+        (target / path.name).write_text(json.dumps(config, ensure_ascii=False), encoding="utf-8")
+        if config.get("enabled", True):
+            agents.append(config)
+    return agents
+
+
+def synthetic_traffic(agents: List[Dict], stream_ratio: float, seed: int) -> Iterator[Dict]:
+    """Mezcla de chat (normal y streaming), configuración pública y widget.js"""
+    generator = random.Random(seed)
+    conversations = [f"bench-{i}" for i in range(50)]
+    while True:
+        agent_id = generator.choice(agents)["id"]
+        roll = generator.random()
+        if roll < 0.1:
+            yield {"endpoint": "widget"}
+        elif roll < 0.25:
+            yield {"endpoint": "public-config", "agent_id": agent_id}
+        else:
+            yield {
+                "endpoint": "stream" if generator.random() < stream_ratio else "chat",
+                "agent_id": agent_id,
+                "message": generator.choice(QUESTIONS),
+                "conversation_id": generator.choice(conversations)
+            }
+
+
+def file_traffic(path: Path) -> Iterator[Dict]:
+    lines = [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines() if line.strip()]
+    if not lines:
+        raise SystemExit(f"{path} no contiene peticiones")
+    return itertools.cycle(lines)
+
+
+def parse_server_timing(header: Optional[str]) -> Dict[str, float]:
+    """Server-Timing -> {etapa: segundos}, sumando las repeticiones (openai-1, openai-2...)"""
+    stages: Dict[str, float] = defaultdict(float)
+    for part in (header or "").split(","):
+        name, _, params = part.strip().partition(";")
+        if not name or not params.startswith("dur="):
+            continue
+        stages[_STAGE_SUFFIX.sub("", name)] += float(params[4:]) / 1000
+    return stages
+
+
+class Results:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.stages: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+
+    def record(self, endpoint: str, status: str, seconds: float):
+        self.statuses[endpoint][status] += 1
+        if status == "200":
+            self.latencies[endpoint].append(seconds)
+
+    def record_stages(self, header: Optional[str]):
+        for stage, seconds in parse_server_timing(header).items():
+            self.stages[stage].append(seconds)
+
+
+async def execute(client: httpx.AsyncClient, item: Dict, scheduled: float, results: Results):
+    endpoint = item.get("endpoint", "chat")
+    loop = asyncio.get_running_loop()
+    try:
+        if endpoint == "widget":
+            response = await client.get("/widget.js", headers={"Accept-Encoding": "gzip"})
+            results.record(endpoint, str(response.status_code), loop.time() - scheduled)
+        elif endpoint == "public-config":
+            response = await client.get(f"/public-config/{item['agent_id']}")
+            results.record(endpoint, str(response.status_code), loop.time() - scheduled)
+        elif endpoint == "stream":
+            body = {"message": item.get("message", ""), "conversation_id": item.get("conversation_id")}
+            async with client.stream("POST", f"/chat/{item['agent_id']}/stream", json=body) as response:
+                status = str(response.status_code)
+                first_delta = None
+                async for line in response.aiter_lines():
+                    if line.startswith("event: delta") and first_delta is None:
+                        first_delta = loop.time() - scheduled
+                    elif line.startswith("event: error"):
+                        status = "error"
+                results.record_stages(response.headers.get("server-timing"))
+            results.record(endpoint, status, loop.time() - scheduled)
+            if first_delta is not None and status == "200":
+                results.latencies["stream (primer delta)"].append(first_delta)
+        else:
+            body = {"message": item.get("message", ""), "conversation_id": item.get("conversation_id")}
+            response = await client.post(f"/chat/{item['agent_id']}", json=body)
+            results.record(endpoint, str(response.status_code), loop.time() - scheduled)
+            results.record_stages(response.headers.get("server-timing"))
+    except httpx.HTTPError as e:
+        results.record(endpoint, type(e).__name__, loop.time() - scheduled)
+
+
+async def run_load(base_url: str, traffic: Iterator[Dict], rps: float, duration: float,
+                   timeout: float) -> Tuple[Results, float]:
+    results = Results()
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits) as client:
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        tasks = []
+        for i, item in enumerate(traffic):
+            scheduled = started + i / rps
+            if scheduled - started >= duration:
+                break
+            delay = scheduled - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(execute(client, item, scheduled, results)))
+        await asyncio.gather(*tasks)
+        elapsed = loop.time() - started
+    return results, elapsed
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Percentil por rango más cercano"""
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(q * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "p50_ms": round(percentile(values, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(values, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(values, 0.99) * 1000, 2),
+        "max_ms": round(max(values) * 1000, 2)
+    }
+
+
+def report(results: Results, elapsed: float, rps: float) -> Dict:
+    total = sum(sum(statuses.values()) for statuses in results.statuses.values())
+    ok = sum(statuses.get("200", 0) for statuses in results.statuses.values())
+    summary = {
+        "elapsed_seconds": round(elapsed, 2),
+        "requests": total,
+        "ok": ok,
+        "throughput_rps": round(total / elapsed, 2) if elapsed else 0.0,
+        "target_rps": rps,
+        "endpoints": {},
+        "stages": {stage: summarize(values) for stage, values in sorted(results.stages.items())}
+    }
+    for endpoint in sorted(set(results.latencies) | set(results.statuses)):
+        summary["endpoints"][endpoint] = {
+            **summarize(results.latencies.get(endpoint, [])),
+            "statuses": dict(results.statuses.get(endpoint, {}))
+        }
+
+    print(f"\n{total} peticiones en {elapsed:.1f} s: {summary['throughput_rps']} req/s (objetivo {rps}), {ok} correctas")
+    header = f"  {'':<24}{'n':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'máx ms':>10}"
+    for title, rows in (("Por endpoint:", summary["endpoints"]), ("Por etapa (Server-Timing):", summary["stages"])):
+        print(f"\n{title}\n{header}")
+        for name, row in rows.items():
+            if not row.get("count"):
+                print(f"  {name:<24}{0:>7}")
+                continue
+            print(
+                f"  {name:<24}{row['count']:>7}{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}"
+                f"{row['p99_ms']:>10.1f}{row['max_ms']:>10.1f}"
+            )
+    errors = {
+        endpoint: {status: count for status, count in statuses.items() if status != "200"}
+        for endpoint, statuses in results.statuses.items()
+    }
+    errors = {endpoint: statuses for endpoint, statuses in errors.items() if statuses}
+    if errors:
+        print(f"\nErrores: {json.dumps(errors, ensure_ascii=False)}")
+    return summary
+
+
+def start_app(port: int, env: Dict[str, str], workers: int) -> subprocess.Popen:
+    command = [
+        sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+        "--log-level", "warning", "--no-access-log"
+    ]
+    if workers > 1:
+        command += ["--workers", str(workers)]
+    return subprocess.Popen(command, env={**os.environ, **env})
+
+
+def wait_ready(base_url: str, process: Optional[subprocess.Popen], timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise SystemExit("La aplicación ha terminado durante el arranque")
+        try:
+            if httpx.get(f"{base_url}/", timeout=1.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise SystemExit("La aplicación no ha respondido a tiempo")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rps", type=float, default=20.0, help="Peticiones por segundo")
+    parser.add_argument("--duration", type=float, default=30.0, help="Segundos de carga")
+    parser.add_argument("--warmup", type=float, default=3.0, help="Segundos de calentamiento (no se miden)")
+    parser.add_argument("--traffic", type=Path, help="JSONL de peticiones (por defecto, tráfico sintético)")
+    parser.add_argument("--stream-ratio", type=float, default=0.5, help="Fracción de chats en streaming (sintético)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--agents-dir", type=Path, default=Path(os.getenv("AGENTS_DIR", "app/agents")))
+    parser.add_argument("--workers", type=int, default=1, help="Procesos de uvicorn de la aplicación")
+    parser.add_argument("--app-url", help="Usar una aplicación ya arrancada en lugar de lanzarla")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Timeout del cliente por petición")
+    parser.add_argument("--json", type=Path, help="Guarda el resumen en este fichero")
+    parser.add_argument("--env", action="append", default=[], metavar="CLAVE=VALOR",
+                        help="Variable de entorno adicional para la aplicación (repetible)")
+    add_latency_arguments(parser)
+    args = parser.parse_args()
+
+    mocks = MockUpstreams(latency_from_args(args))
+    mocks.start()
+    workdir = Path(tempfile.mkdtemp(prefix="agentclic-bench-"))
+    process = None
+    try:
+        agents = prepare_agents(args.agents_dir, workdir / "agents", mocks)
+        if args.app_url:
+            base_url = args.app_url.rstrip("/")
+            print("Aplicación externa: arráncala con estas variables para usar los upstreams simulados:")
+            for name, value in {**mocks.environment(), "AGENTS_DIR": str(workdir / "agents")}.items():
+                print(f"  {name}={value}")
+        else:
+            port = free_port()
+            base_url = f"http://127.0.0.1:{port}"
+            env = {
+                **mocks.environment(),
+                "AGENTS_DIR": str(workdir / "agents"),
+                "METRICS_DIR": str(workdir / "metrics"),
+                "CONVERSATION_DB": str(workdir / "conversations.db"),
+                "SERVER_TIMING": "true",
+                "LOG_LEVEL": "WARNING",
+                "CONFIG_WATCH_INTERVAL": "0",
+                "WIDGET_WATCH_INTERVAL": "0",
+                # Con varios workers, estado compartido (cachés y métricas) en el directorio temporal
+                **({"SHARED_STATE_DIR": str(workdir / "shared")} if args.workers > 1 else {}),
+                **dict(item.split("=", 1) for item in args.env)
+            }
+            process = start_app(port, env, args.workers)
+        wait_ready(base_url, process)
+
+        traffic = file_traffic(args.traffic) if args.traffic else synthetic_traffic(agents, args.stream_ratio, args.seed)
+        print(f"Agentes: {', '.join(agent['id'] for agent in agents)}")
+        if args.warmup > 0:
+            print(f"Calentamiento: {args.warmup:g} s a {args.rps:g} req/s...")
+            asyncio.run(run_load(base_url, traffic, args.rps, args.warmup, args.timeout))
+        print(f"Carga: {args.duration:g} s a {args.rps:g} req/s...")
+        results, elapsed = asyncio.run(run_load(base_url, traffic, args.rps, args.duration, args.timeout))
+        summary = report(results, elapsed, args.rps)
+        if args.json:
+            args.json.write_text(json.dumps(summary, ensure_ascii=False, indent=2), encoding="utf-8")
+            print(f"\nResumen guardado en {args.json}")
+    finally:
+        if process is not None:
+            process.terminate()
+            try:
+                process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        mocks.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""Compara el conversor incremental de markdown con la implementación anterior basada en regex.
+
+Primero verifica que el conversor reproduce exactamente el corpus dorado
+(markdown_golden.json), tanto con el texto completo como troceado en fragmentos
+de distintos tamaños, y después mide el tiempo de ambas implementaciones.
+
+Uso:
+    python -m benchmarks.markdown_bench [--repeat 200]
+"""
+import argparse
+import json
+import re
+import sys
+import timeit
+from pathlib import Path
+
+from app.markdown_stream import MarkdownStreamConverter, convert_markdown_to_html
+
+GOLDEN_FILE = Path(__file__).with_name("markdown_golden.json")
+CHUNK_SIZES = (1, 3, 7, 64)
+
+
+def legacy_convert_markdown_to_html(text: str) -> str:
+    """Copia literal del ChatService._convert_markdown_to_html original (referencia)"""
+    markdown_link_pattern = r'\[([^\]]+)\]\(([^)]+)\)'
+
+    def replace_link(match):
+        link_text = match.group(1)
+        url = match.group(2)
+        if not url.startswith(('http://', 'https://')):
+            url = 'https://' + url
+        return f'<a href="{url}" target="_blank" rel="noopener noreferrer">{link_text}</a>'
+
+    text = re.sub(markdown_link_pattern, replace_link, text)
+    text = re.sub(r'\*\*([^*]+)\*\*', r'<strong>\1</strong>', text)
+    text = re.sub(r'\*([^*]+)\*', r'<em>\1</em>', text)
+
+    lines = text.split('\n')
+    processed_lines = []
+    list_stack = []
+
+    for line in lines:
+        stripped_line = line.strip()
+        indent_level = (len(line) - len(line.lstrip())) // 2
+
+        if stripped_line.startswith('- '):
+            list_item = stripped_line[2:].strip()
+            while len(list_stack) > indent_level:
+                processed_lines.append('</ul>')
+                list_stack.pop()
+            if len(list_stack) != indent_level:
+                processed_lines.append('<ul>')
+                list_stack.append(indent_level)
+            processed_lines.append(f'<li>{list_item}</li>')
+        elif stripped_line:
+            while list_stack:
+                processed_lines.append('</ul>')
+                list_stack.pop()
+            processed_lines.append(stripped_line)
+        else:
+            if not list_stack:
+                processed_lines.append('')
+
+    while list_stack:
+        processed_lines.append('</ul>')
+        list_stack.pop()
+
+    result_parts = []
+    for line in processed_lines:
+        if line == '':
+            if result_parts and not result_parts[-1].endswith('<br><br>'):
+                result_parts.append('<br><br>')
+        elif line.startswith('<ul>') or line.startswith('</ul>') or line.startswith('<li>'):
+            result_parts.append(line)
+        else:
+            if result_parts and not result_parts[-1].endswith(('<ul>', '</ul>', '<br>', '<br><br>')):
+                result_parts.append('<br>')
+            result_parts.append(line)
+
+    text = ''.join(result_parts)
+    text = re.sub(r'(<br>\s*){3,}', '<br><br>', text)
+    text = re.sub(r'<br></ul>', '</ul>', text)
+    text = re.sub(r'<ul><br>', '<ul>', text)
+    return text
+
+
+def convert_in_chunks(text: str, chunk_size: int) -> str:
+    converter = MarkdownStreamConverter()
+    parts = [converter.feed(text[i:i + chunk_size]) for i in range(0, len(text), chunk_size)]
+    parts.append(converter.finish())
+    return "".join(parts)
+
+
+def check_golden(cases) -> int:
+    failures = 0
+    for case in cases:
+        expected = case["html"]
+        results = {"legacy": legacy_convert_markdown_to_html(case["markdown"]),
+                   "completo": convert_markdown_to_html(case["markdown"])}
+        for size in CHUNK_SIZES:
+            results[f"chunks={size}"] = convert_in_chunks(case["markdown"], size)
+        for label, html in results.items():
+            if html != expected:
+                failures += 1
+                print(f"FALLO {case['name']} ({label})\n  esperado: {expected!r}\n  obtenido: {html!r}")
+    return failures
+
+
+def bench(label: str, func, repeat: int) -> float:
+    seconds = min(timeit.repeat(func, number=repeat, repeat=5)) / repeat
+    print(f"  {label:<28} {seconds * 1e6:10.1f} µs")
+    return seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=200, help="Iteraciones por medición")
+    args = parser.parse_args()
+
+    cases = json.loads(GOLDEN_FILE.read_text(encoding="utf-8"))
+    failures = check_golden(cases)
+    print(f"Corpus dorado: {len(cases)} casos, {failures} fallos")
+    if failures:
+        sys.exit(1)
+
+    long_text = next(case["markdown"] for case in cases if case["name"] == "long_answer") * 4
+    print(f"\nRespuesta larga ({len(long_text)} caracteres):")
+    legacy = bench("regex (anterior)", lambda: legacy_convert_markdown_to_html(long_text), args.repeat)
+    single = bench("incremental, texto completo", lambda: convert_markdown_to_html(long_text), args.repeat)
+    bench("incremental, deltas de 4", lambda: convert_in_chunks(long_text, 4), max(1, args.repeat // 10))
+    print(f"  speedup texto completo: {legacy / single:.2f}x")
+
+    short_text = next(case["markdown"] for case in cases if case["name"] == "nested_list")
+    print(f"\nRespuesta corta ({len(short_text)} caracteres):")
+    bench("regex (anterior)", lambda: legacy_convert_markdown_to_html(short_text), args.repeat * 10)
+    bench("incremental, texto completo", lambda: convert_markdown_to_html(short_text), args.repeat * 10)
+
+
+if __name__ == "__main__":
+    main()
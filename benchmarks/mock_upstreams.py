@@ -0,0 +1,309 @@
+"""Servidores locales que imitan los upstreams de la aplicación para pruebas de carga sin red.
+
+- Azure OpenAI: Responses API (normal y en streaming SSE, con function_call de
+  semantic_search en la primera petición de los agentes con Pinecone) y embeddings.
+- Pinecone: describe_index del plano de control y /query, /vectors/list y
+  /vectors/fetch del índice (para construir índices locales con app.local_index).
+- n8n: webhooks (/webhook/<id>) y un backend personalizado (/custom).
+
+Cada upstream escucha en su propio puerto, con latencia configurable (media y
+jitter en milisegundos) para reproducir el comportamiento de los servicios reales.
+
+Uso (servidores sueltos, p.ej. para apuntar a mano la aplicación):
+    python -m benchmarks.mock_upstreams [--openai-latency 800] [--port 9100]
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import socket
+import threading
+import time
+from typing import Dict, List, Optional
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+ANSWER = (
+    "Según la **información disponible**, la biblioteca abre de lunes a viernes de 8:00 a 21:00. "
+    "Durante el periodo de exámenes amplía el horario hasta las 23:00. Puedes consultar más detalles en "
+    "[la web de la biblioteca](https://example.com/biblioteca) o escribir a biblioteca@example.com.\n"
+    "- Préstamo: hasta 15 días\n- Renovaciones: 2 veces"
+)
+
+
+class MockLatency:
+    """Latencias simuladas (milisegundos) de cada upstream"""
+
+    def __init__(self, openai: float = 600.0, openai_token: float = 15.0, embedding: float = 60.0,
+                 pinecone: float = 40.0, n8n: float = 300.0, jitter: float = 0.3):
+        self.openai = openai  # Hasta el primer token (o hasta la respuesta completa sin streaming)
+        self.openai_token = openai_token  # Entre deltas del streaming
+        self.embedding = embedding
+        self.pinecone = pinecone
+        self.n8n = n8n
+        self.jitter = jitter  # Variación relativa (0.3 = ±30 %)
+
+    async def sleep(self, milliseconds: float):
+        if milliseconds > 0:
+            factor = 1 + random.uniform(-self.jitter, self.jitter)
+            await asyncio.sleep(milliseconds * factor / 1000)
+
+
+def free_port(host: str = "127.0.0.1") -> int:
+    with socket.socket() as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+
+
+def mock_embedding(text: str, dimension: int = 256) -> List[float]:
+    """Vector determinista por texto (misma entrada, mismo embedding)"""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "big")
+    generator = random.Random(seed)
+    return [generator.uniform(-1, 1) for _ in range(dimension)]
+
+
+def faq_metadata(i: int) -> Dict[str, str]:
+    return {
+        "pregunta": f"Pregunta frecuente {i}",
+        "respuesta": f"Respuesta de ejemplo número {i} sobre horarios, préstamos y servicios."
+    }
+
+
+def _response_object(response_id: str, output: List[Dict]) -> Dict:
+    return {"id": response_id, "object": "response", "status": "completed", "output": output}
+
+
+def _answer_output(text: str) -> List[Dict]:
+    return [{"type": "message", "role": "assistant", "content": [{"type": "output_text", "text": text}]}]
+
+
+def openai_app(latency: MockLatency, embedding_dimension: int = 256) -> Starlette:
+    """Azure OpenAI: /openai/v1/responses y /openai/deployments/<deployment>/embeddings"""
+    counter = {"responses": 0}
+
+    async def responses(request: Request):
+        body = json.loads(await request.body())
+        counter["responses"] += 1
+        response_id = f"resp_bench_{counter['responses']}"
+        tools = {tool.get("name") for tool in body.get("tools", [])}
+        first_request = isinstance(body.get("input"), list) and body["input"][0].get("role") == "system"
+
+        if "semantic_search" in tools and first_request:
+            # Primera vuelta de un agente con Pinecone: el modelo pide una búsqueda
+            query = body["input"][-1]["content"][0]["text"]
+            output = [{
+                "type": "function_call", "name": "semantic_search", "call_id": f"call_{response_id}",
+                "arguments": json.dumps({"query": query}, ensure_ascii=False)
+            }]
+            text = ""
+        else:
+            output = _answer_output(ANSWER)
+            text = ANSWER
+
+        if not body.get("stream"):
+            await latency.sleep(latency.openai)
+            return JSONResponse(_response_object(response_id, output))
+
+        async def events():
+            def sse(event: Dict) -> bytes:
+                return f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n".encode("utf-8")
+
+            yield sse({"type": "response.created", "response": _response_object(response_id, [])})
+            await latency.sleep(latency.openai)
+            for i in range(0, len(text), 12):
+                yield sse({"type": "response.output_text.delta", "delta": text[i:i + 12]})
+                await latency.sleep(latency.openai_token)
+            yield sse({"type": "response.completed", "response": _response_object(response_id, output)})
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    async def embeddings(request: Request):
+        body = json.loads(await request.body())
+        await latency.sleep(latency.embedding)
+        texts = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        data = [
+            {"object": "embedding", "index": i, "embedding": mock_embedding(text, embedding_dimension)}
+            for i, text in enumerate(texts)
+        ]
+        return JSONResponse({"object": "list", "data": data})
+
+    return Starlette(routes=[
+        Route("/openai/v1/responses", responses, methods=["POST"]),
+        Route("/openai/deployments/{deployment}/embeddings", embeddings, methods=["POST"]),
+    ])
+
+
+def pinecone_app(latency: MockLatency, data_plane_url: str, dimension: int = 256, size: int = 200) -> Starlette:
+    """Pinecone: plano de control (describe_index) y plano de datos (/query, /vectors/*) en el mismo servidor
+
+    El índice tiene 'size' FAQs cuyos vectores son los embeddings simulados de su pregunta.
+    """
+
+    async def describe_index(request: Request):
+        name = request.path_params["name"]
+        return JSONResponse({
+            "name": name,
+            "dimension": dimension,
+            "metric": "cosine",
+            "host": data_plane_url,
+            "vector_type": "dense",
+            "deletion_protection": "disabled",
+            "spec": {"serverless": {"cloud": "aws", "region": "us-east-1"}},
+            "status": {"ready": True, "state": "Ready"}
+        })
+
+    async def query(request: Request):
+        body = json.loads(await request.body())
+        await latency.sleep(latency.pinecone)
+        top_k = body.get("topK", 10)
+        matches = [
+            {"id": f"faq-{i}", "score": round(0.9 - i * 0.01, 4), "metadata": faq_metadata(i)}
+            for i in range(top_k)
+        ]
+        return JSONResponse({"matches": matches, "namespace": body.get("namespace", ""), "usage": {"readUnits": 5}})
+
+    async def list_vectors(request: Request):
+        limit = int(request.query_params.get("limit", 100))
+        start = int(request.query_params.get("paginationToken", 0))
+        end = min(start + limit, size)
+        page = {"vectors": [{"id": f"faq-{i}"} for i in range(start, end)], "namespace": "", "usage": {"readUnits": 1}}
+        if end < size:
+            page["pagination"] = {"next": str(end)}
+        return JSONResponse(page)
+
+    async def fetch_vectors(request: Request):
+        vectors = {}
+        for vector_id in request.query_params.getlist("ids"):
+            i = int(vector_id.rsplit("-", 1)[-1])
+            if 0 <= i < size:
+                vectors[vector_id] = {
+                    "id": vector_id,
+                    "values": mock_embedding(faq_metadata(i)["pregunta"], dimension),
+                    "metadata": faq_metadata(i)
+                }
+        return JSONResponse({"vectors": vectors, "namespace": "", "usage": {"readUnits": 1}})
+
+    return Starlette(routes=[
+        Route("/indexes/{name}", describe_index, methods=["GET"]),
+        Route("/query", query, methods=["POST"]),
+        Route("/vectors/list", list_vectors, methods=["GET"]),
+        Route("/vectors/fetch", fetch_vectors, methods=["GET"]),
+    ])
+
+
+def n8n_app(latency: MockLatency) -> Starlette:
+    """n8n (/webhook/<id>) y backend personalizado (/custom, responde en data.response)"""
+
+    async def webhook(request: Request):
+        body = json.loads(await request.body())
+        await latency.sleep(latency.n8n)
+        return JSONResponse([{"output": f"{ANSWER}\n\n(n8n: {body.get('chatInput', '')[:40]})"}])
+
+    async def custom(request: Request):
+        await request.body()
+        await latency.sleep(latency.n8n)
+        return JSONResponse({"data": {"response": ANSWER}})
+
+    return Starlette(routes=[
+        Route("/webhook/{webhook_id}", webhook, methods=["POST"]),
+        Route("/custom", custom, methods=["POST"]),
+    ])
+
+
+class MockUpstreams:
+    """Arranca los tres servidores simulados en un hilo con su propio event loop"""
+
+    def __init__(self, latency: MockLatency, host: str = "127.0.0.1", base_port: Optional[int] = None):
+        self.latency = latency
+        self.host = host
+        ports = [base_port + i for i in range(3)] if base_port else [free_port(host) for _ in range(3)]
+        self.openai_url = f"http://{host}:{ports[0]}"
+        self.pinecone_url = f"http://{host}:{ports[1]}"
+        self.n8n_url = f"http://{host}:{ports[2]}"
+        self._servers = [
+            self._server(openai_app(latency), ports[0]),
+            self._server(pinecone_app(latency, self.pinecone_url), ports[1]),
+            self._server(n8n_app(latency), ports[2]),
+        ]
+        self._thread: Optional[threading.Thread] = None
+
+    def _server(self, app: Starlette, port: int) -> uvicorn.Server:
+        config = uvicorn.Config(app, host=self.host, port=port, log_level="warning", access_log=False)
+        server = uvicorn.Server(config)
+        server.install_signal_handlers = lambda: None  # Se ejecutan fuera del hilo principal
+        return server
+
+    def start(self, timeout: float = 10.0):
+        def run():
+            asyncio.run(self._serve())
+
+        self._thread = threading.Thread(target=run, name="mock-upstreams", daemon=True)
+        self._thread.start()
+        deadline = time.monotonic() + timeout
+        while not all(server.started for server in self._servers):
+            if time.monotonic() > deadline:
+                raise RuntimeError("Los servidores simulados no han arrancado")
+            time.sleep(0.05)
+
+    async def _serve(self):
+        await asyncio.gather(*(server.serve() for server in self._servers))
+
+    def stop(self):
+        for server in self._servers:
+            server.should_exit = True
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def environment(self) -> Dict[str, str]:
+        """Variables de entorno para que la aplicación use los servidores simulados"""
+        return {
+            "AZURE_OPENAI_ENDPOINT": self.openai_url,
+            "OPENAI_API_KEY": "bench",
+            "PINECONE_API_KEY": "bench",
+            "PINECONE_CONTROLLER_HOST": self.pinecone_url,
+        }
+
+
+def add_latency_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--openai-latency", type=float, default=600.0, help="ms hasta la respuesta o el primer token")
+    parser.add_argument("--token-latency", type=float, default=15.0, help="ms entre deltas del streaming")
+    parser.add_argument("--embedding-latency", type=float, default=60.0, help="ms por embedding")
+    parser.add_argument("--pinecone-latency", type=float, default=40.0, help="ms por query de Pinecone")
+    parser.add_argument("--n8n-latency", type=float, default=300.0, help="ms por webhook de n8n o backend custom")
+    parser.add_argument("--jitter", type=float, default=0.3, help="variación relativa de las latencias")
+
+
+def latency_from_args(args) -> MockLatency:
+    return MockLatency(
+        openai=args.openai_latency, openai_token=args.token_latency, embedding=args.embedding_latency,
+        pinecone=args.pinecone_latency, n8n=args.n8n_latency, jitter=args.jitter
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100, help="Puerto del primero (OpenAI); Pinecone y n8n usan los dos siguientes")
+    add_latency_arguments(parser)
+    args = parser.parse_args()
+
+    mocks = MockUpstreams(latency_from_args(args), args.host, args.port)
+    mocks.start()
+    print("Servidores simulados en marcha (Ctrl+C para parar):")
+    for name, value in mocks.environment().items():
+        print(f"  {name}={value}")
+    print(f"  Webhook de n8n: {mocks.n8n_url}/webhook/<id>   Backend custom: {mocks.n8n_url}/custom")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        mocks.stop()
+
+
+if __name__ == "__main__":
+    main()
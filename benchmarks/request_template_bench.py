@@ -0,0 +1,105 @@
+"""Compara el coste por petición de construir y serializar el body de la Responses API.
+
+"anterior" reconstruye el dict completo en cada petición (como hacía
+ChatService._build_openai_request) y lo serializa; "plantilla" usa el
+OpenAIRequestTemplate precompilado al cargar el agente. Antes de medir verifica
+que ambos bodies son equivalentes para todos los agentes openai de app/agents.
+
+Uso:
+    python -m benchmarks.request_template_bench [--repeat 20000]
+"""
+import argparse
+import json
+import sys
+import timeit
+
+from app.config import config_manager
+from app.models import AgentType
+from app.request_template import SEMANTIC_SEARCH_TOOL, OpenAIRequestTemplate
+from app.tools import tool_engine
+
+MESSAGE = "¿Qué horario tiene la biblioteca durante el periodo de exámenes?"
+PREVIOUS_RESPONSE_ID = "resp_0123456789abcdef"
+
+
+def legacy_build_body(agent, message, previous_response_id=None, stream=False):
+    """Construcción del body anterior a las plantillas (referencia)"""
+    body = {
+        "model": agent.openai_config.model,
+        "input": [
+            {"role": "system", "content": [{"type": "input_text", "text": agent.openai_config.instructions}]},
+            {"role": "user", "content": [{"type": "input_text", "text": message}]}
+        ],
+        "text": {"format": {"type": "text"}},
+        "reasoning": {},
+        "tools": tool_engine.api_tools(agent),
+        "max_output_tokens": agent.openai_config.max_output_tokens,
+        "store": True
+    }
+    if agent.openai_config.model != "o4-mini":
+        body["temperature"] = agent.openai_config.temperature
+        body["top_p"] = agent.openai_config.top_p
+    if agent.openai_config.pinecone_index:
+        body["tools"] = body["tools"] + [SEMANTIC_SEARCH_TOOL]
+    if agent.openai_config.tools:
+        for tool in agent.openai_config.tools:
+            if isinstance(tool, dict) and tool.get("type") == "file_search":
+                body["include"] = ["file_search_call.results"]
+                break
+    if previous_response_id:
+        body["previous_response_id"] = previous_response_id
+    if stream:
+        body["stream"] = True
+    return body
+
+
+def legacy_serialize(agent, message, previous_response_id=None, stream=False) -> bytes:
+    # httpx serializa json= con json.dumps y los parámetros por defecto
+    return json.dumps(legacy_build_body(agent, message, previous_response_id, stream)).encode("utf-8")
+
+
+def check_equivalence(agents) -> int:
+    failures = 0
+    for agent in agents:
+        template = OpenAIRequestTemplate(agent)
+        for previous_response_id in (None, PREVIOUS_RESPONSE_ID):
+            for stream in (False, True):
+                expected = legacy_build_body(agent, MESSAGE, previous_response_id, stream)
+                obtained = json.loads(template.render(MESSAGE, previous_response_id, stream))
+                if obtained != expected:
+                    failures += 1
+                    print(f"FALLO {agent.id} (previous_response_id={previous_response_id}, stream={stream})")
+    return failures
+
+
+def bench(label: str, func, repeat: int) -> float:
+    seconds = min(timeit.repeat(func, number=repeat, repeat=5)) / repeat
+    print(f"  {label:<12} {seconds * 1e6:10.2f} µs")
+    return seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=20000, help="Iteraciones por medición")
+    args = parser.parse_args()
+
+    agents = [
+        agent for agent in config_manager.iter_agents()
+        if agent.type == AgentType.OPENAI and agent.openai_config
+    ]
+    failures = check_equivalence(agents)
+    print(f"Equivalencia: {len(agents)} agentes, {failures} fallos")
+    if failures:
+        sys.exit(1)
+
+    for agent in agents:
+        template = config_manager.get_request_template(agent)
+        size = len(template.render(MESSAGE))
+        print(f"\n{agent.id} ({size} bytes, {len(template.tools)} tools):")
+        legacy = bench("anterior", lambda: legacy_serialize(agent, MESSAGE, PREVIOUS_RESPONSE_ID), args.repeat)
+        compiled = bench("plantilla", lambda: template.render(MESSAGE, PREVIOUS_RESPONSE_ID), args.repeat)
+        print(f"  speedup: {legacy / compiled:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
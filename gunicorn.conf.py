@@ -0,0 +1,45 @@
+"""Configuración de gunicorn para el modo multi-worker (un proceso por núcleo).
+
+Uso: gunicorn -c gunicorn.conf.py app.main:app
+(el Dockerfile lo usa cuando WEB_CONCURRENCY > 1)
+
+Cada worker es un proceso con su propio event loop. Las cachés de embeddings y
+de búsquedas, los histogramas de latencia y los segmentos de métricas se
+comparten a través de SHARED_STATE_DIR (tmpfs por defecto); ver app/shared_state.py.
+"""
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+# No se importa nada de 'app' aquí: el maestro no debe crear hilos ni conexiones que heredarían los workers
+# (mismo directorio por defecto que app/shared_state.py)
+DEFAULT_SHARED_STATE_DIR = os.path.join(
+    "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "agentclic"
+)
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8080')}"
+workers = int(os.getenv("WEB_CONCURRENCY") or multiprocessing.cpu_count())
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# Sin preload: cada worker importa la aplicación tras el fork (hilos, conexiones y SQLite propios)
+preload_app = False
+
+# Los workers de uvicorn avisan de que siguen vivos aunque haya streams largos en curso
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "60"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+keepalive = 5
+
+accesslog = None
+errorlog = "-"
+
+
+def on_starting(server):
+    """Activa el estado compartido para los workers y descarta el de una ejecución anterior"""
+    directory = os.environ.setdefault("SHARED_STATE_DIR", DEFAULT_SHARED_STATE_DIR)
+    shutil.rmtree(directory, ignore_errors=True)
+    server.log.info("Estado compartido entre %d workers en %s", workers, directory)
+
+
+def on_exit(server):
+    shutil.rmtree(os.environ["SHARED_STATE_DIR"], ignore_errors=True)
@@ -0,0 +1,23 @@
+import json
+from pathlib import Path
+from typing import Any, Dict
+
+import pytest
+
+from app.models import AgentConfig
+
+AGENTS_DIR = Path(__file__).resolve().parent.parent / "app" / "agents"
+
+
+def agent_data(**openai_config: Any) -> Dict[str, Any]:
+    """JSON de openai-agent-txt con los campos de openai_config indicados sustituidos"""
+    data = json.loads((AGENTS_DIR / "openai-agent-txt.json").read_text(encoding="utf-8"))
+    data["openai_config"].update(openai_config)
+    return data
+
+
+@pytest.fixture
+def make_agent():
+    def factory(**openai_config: Any) -> AgentConfig:
+        return AgentConfig(**agent_data(**openai_config))
+    return factory
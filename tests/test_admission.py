@@ -0,0 +1,116 @@
+import asyncio
+
+import httpx
+import pytest
+
+from app.admission import AdmissionController, ConcurrencyLimiter, OverloadedError
+from app.agent_store import UpstreamProfile
+from app.chat_service import ChatService
+from app.models import AgentConfig, ChatResponse
+from tests.conftest import agent_data
+
+
+def limiter(max_concurrent=1, max_queue=1, queue_timeout=1.0):
+    return ConcurrencyLimiter("agent", "agente", max_concurrent, max_queue, queue_timeout, retry_after=3)
+
+
+def test_full_queue_is_rejected_at_once():
+    async def run():
+        slots = limiter(max_queue=1)
+        await slots.acquire()
+        queued = asyncio.create_task(slots.acquire())
+        await asyncio.sleep(0)
+        with pytest.raises(OverloadedError) as error:
+            await slots.acquire()
+        assert error.value.retry_after == 3
+        assert slots.stats()["queue_depth"] == 1 and slots.rejected == 1
+        # Al liberar, el hueco pasa directamente a la petición en cola
+        slots.release()
+        await queued
+        assert slots.active == 1 and slots.admitted == 2
+    asyncio.run(run())
+
+
+def test_queue_timeout_is_rejected():
+    async def run():
+        slots = limiter(queue_timeout=0.01)
+        await slots.acquire()
+        with pytest.raises(OverloadedError):
+            await slots.acquire()
+        assert slots.timeouts == 1 and slots.stats()["queue_depth"] == 0
+        slots.release()
+        assert slots.active == 0
+    asyncio.run(run())
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def run():
+        slots = limiter()
+        await slots.acquire()
+        queued = asyncio.create_task(slots.acquire())
+        await asyncio.sleep(0)
+        queued.cancel()  # El cliente se desconecta mientras espera
+        with pytest.raises(asyncio.CancelledError):
+            await queued
+        assert slots.stats()["queue_depth"] == 0
+        slots.release()
+        assert slots.active == 0
+    asyncio.run(run())
+
+
+def test_rejected_upstream_releases_agent_slot():
+    data = agent_data()
+    data["concurrency"] = {"max_concurrent": 5, "upstream_max_concurrent": 1, "upstream_max_queue": 0}
+    agent = AgentConfig(**data)
+    controller = AdmissionController()
+    controller.configure([UpstreamProfile.from_agent(agent)])
+
+    async def run():
+        ticket = await controller.acquire(agent)
+        with pytest.raises(OverloadedError) as error:
+            await controller.acquire(agent)
+        assert error.value.scope == "upstream"
+        stats = controller.stats()
+        assert stats["agents"][agent.id]["active"] == 1
+        ticket.release()
+        ticket.release()  # Idempotente
+        assert controller.stats()["agents"][agent.id]["active"] == 0
+    asyncio.run(run())
+
+
+def test_chat_endpoint_returns_429_with_retry_after(monkeypatch):
+    from app import main
+    from app.admission import admission
+
+    data = agent_data()
+    data["id"] = "agente-429"
+    data["concurrency"] = {"max_concurrent": 1, "max_queue": 0, "retry_after": 7}
+    agent = AgentConfig(**data)
+
+    async def get_agent_async(agent_id):
+        return agent
+    monkeypatch.setattr(main.config_manager, "get_agent_async", get_agent_async)
+    release = asyncio.Event()
+
+    async def send_message(agent, message):
+        await release.wait()
+        return ChatResponse(response="ok")
+    monkeypatch.setattr(ChatService, "send_message", staticmethod(send_message))
+
+    async def run():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            first = asyncio.create_task(client.post(f"/chat/{agent.id}", json={"message": "hola"}))
+            while admission.stats()["agents"].get(agent.id, {}).get("active") != 1:
+                await asyncio.sleep(0.001)
+            rejected = await client.post(f"/chat/{agent.id}", json={"message": "hola"})
+            release.set()
+            return (await first), rejected
+
+    try:
+        first, rejected = asyncio.run(run())
+    finally:
+        admission.forget([agent.id])
+    assert first.status_code == 200 and first.json()["response"] == "ok"
+    assert rejected.status_code == 429
+    assert rejected.headers["Retry-After"] == "7"
@@ -0,0 +1,76 @@
+import asyncio
+import sqlite3
+import threading
+from pathlib import Path
+from unittest import mock
+
+import pytest
+
+import app.agent_store as agent_store
+from app.agent_store import JsonAgentStore, SQLiteAgentStore
+
+AGENTS_DIR = Path(__file__).resolve().parent.parent / "app" / "agents"
+
+
+def test_sqlite_upstreams_without_parsing_agents(tmp_path):
+    db = tmp_path / "agents.db"
+    store = SQLiteAgentStore(db)
+    store.import_directory(AGENTS_DIR)
+    store.close()
+    expected = sorted(JsonAgentStore(AGENTS_DIR).iter_upstreams())
+
+    # Arrancar y configurar pools y limitadores no parsea ninguna configuración
+    with mock.patch.object(agent_store, "AgentConfig", side_effect=AssertionError("configuración parseada")):
+        store = SQLiteAgentStore(db)
+        assert sorted(store.iter_upstreams()) == expected
+    store.close()
+
+
+def test_sqlite_migrates_missing_upstream_column(tmp_path):
+    db = tmp_path / "agents.db"
+    store = SQLiteAgentStore(db)
+    store.import_directory(AGENTS_DIR)
+    expected = sorted(store.iter_upstreams())
+    store.close()
+    conn = sqlite3.connect(db)
+    conn.execute("UPDATE agents SET upstream = NULL")
+    conn.commit()
+    conn.close()
+
+    store = SQLiteAgentStore(db)
+    assert sorted(store.iter_upstreams()) == expected
+    store.close()
+
+
+def test_incomplete_store_fails_at_construction():
+    class PartialStore(agent_store.AgentStore):
+        def get(self, agent_id):
+            return None
+
+    with pytest.raises(TypeError):
+        PartialStore()
+
+
+def test_sqlite_get_async_loads_misses_off_the_event_loop(tmp_path):
+    store = SQLiteAgentStore(tmp_path / "agents.db")
+    store.import_directory(AGENTS_DIR)
+    threads = []
+    load_agent = agent_store.load_agent
+
+    def record_thread(data):
+        threads.append(threading.get_ident())
+        return load_agent(data)
+
+    async def run():
+        with mock.patch.object(agent_store, "load_agent", side_effect=record_thread):
+            first = await store.get_async("openai-agent-txt")
+            second = await store.get_async("openai-agent-txt")
+            missing = await store.get_async("no-existe")
+        return first, second, missing
+
+    first, second, missing = asyncio.run(run())
+    assert first is second and first.id == "openai-agent-txt" and missing is None
+    # Solo el fallo de la LRU parsea, y lo hace en un hilo
+    assert len(threads) == 1 and threads[0] != threading.get_ident()
+    assert store.get_template(first) is store.get_template(first)
+    store.close()
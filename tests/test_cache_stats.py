@@ -0,0 +1,36 @@
+import asyncio
+
+import httpx
+
+from app import main
+from app.answer_cache import answer_cache
+from app.embedding_cache import EmbeddingCache
+from app.search_cache import search_cache
+
+
+def test_every_cache_exposes_hits_and_misses():
+    for cache in (EmbeddingCache(), search_cache, answer_cache):
+        stats = cache.stats()
+        assert isinstance(stats["hits"], int) and isinstance(stats["misses"], int)
+
+
+def test_embedding_hits_include_every_tier():
+    cache = EmbeddingCache()
+    cache.put("deployment", "hola", [1.0, 2.0])
+    assert cache.get("deployment", "hola") == [1.0, 2.0]
+    assert cache.get("deployment", "adios") is None
+    cache.disk_hits = 2  # Aciertos del segundo nivel, que la LRU contó como fallos
+    cache._memory.misses += 2
+    stats = cache.stats()
+    assert (stats["hits"], stats["memory_hits"], stats["misses"]) == (3, 1, 1)
+
+
+def test_prometheus_reports_cache_hits():
+    async def run():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.get("/metrics/prometheus")
+    response = asyncio.run(run())
+    assert response.status_code == 200
+    for cache in ("embedding", "search", "answer"):
+        assert f'agentclic_cache_hits_total{{cache="{cache}"}}' in response.text
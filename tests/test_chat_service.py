@@ -0,0 +1,64 @@
+import asyncio
+
+from app.answer_cache import AnswerCache
+from app.chat_service import ChatService
+from app.models import AgentConfig, ChatMessage, ChatResponse
+from tests.conftest import agent_data
+
+
+def faq_agent():
+    data = agent_data(temperature=0.0)
+    data["answer_cache"] = {"enabled": True}
+    return AgentConfig(**data)
+
+
+def test_answer_cache_hits_do_not_reuse_response_id():
+    agent = faq_agent()
+    cache = AnswerCache()
+    first = ChatMessage(message="¿Horario?", conversation_id="visitante-1")
+    other = ChatMessage(message="¿horario?", conversation_id="visitante-2")
+
+    async def run():
+        await cache.set(agent, first, ChatResponse(response="De 8 a 21", response_id="resp_1", conversation_id="visitante-1"))
+        return await cache.get(agent, other)
+
+    hit = asyncio.run(run())
+    assert hit.response == "De 8 a 21" and hit.conversation_id == "visitante-2"
+    assert hit.response_id is None
+
+
+def test_only_the_leader_keeps_the_coalesced_response_id(monkeypatch):
+    agent = AgentConfig(**agent_data())
+    release = asyncio.Event()
+
+    async def dispatch(agent, message):
+        await release.wait()
+        return ChatResponse(response="ok", response_id="resp_1", conversation_id=message.conversation_id)
+
+    async def events(agent, message):
+        await release.wait()
+        yield {"type": "done", "response": "ok", "response_id": "resp_1", "conversation_id": message.conversation_id}
+
+    monkeypatch.setattr(ChatService, "_dispatch_message", staticmethod(dispatch))
+    monkeypatch.setattr(ChatService, "_stream_events", staticmethod(events))
+
+    async def collect(conversation_id):
+        message = ChatMessage(message="hola", conversation_id=conversation_id)
+        return [event async for event in ChatService.stream_message(agent, message)][-1]
+
+    async def run():
+        leader = asyncio.create_task(ChatService.send_message(agent, ChatMessage(message="hola", conversation_id="a")))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(ChatService.send_message(agent, ChatMessage(message="Hola ", conversation_id="b")))
+        stream_leader = asyncio.create_task(collect("c"))
+        await asyncio.sleep(0)
+        stream_follower = asyncio.create_task(collect("d"))
+        await asyncio.sleep(0.01)
+        release.set()
+        return await asyncio.gather(leader, follower, stream_leader, stream_follower)
+
+    leader, follower, stream_leader, stream_follower = asyncio.run(run())
+    assert (leader.conversation_id, leader.response_id) == ("a", "resp_1")
+    assert (follower.conversation_id, follower.response_id) == ("b", None)
+    assert (stream_leader["conversation_id"], stream_leader["response_id"]) == ("c", "resp_1")
+    assert (stream_follower["conversation_id"], stream_follower["response_id"]) == ("d", None)
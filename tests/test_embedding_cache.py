@@ -0,0 +1,40 @@
+from array import array
+
+from app.embedding_cache import _DiskEmbeddingStore
+
+
+def test_disk_store_round_trip(tmp_path):
+    store = _DiskEmbeddingStore(tmp_path, ttl_seconds=None, max_bytes=1 << 20)
+    assert store.get("a") is None
+    store.append("a", array("f", [1.0, 2.0]))
+    store.append("b", array("f", [3.0, 4.0, 5.0]))
+    assert store.get("a").tolist() == [1.0, 2.0]
+    assert store.get("b").tolist() == [3.0, 4.0, 5.0]
+    store.close()
+
+    reopened = _DiskEmbeddingStore(tmp_path, ttl_seconds=None, max_bytes=1 << 20)
+    assert len(reopened) == 2 and reopened.get("b").tolist() == [3.0, 4.0, 5.0]
+
+
+def test_reads_do_not_wait_for_writers(tmp_path):
+    store = _DiskEmbeddingStore(tmp_path, ttl_seconds=None, max_bytes=1 << 20)
+    store.append("a", array("f", [1.0]))
+    with store._lock:  # Un append en curso en otro hilo
+        assert store.get("a").tolist() == [1.0]
+
+
+def test_previous_map_stays_readable_after_append(tmp_path):
+    store = _DiskEmbeddingStore(tmp_path, ttl_seconds=None, max_bytes=1 << 20)
+    store.append("a", array("f", [1.0]))
+    previous = store._mmap
+    store.append("b", array("f", [2.0]))
+    # Un lector que aún tenga el mmap anterior puede terminar su lectura
+    assert previous is not store._mmap and previous[:4] == array("f", [1.0]).tobytes()
+    assert store.get("b").tolist() == [2.0]
+
+
+def test_full_store_skips_appends(tmp_path):
+    store = _DiskEmbeddingStore(tmp_path, ttl_seconds=None, max_bytes=8)
+    store.append("a", array("f", [1.0, 2.0]))
+    store.append("b", array("f", [3.0]))
+    assert store.get("a").tolist() == [1.0, 2.0] and store.get("b") is None
@@ -0,0 +1,68 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from app.lexical_index import BM25Index, tokenize
+from app.local_index import LocalVectorIndex, write_index
+from app.models import AgentConfig
+from tests.conftest import agent_data
+
+METADATA = [
+    {"pregunta": "¿Dónde está la sala A-201?", "respuesta": "En la segunda planta"},
+    {"pregunta": "Horario de la biblioteca", "respuesta": "De 8:00 a 21:00"},
+    {"pregunta": "Préstamo de portátiles", "respuesta": "Escribe a prestamos@example.com"},
+]
+# Vectores ortogonales: la similitud coseno de cada query se controla con sus componentes
+VECTORS = np.eye(3, 4, dtype=np.float32)
+
+
+@pytest.fixture
+def index(tmp_path):
+    write_index(tmp_path, ["sala", "horario", "prestamo"], VECTORS, METADATA, "test")
+    return LocalVectorIndex(tmp_path)
+
+
+def scores(results):
+    return {result["id"]: result["score"] for result in results}
+
+
+def test_tokenize_keeps_compound_terms():
+    assert tokenize("Sala A-201, préstamos@example.com") == [
+        "sala", "a-201", "201", "prestamos@example.com", "prestamos", "example", "com"
+    ]
+
+
+def test_hybrid_fuses_cosine_and_normalized_bm25(index):
+    query_vector = [0.0, 0.8, 0.6, 0.0]
+    results = index.search_hybrid(query_vector, "sala A-201", top_k=3, vector_weight=0.5)
+    # Única coincidencia léxica: BM25 normalizado 1 y coseno 0
+    assert results[0]["id"] == "sala"
+    assert scores(results) == pytest.approx({"sala": 0.5, "horario": 0.4, "prestamo": 0.3})
+    assert results[0]["metadata"] == METADATA[0]
+
+
+def test_hybrid_scale_does_not_depend_on_lexical_hits(index):
+    query_vector = [0.0, 0.8, 0.0, 0.6]
+    without_hits = scores(index.search_hybrid(query_vector, "zzz", top_k=3, vector_weight=0.5))
+    with_hit = scores(index.search_hybrid(query_vector, "portátiles", top_k=3, vector_weight=0.5))
+    # El coseno se pondera igual haya o no coincidencias léxicas
+    assert without_hits["horario"] == pytest.approx(0.4)
+    assert with_hit["horario"] == pytest.approx(0.4)
+    assert with_hit["prestamo"] == pytest.approx(0.5)
+
+
+def test_vector_search_matches_cosine(index):
+    results = index.search([0.0, 0.0, 2.0, 0.0], top_k=2)
+    assert results[0] == {"id": "prestamo", "score": pytest.approx(1.0), "metadata": METADATA[2]}
+
+
+def test_bm25_prefers_rarer_terms():
+    bm25 = BM25Index.build(["sala A-201 planta", "sala de estudio", "sala de grupos"])
+    ranked = bm25.scores("sala A-201")
+    assert max(ranked, key=ranked.get) == 0
+
+
+def test_hybrid_requires_local_index():
+    with pytest.raises(ValueError, match="local_index"):
+        AgentConfig(**agent_data(search_mode="hybrid", pinecone_index="faqs"))
+    AgentConfig(**agent_data(search_mode="hybrid", local_index="app/indexes/faqs"))
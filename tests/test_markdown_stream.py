@@ -0,0 +1,44 @@
+import json
+import random
+
+import pytest
+
+from app.markdown_stream import MarkdownStreamConverter, convert_markdown_to_html
+from benchmarks.markdown_bench import GOLDEN_FILE, convert_in_chunks, legacy_convert_markdown_to_html
+
+CASES = json.loads(GOLDEN_FILE.read_text(encoding="utf-8"))
+
+
+@pytest.mark.parametrize("case", CASES, ids=[case["name"] for case in CASES])
+def test_golden_corpus(case):
+    assert legacy_convert_markdown_to_html(case["markdown"]) == case["html"]
+    assert convert_markdown_to_html(case["markdown"]) == case["html"]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 5, 7, 64])
+@pytest.mark.parametrize("case", CASES, ids=[case["name"] for case in CASES])
+def test_golden_corpus_in_chunks(case, chunk_size):
+    assert convert_in_chunks(case["markdown"], chunk_size) == case["html"]
+
+
+def _random_split(text: str, rng: random.Random):
+    start = 0
+    while start < len(text):
+        end = start + rng.randint(0, 12)
+        yield text[start:end]
+        start = end
+
+
+def _random_markdown(rng: random.Random) -> str:
+    pieces = ["texto", " ", "\n", "\n\n", "  ", "- ", "* ", "**", "*", "[enlace](example.com)",
+              "[a](https://example.com/x)", "[", "]", "(", ")", "<br>", "ñ", "A-201"]
+    return "".join(rng.choice(pieces) for _ in range(rng.randint(0, 60)))
+
+
+def test_random_markdown_matches_regex_converter():
+    rng = random.Random(2024)
+    for _ in range(2000):
+        text = _random_markdown(rng)
+        converter = MarkdownStreamConverter()
+        html = "".join(converter.feed(chunk) for chunk in _random_split(text, rng)) + converter.finish()
+        assert html == legacy_convert_markdown_to_html(text), repr(text)
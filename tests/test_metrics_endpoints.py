@@ -0,0 +1,41 @@
+import asyncio
+import threading
+
+import httpx
+
+from app import main
+from app.metrics_service import metrics_service
+
+
+def get(path):
+    async def run():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.get(path)
+    return asyncio.run(run())
+
+
+def test_segment_listing_runs_off_the_event_loop(monkeypatch):
+    threads = []
+    segments = [{"name": "messages-2026-10-16.csv.gz", "date": "2026-10-16", "bytes": 10}]
+
+    def list_segments():
+        threads.append(threading.get_ident())
+        return segments
+
+    monkeypatch.setattr(metrics_service, "list_segments", list_segments)
+    monkeypatch.setattr(metrics_service, "flush", lambda: None)
+    monkeypatch.setattr(metrics_service, "iter_csv", lambda *args: iter(["fecha_hora\n"]))
+
+    assert get("/metrics/segments").json() == {"segments": segments}
+    download = get("/metrics/download")
+    assert download.status_code == 200 and download.text == "fecha_hora\n"
+    # El CSV se genera al vuelo: los clientes no deben pedir rangos
+    assert download.headers["accept-ranges"] == "none"
+    assert len(threads) == 2 and threading.get_ident() not in threads
+
+
+def test_download_without_segments_is_404(monkeypatch):
+    monkeypatch.setattr(metrics_service, "list_segments", lambda: [])
+    monkeypatch.setattr(metrics_service, "flush", lambda: None)
+    assert get("/metrics/download").status_code == 404
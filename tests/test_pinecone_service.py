@@ -0,0 +1,60 @@
+import asyncio
+import threading
+
+from app.pinecone_service import PineconeService
+
+
+class SlowIndex:
+    def __init__(self):
+        self.release = threading.Event()
+
+    def query(self, **kwargs):
+        self.release.wait(5)
+        return {"matches": []}
+
+
+def test_cancelled_query_leaves_the_queue(monkeypatch):
+    service = PineconeService()
+    service.max_workers = 1
+    index = SlowIndex()
+    monkeypatch.setattr(service, "get_index", lambda name: index)
+
+    async def run():
+        running = asyncio.create_task(service.query("faq", [0.0], 3))
+        queued = asyncio.create_task(service.query("faq", [0.0], 3))
+        await asyncio.sleep(0.05)
+        assert service.stats()["queue_depth"] == 1 and service.stats()["in_flight"] == 1
+        queued.cancel()
+        await asyncio.sleep(0)
+        assert service.stats()["queue_depth"] == 0
+        index.release.set()
+        assert await running == {"matches": []}
+
+    try:
+        asyncio.run(run())
+    finally:
+        service.shutdown()
+    assert service.stats()["queue_depth"] == 0 and service.stats()["in_flight"] == 0
+
+
+def test_connecting_to_an_index_does_not_block_stats(monkeypatch):
+    service = PineconeService()
+    connecting = threading.Event()
+    release = threading.Event()
+
+    class Client:
+        def Index(self, name):
+            connecting.set()
+            release.wait(5)
+            return SlowIndex()
+
+    monkeypatch.setattr(service, "_get_client", lambda: Client())
+    thread = threading.Thread(target=service.get_index, args=("faq",))
+    thread.start()
+    try:
+        assert connecting.wait(5)
+        assert service.stats()["cached_indexes"] == []  # No espera a la conexión en curso
+    finally:
+        release.set()
+        thread.join()
+    assert service.stats()["cached_indexes"] == ["faq"]
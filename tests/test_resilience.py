@@ -0,0 +1,106 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from app.http_pool import http_pool
+from app.models import ResilienceConfig
+from app.resilience import CircuitBreaker, CircuitOpenError, ResilientCaller
+
+URL = "http://upstream.test/openai/v1/responses"
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """Upstream simulado: responde con los códigos de 'statuses' (el último se repite) y cuenta las peticiones"""
+    state = {"statuses": [200], "calls": 0}
+
+    def handler(request):
+        state["calls"] += 1
+        statuses = state["statuses"]
+        return httpx.Response(statuses.pop(0) if len(statuses) > 1 else statuses[0])
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(http_pool, "get_client", lambda url: client)
+    return state
+
+
+def post(caller, config, idempotent=False, name="agente"):
+    async def run():
+        response = await caller.request(name, "openai", config, "POST", URL, idempotent=idempotent, content=b"{}")
+        return response.status_code
+    return asyncio.run(run())
+
+
+def test_breaker_opens_and_half_opens():
+    config = ResilienceConfig(breaker_failures=3, breaker_reset_timeout=0.05)
+    breaker = CircuitBreaker()
+    for _ in range(2):
+        assert breaker.allow(config)
+        assert not breaker.record_failure(config)
+    assert breaker.state == "closed"
+    assert breaker.record_failure(config)
+    assert breaker.state == "open" and not breaker.allow(config)
+
+    time.sleep(0.06)
+    # Pasado el margen solo pasa una petición de prueba
+    assert breaker.allow(config) and breaker.state == "half_open"
+    assert not breaker.allow(config)
+    # Si la prueba falla se vuelve a abrir; si va bien se cierra
+    assert breaker.record_failure(config) and breaker.state == "open"
+    time.sleep(0.06)
+    assert breaker.allow(config)
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.allow(config)
+
+
+def test_open_circuit_rejects_without_calling_upstream(upstream):
+    config = ResilienceConfig(retries=0, breaker_failures=2, breaker_reset_timeout=0.05)
+    upstream["statuses"] = [500]
+    caller = ResilientCaller()
+    assert post(caller, config) == 500
+    assert post(caller, config) == 500
+    with pytest.raises(CircuitOpenError):
+        post(caller, config)
+    assert upstream["calls"] == 2
+
+    time.sleep(0.06)
+    upstream["statuses"] = [200]
+    assert post(caller, config) == 200
+    assert caller.stats()["agente"]["state"] == "closed"
+
+
+def test_non_idempotent_post_not_retried_after_server_error(upstream):
+    config = ResilienceConfig(retries=2, retry_backoff=0.0, breaker_failures=0)
+    upstream["statuses"] = [500, 200]
+    assert post(ResilientCaller(), config) == 500
+    assert upstream["calls"] == 1
+
+
+def test_not_processed_status_retried_even_if_not_idempotent(upstream):
+    config = ResilienceConfig(retries=2, retry_backoff=0.0, breaker_failures=0)
+    upstream["statuses"] = [503, 200]
+    assert post(ResilientCaller(), config) == 200
+    assert upstream["calls"] == 2
+
+
+def test_idempotent_call_retried_after_server_error(upstream):
+    config = ResilienceConfig(retries=2, retry_backoff=0.0, breaker_failures=0)
+    upstream["statuses"] = [500, 200]
+    assert post(ResilientCaller(), config, idempotent=True) == 200
+    assert upstream["calls"] == 2
+
+
+def test_total_timeout_bounds_a_slow_attempt(monkeypatch):
+    async def handler(request):
+        await asyncio.sleep(1.0)  # Más que total_timeout, menos que read_timeout
+        return httpx.Response(200)
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(http_pool, "get_client", lambda url: client)
+    config = ResilienceConfig(read_timeout=5.0, total_timeout=0.1, retries=2, breaker_failures=0)
+    started = time.monotonic()
+    with pytest.raises(httpx.ReadTimeout):
+        post(ResilientCaller(), config, idempotent=True)
+    assert time.monotonic() - started < 0.5
@@ -0,0 +1,52 @@
+import asyncio
+import threading
+
+import httpx
+
+from app import main
+from app.search_cache import search_cache
+from app.shared_state import shared_store
+
+
+def flush(params=None, headers=None):
+    async def run():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post("/cache/search/flush", params=params, headers=headers)
+    return asyncio.run(run())
+
+
+def test_flush_in_memory():
+    key = search_cache.make_key("faq", None, "horario", 3)
+    search_cache.set(key, "resultados")
+    assert search_cache.get(key) == "resultados"
+    response = flush({"index": "faq"})
+    assert response.status_code == 200 and response.json()["entries_removed"] == 1
+    assert search_cache.get(key) is None
+
+
+def test_shared_flush_runs_off_the_event_loop(tmp_path, monkeypatch):
+    monkeypatch.setattr(shared_store, "path", tmp_path / "shared.db")
+    threads = []
+    original = search_cache.flush
+
+    def record_thread(index_name=None):
+        threads.append(threading.get_ident())
+        return original(index_name)
+
+    monkeypatch.setattr(search_cache, "flush", record_thread)
+    key = search_cache.make_key("faq", None, "horario", 3)
+    shared_store.set("search", search_cache._shared_key(key), b"resultados", tag="faq")
+    try:
+        response = flush({"index": "faq"})
+    finally:
+        shared_store.close()
+    assert response.json()["entries_removed"] == 1
+    assert threads and threads[0] != threading.get_ident()
+
+
+def test_flush_requires_admin_token_when_configured(monkeypatch):
+    monkeypatch.setattr(main, "ADMIN_TOKEN", "secreto")
+    assert flush().status_code == 401
+    assert flush(headers={"X-Admin-Token": "otro"}).status_code == 401
+    assert flush(headers={"X-Admin-Token": "secreto"}).status_code == 200
@@ -0,0 +1,47 @@
+import sqlite3
+import time
+
+import pytest
+
+from app.shared_state import SharedStore
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setenv("SHARED_STATE_DIR", str(tmp_path))
+    store = SharedStore()
+    yield store
+    store.close()
+
+
+def test_get_and_items(store):
+    store.set("search", "a", b"1", ttl_seconds=60)
+    store.set("search", "b", b"2", ttl_seconds=-1)
+    assert store.get("search", "a") == b"1"
+    assert store.get("search", "b") is None
+    assert store.items("search") == [("a", b"1")]
+
+
+def test_reads_do_not_wait_for_the_write_lock(store):
+    store.set("search", "a", b"1")
+    with store._lock:  # Una escritura en curso en otro hilo
+        assert store.get("search", "a") == b"1"
+
+
+def test_locked_database_is_a_miss(store):
+    store.set("search", "a", b"1")
+    store.close()  # El modo exclusivo exige que no haya otras conexiones abiertas
+    other = sqlite3.connect(str(store.path), isolation_level=None)
+    other.execute("PRAGMA locking_mode=EXCLUSIVE")
+    other.execute("BEGIN EXCLUSIVE")
+    other.execute("DELETE FROM entries")
+    try:
+        started = time.monotonic()
+        assert store.get("search", "a") is None
+        assert store.items("search") == []
+        assert time.monotonic() - started < 1.0
+        assert store.busy == 2 and store.errors == 0
+    finally:
+        other.execute("ROLLBACK")
+        other.close()
+    assert store.get("search", "a") == b"1"
@@ -0,0 +1,146 @@
+import asyncio
+
+import pytest
+
+from app.single_flight import SingleFlight
+
+
+@pytest.fixture
+def flight(monkeypatch):
+    monkeypatch.setenv("SINGLE_FLIGHT", "true")
+    return SingleFlight()
+
+
+class Work:
+    """Trabajo que espera a 'release' y registra si llegó a ejecutarse, terminar o cancelarse"""
+
+    def __init__(self, result="ok"):
+        self.result = result
+        self.release = asyncio.Event()
+        self.started = 0
+        self.cancelled = False
+
+    async def __call__(self):
+        self.started += 1
+        try:
+            await self.release.wait()
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        if isinstance(self.result, Exception):
+            raise self.result
+        return self.result
+
+
+async def settle():
+    for _ in range(3):
+        await asyncio.sleep(0)
+
+
+def test_identical_calls_share_one_execution(flight):
+    async def run():
+        work = Work()
+        tasks = [asyncio.create_task(flight.do("embedding", "hola", work)) for _ in range(3)]
+        await settle()
+        work.release.set()
+        assert await asyncio.gather(*tasks) == ["ok"] * 3
+        assert work.started == 1
+        assert flight.stats()["groups"]["embedding"] == {"calls": 1, "coalesced": 2, "coalesced_ratio": 0.6667}
+        assert flight.stats()["in_flight"] == 0
+    asyncio.run(run())
+
+
+def test_errors_reach_every_waiter(flight):
+    async def run():
+        work = Work(result=RuntimeError("upstream caído"))
+        tasks = [asyncio.create_task(flight.do("search", "q", work)) for _ in range(2)]
+        await settle()
+        work.release.set()
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        assert all(isinstance(result, RuntimeError) for result in results)
+    asyncio.run(run())
+
+
+def test_leader_leaving_does_not_cancel_followers(flight):
+    async def run():
+        work = Work()
+        leader = asyncio.create_task(flight.do("embedding", "hola", work))
+        await settle()
+        follower = asyncio.create_task(flight.do("embedding", "hola", work))
+        await settle()
+        leader.cancel()
+        await settle()
+        assert not work.cancelled
+        work.release.set()
+        assert await follower == "ok"
+        assert leader.cancelled() and work.started == 1
+    asyncio.run(run())
+
+
+def test_work_is_cancelled_when_all_waiters_leave(flight):
+    async def run():
+        work = Work()
+        tasks = [asyncio.create_task(flight.do("embedding", "hola", work)) for _ in range(2)]
+        await settle()
+        for task in tasks:
+            task.cancel()
+        await settle()
+        assert work.cancelled
+        assert flight.stats()["in_flight"] == 0
+        # La clave se ha olvidado: una nueva petición vuelve a ejecutar el trabajo
+        again = Work()
+        again.release.set()
+        assert await flight.do("embedding", "hola", again) == "ok"
+        assert again.started == 1
+    asyncio.run(run())
+
+
+def test_stream_replays_events_to_late_joiners(flight):
+    async def run():
+        release = asyncio.Event()
+        started = []
+
+        async def produce():
+            started.append(True)
+            yield "a"
+            await release.wait()
+            yield "b"
+
+        async def consume():
+            return [event async for event in flight.stream("message", "hola", produce)]
+
+        first = asyncio.create_task(consume())
+        await settle()
+        late = asyncio.create_task(consume())
+        await settle()
+        release.set()
+        assert await first == ["a", "b"]
+        assert await late == ["a", "b"]
+        assert len(started) == 1
+    asyncio.run(run())
+
+
+def test_stream_is_cancelled_when_all_consumers_leave(flight):
+    async def run():
+        cancelled = asyncio.Event()
+
+        async def produce():
+            yield "a"
+            try:
+                await asyncio.Event().wait()
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+            yield "b"
+
+        streams = [flight.stream("message", "hola", produce) for _ in range(2)]
+        for stream in streams:
+            assert await stream.__anext__() == "a"
+        await streams[0].aclose()
+        await settle()
+        assert not cancelled.is_set()
+        await streams[1].aclose()
+        await settle()
+        assert cancelled.is_set()
+        assert flight.stats()["in_flight"] == 0
+    asyncio.run(run())
@@ -0,0 +1,92 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+from app.agent_store import load_agent
+from app.tools import ToolEngine, ToolRegistry, UNKNOWN_TOOL
+from tests.conftest import agent_data
+
+CALLS = []
+
+
+async def echo(arguments, agent):
+    CALLS.append(arguments)
+    return {"echo": arguments}
+
+
+def function_call(name, arguments=None):
+    return {"type": "function_call", "name": name, "call_id": "call_1", "arguments": json.dumps(arguments or {})}
+
+
+def run_call(engine, agent, name, arguments=None):
+    outputs = asyncio.run(engine.execute([function_call(name, arguments)], agent))
+    return json.loads(outputs[0]["output"])
+
+
+@pytest.fixture
+def engine():
+    CALLS.clear()
+    return ToolEngine(ToolRegistry())
+
+
+def test_model_cannot_call_module_path(engine, make_agent):
+    agent = make_agent()
+    for name in ("builtins:print", "tests.test_tools:echo", "os:getcwd"):
+        assert run_call(engine, agent, name, {"x": 1}) == {"error": f"La tool '{name}' no está disponible"}
+    assert CALLS == []
+    # Nada se registra ni se cachea con los nombres del modelo
+    assert engine.registry.get("tests.test_tools:echo") is None
+    assert set(engine.registry.stats()) == {UNKNOWN_TOOL}
+    assert engine.registry.stats()[UNKNOWN_TOOL]["errors"] == 3
+
+
+def test_imported_handler_not_callable_by_its_path(engine, make_agent):
+    tool = {"type": "function", "name": "eco", "parameters": {}, "handler": "tests.test_tools:echo"}
+    agent = make_agent(tools=[tool])
+    engine.prepare(agent)
+    assert run_call(engine, agent, "eco", {"a": 1}) == {"echo": {"a": 1}}
+    # Aunque el handler ya esté importado, el modelo no puede llamarlo por su ruta
+    assert "error" in run_call(engine, agent, "tests.test_tools:echo")
+
+
+def test_registered_handler_by_name(engine, make_agent):
+    engine.registry.register("eco", echo)
+    assert run_call(engine, make_agent(), "eco", {"b": 2}) == {"echo": {"b": 2}}
+
+
+def test_invalid_handler_rejected_at_config_load():
+    tool = {"type": "function", "name": "eco", "parameters": {}, "handler": "tests.test_tools:no_existe"}
+    with pytest.raises(ValueError, match="no_existe"):
+        load_agent(agent_data(tools=[tool]))
+
+
+def slow_sync(arguments, agent):
+    time.sleep(arguments["seconds"])
+    return {"estado": "listo"}
+
+
+def test_sync_handler_runs_in_a_thread_with_timeout(engine, make_agent):
+    engine.registry.register("lenta", slow_sync)
+    agent = make_agent(tool_call_timeout=0.05)
+
+    async def run():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        task = asyncio.create_task(ticker())
+        outputs = await engine.execute([function_call("lenta", {"seconds": 0.3})], agent)
+        task.cancel()
+        return json.loads(outputs[0]["output"]), ticks
+
+    output, ticks = asyncio.run(run())
+    assert output == {"error": "La tool 'lenta' superó el tiempo máximo de 0.05 segundos"}
+    assert ticks >= 2  # El event loop siguió atendiendo mientras el handler estaba bloqueado
+    assert engine.registry.stats()["lenta"]["timeouts"] == 1
+    assert run_call(engine, agent, "lenta", {"seconds": 0}) == {"estado": "listo"}